@@ -6,26 +6,51 @@ Set of programs to read and interact with output from Bifrost
 import os
 import ast
 import time
+import queue
 import weakref
 import warnings
 import functools
+import threading
 import collections
+import multiprocessing
 from glob import glob
+from multiprocessing import shared_memory
 
 # import external public modules
 import numpy as np
-from scipy import interpolate
-from scipy.ndimage import map_coordinates
 
-from . import document_vars, file_memory, load_fromfile_quantities, stagger, tools, units
+from . import (
+    document_vars,
+    file_memory,
+    lazy_var,
+    load_fromfile_quantities,
+    quant_planner,
+    snap_index,
+    stagger,
+    tools,
+    units,
+)
 from .load_arithmetic_quantities import *
 # import internal modules
 from .load_quantities import *
 from .tools import *
 
+# import external public modules which are slow to import, only when first used.
+ndimage = tools.lazy_import('scipy.ndimage')
+
 # defaults
 whsp = '  '
 AXES = ('x', 'y', 'z')
+SLICE_HALO_NOPS = 4  # number of chained stagger operations covered by the default slice_halo.
+GET_VARS_NPLANS = 10  # number of plans which get_vars remembers, to re-use for later calls.
+# attrs which get_varTime(workers=N) copies from obj to the reader in each worker process.
+# (the fluids too, e.g. after EbysusData.set_mfi. attrs which obj doesn't have are skipped.)
+VARTIME_WORKER_ATTRS = ('do_stagger', 'stagger_kind', 'slice_halo', 'units_output', 'squeeze_output',
+                        'internal_means', 'lowbus', 'numThreads', 'match_type', 'read_mode',
+                        'mesh_location_tracking', 'sel_units', 'ifluid', 'jfluid')
+# start method for get_varTime(workers=N). (numba's parallel threading layer is not safe to use after 'fork'.)
+VARTIME_MP_START_METHOD = 'spawn'
+VARTIME_PREFETCH = 1  # default number of snaps which iter_varTime reads ahead, in a background thread.
 
 # BifrostData class
 
@@ -68,6 +93,9 @@ class BifrostData():
         operations layer by layer using threads (slower).
     numThreads - integer, optional
         number of threads for certain operations that use parallelism.
+        This one setting limits the threads used by the thread pool of the object (see tools.map_slabs),
+        the numba stagger functions, and scipy.fft, so that they don't oversubscribe the cores together.
+        1 (default) --> no thread pool; numba and scipy.fft use their own defaults.
     fast - whether to read data "fast", by only reading the requested data.
         implemented as a flag, with False as default, for backwards
         compatibility; some previous codes may have assumed non-requested
@@ -92,6 +120,29 @@ class BifrostData():
         False --> don't print stats.
         True  --> do print stats.
         dict  --> do print stats, passing this dictionary as kwargs.
+    slice_halo - None, int, or False, optional. default None
+        number of extra cells (on each side of iix, iiy, iiz) used while calculating
+        quantities on a sub-domain, if do_stagger. See self.slice_halo for details.
+        None  --> use enough cells for SLICE_HALO_NOPS chained stagger operations.
+        False --> always calculate on the full domain, slicing only at the end.
+    chunks - None, tuple, or 'auto', optional. default None
+        default for the chunks kwarg of get_var. if not None, get_var returns a lazy_var.LazyVar,
+        which calculates the quantity one block at a time. See help(self.get_var) for details.
+    chunks_max_MB - number, optional. default lazy_var.CHUNKS_MAX_MB
+        memory budget for each block, when chunks='auto'.
+    disk_cache - None, bool, string, or disk_cache.DiskCache, optional. default None
+        whether to remember results of get_var on disk, across python sessions.
+        None or False --> don't use a disk cache.
+        True --> use a disk cache in disk_cache.DISK_CACHE_DIR.
+        string --> use a disk cache in this directory.
+        See help(helita.sim.disk_cache) for details.
+    snap_index - None, bool, or string, optional. default None
+        whether to use an index of the metadata of all snapshots (params, times, mesh, file sizes),
+        so that set_snap and get_snaps don't need to re-read .idl and mesh files.
+        None or False --> don't use a snapshot index.
+        True --> store the index in snap_index.SNAP_INDEX_DIR.
+        string --> store the index in this file.
+        See help(helita.sim.snap_index) for details.
 
     Examples
     --------
@@ -112,6 +163,11 @@ class BifrostData():
     """
 
     ## CREATION ##
+    def __new__(cls, *args, **kwargs):
+        obj = super().__new__(cls)
+        obj._init_args = (args, kwargs)  # remember how obj was created. (e.g. for get_varTime with workers)
+        return obj
+
     def __init__(self, file_root, snap=None, meshfile=None, fdir='.',
                  fast=False, verbose=True, dtype='f4', big_endian=False,
                  cstagop=None, do_stagger=True, ghost_analyse=False, lowbus=False,
@@ -119,7 +175,9 @@ class BifrostData():
                  use_relpath=False, stagger_kind=stagger.DEFAULT_STAGGER_KIND,
                  units_output='simu', squeeze_output=False,
                  print_freq=2, printing_stats=False,
-                 iix=None, iiy=None, iiz=None):
+                 iix=None, iiy=None, iiz=None, slice_halo=None,
+                 chunks=None, chunks_max_MB=lazy_var.CHUNKS_MAX_MB, disk_cache=None,
+                 snap_index=None):
         """
         Loads metadata and initialises variables.
         """
@@ -140,6 +198,11 @@ class BifrostData():
         self.squeeze_output = squeeze_output
         self.print_freq = print_freq
         self.printing_stats = printing_stats
+        self.slice_halo = slice_halo
+        self.chunks = chunks
+        self.chunks_max_MB = chunks_max_MB
+        self.disk_cache = disk_cache
+        self.snap_index = snap_index
 
         # units. Two options for management. Should only use one at a time; leave the other at default value.
         self.units_output = units_output    # < units.py system of managing units.
@@ -178,7 +241,7 @@ class BifrostData():
         if 'tabinputfile' in self.params.keys():
             tabfile = os.path.join(self.fdir, self.get_param('tabinputfile').strip())
             if os.access(tabfile, os.R_OK):
-                self.rhoee = Rhoeetab(tabfile=tabfile, fdir=fdir, radtab=True, verbose=self.verbose)
+                self.rhoee = get_rhoeetab(tabfile=tabfile, fdir=fdir, radtab=True, verbose=self.verbose)
 
         self.stagger = stagger.StaggerInterface(self)
 
@@ -227,6 +290,32 @@ class BifrostData():
     def printing_stats(self, value):
         self._printing_stats = value
 
+    @property
+    def slice_halo(self):
+        '''number of extra cells used on each side of iix, iiy, iiz while calculating quantities.
+
+        When do_stagger, a request for a sub-domain (e.g. get_var('tg', iiz=5)) is calculated
+        on the sub-domain expanded by slice_halo cells in each sliced direction, then sliced
+        to the requested domain at the end. Each stagger operation only contaminates the
+        STENCIL_REACH cells nearest to the edge of the expanded domain, so the result is exact
+        as long as the quantity involves at most slice_halo / STENCIL_REACH chained operations
+        along any axis. For quantities with more chained operations, increase slice_halo.
+
+        Only contiguous slices are expanded; other iix (e.g. lists) use the full axis instead.
+        Periodic axes also use the full axis if the expanded domain would wrap around.
+
+        None (default) --> SLICE_HALO_NOPS * stagger.STENCIL_REACH[self.stagger_kind]
+        False --> always calculate on the full domain, slicing only at the end.
+        '''
+        halo = getattr(self, '_slice_halo', None)
+        if halo is None:
+            halo = SLICE_HALO_NOPS * stagger.STENCIL_REACH.get(self.stagger_kind, 3)
+        return halo
+
+    @slice_halo.setter
+    def slice_halo(self, value):
+        self._slice_halo = value
+
     stagger_kind = stagger.STAGGER_KIND_PROPERTY(internal_name='_stagger_kind')
 
     @property
@@ -395,8 +484,12 @@ class BifrostData():
             else:
                 filename.append(self.file_root + snap_str[i] + '.idl')
 
-        for file in filename:
-            self.paramList.append(read_idl_ascii(file, firstime=firstime, obj=self))
+        index = snap_index.get_snap_index(self)
+        for num, file in zip(snap, filename):
+            params = None if (index is None) else index.params(num)
+            if params is None:
+                params = read_idl_ascii(file, firstime=firstime, obj=self)
+            self.paramList.append(params)
 
         # assign some parameters as attributes
         for params in self.paramList:
@@ -496,23 +589,14 @@ class BifrostData():
             meshfile = os.path.join(
                 self.fdir, self.get_param('meshfile', error_prop=True).strip())
         if os.path.isfile(meshfile):
-            f = open(meshfile, 'r')
+            index = snap_index.get_snap_index(self)
+            mesh = None if (index is None) else index.mesh(meshfile)
+            if mesh is None:
+                mesh = read_mesh_ascii(meshfile)
             for p in ['x', 'y', 'z']:
-                dim = int(f.readline().strip('\n').strip())
-                assert dim == getattr(self, 'n' + p)
-                # quantity
-                setattr(self, p, np.array(
-                    [float(v) for v in f.readline().strip('\n').split()]))
-                # quantity "down"
-                setattr(self, p + 'dn', np.array(
-                    [float(v) for v in f.readline().strip('\n').split()]))
-                # up derivative of quantity
-                setattr(self, 'd%sid%sup' % (p, p), np.array(
-                    [float(v) for v in f.readline().strip('\n').split()]))
-                # down derivative of quantity
-                setattr(self, 'd%sid%sdn' % (p, p), np.array(
-                    [float(v) for v in f.readline().strip('\n').split()]))
-            f.close()
+                assert mesh['n' + p] == getattr(self, 'n' + p)
+                for attr in (p, p + 'dn', 'd%sid%sup' % (p, p), 'd%sid%sdn' % (p, p)):
+                    setattr(self, attr, np.array(mesh[attr], copy=True))
             if self.ghost_analyse:
                 # extend mesh to cover ghost zones
                 self.z = np.concatenate((self.z[0] - np.linspace(
@@ -575,7 +659,9 @@ class BifrostData():
             self.dzidzdn = np.zeros(self.nz) + 1. / self.dz
 
         for x in ('x', 'y', 'z'):
-            setattr(self, x, getattr(self, x)[getattr(self, 'ii'+x, slice(None))])
+            iix = getattr(self, 'ii'+x, slice(None))
+            for attr in (x, x+'dn', f'd{x}id{x}up', f'd{x}id{x}dn'):
+                setattr(self, attr, getattr(self, attr)[iix])
 
         for x in ('x', 'y', 'z'):
             xcoords = getattr(self, x)
@@ -740,14 +826,19 @@ class BifrostData():
             To set existing self.iix to slice(None), use iix=slice(None).
         iiy, iiz: similar to iix.
         internal: bool (default: False)
-            if internal and self.do_stagger, don't change slices.
+            if internal and self.do_stagger, use the requested slices plus a halo (see self.slice_halo),
+            at the outermost call to get_var; and don't change slices during internal calls.
             internal=True inside get_var.
 
         updates x, y, z, dx1d, dy1d, dz1d afterwards, if any domains were changed.
         '''
         if internal and self.do_stagger:
-            # we slice at the end, only. For now, set all to slice(None)
-            slices = (slice(None), slice(None), slice(None))
+            if self._getting_internal_var():
+                # keep the domain chosen by the outermost call to get_var.
+                slices = (None, None, None)
+            else:
+                # calculate on the requested domain plus a halo; slice the halo off at the end.
+                slices = self._slices_with_halo(iix, iiy, iiz)
         else:
             slices = (iix, iiy, iiz)
 
@@ -760,6 +851,69 @@ class BifrostData():
         if any_domain_changes:
             self.__read_mesh(self.meshfile, firstime=False)
 
+    def _slices_with_halo(self, iix=None, iiy=None, iiz=None):
+        '''returns slices of the domain on which to calculate a quantity
+        which will be sliced by iix, iiy, iiz.
+        Each contiguous slice is expanded by self.slice_halo cells on each side (staying within the domain).
+        Uses slice(None) for any slice which can't be expanded safely. See self.slice_halo for details.
+
+        iix: slice, int, list, array, or None (default)
+            None --> use self.iix (if it exists, else slice(None)).
+        iiy, iiz: similar to iix.
+        '''
+        halo = self.slice_halo
+        result = []
+        for x, ii in zip(AXES, (iix, iiy, iiz)):
+            if ii is None:
+                ii = getattr(self, 'ii'+x, slice(None))
+            if isinstance(ii, (int, np.integer)):
+                ii = slice(ii, ii+1)
+            if (halo is False) or (not isinstance(ii, slice)) or (ii.step not in (None, 1)):
+                result.append(slice(None))
+                continue
+            nx = getattr(self, 'n'+x+'b')
+            start, stop, _ = ii.indices(nx)
+            start, stop = start - halo, stop + halo
+            periodic_default = (stagger.PAD_DEFAULTS[x] == stagger.PAD_PERIODIC)
+            periodic = self.get_param('periodic_'+x, default=periodic_default)
+            if (start < 0 or stop > nx) and periodic:
+                result.append(slice(None))  # the expanded slice would wrap around the domain.
+                continue
+            start, stop = max(start, 0), min(stop, nx)
+            if (stop - start <= 5) or (stop - start >= nx):
+                # stagger.do skips axes with length 5 or less, so we can't use a window that small.
+                result.append(slice(None))
+            else:
+                result.append(slice(start, stop))
+        return tuple(result)
+
+    def _slice_from_window(self, val, window):
+        '''returns val sliced by self.iix, self.iiy, self.iiz, where val was calculated on window.
+        window should be the result of self._slices_with_halo().
+        If np.shape(val) doesn't match the shape of window, return val, unchanged.
+        '''
+        if all(w == slice(None) for w in window):
+            return val
+        wshape = tuple(len(range(*w.indices(getattr(self, 'n'+x+'b')))) for x, w in zip(AXES, window))
+        if np.shape(val) != wshape:
+            return val
+        for i, (x, w) in enumerate(zip(AXES, window)):
+            ii = getattr(self, 'ii'+x)
+            if w != slice(None):  # here, ii must be a contiguous slice (see _slices_with_halo).
+                start, stop, _ = ii.indices(getattr(self, 'n'+x+'b'))
+                ii = slice(start - w.start, stop - w.start)
+            val = val[(slice(None),)*i + (ii,)]
+        return val
+
+    def _full_domain(self):
+        '''returns context manager; get_var calls inside of it will calculate on the full domain.
+        Restores the original domain upon exiting the context.
+
+        Useful for quantities which depend on the whole domain (e.g. averages), if do_stagger,
+        since internal calls to get_var usually only calculate on the domain set by the outermost call.
+        '''
+        return _FullDomain(self)
+
     def genvar(self):
         '''
         Dictionary of original variables which will allow to convert to cgs.
@@ -777,7 +931,9 @@ class BifrostData():
         self.varn['by'] = 'by'
         self.varn['bz'] = 'bz'
 
+    @file_memory.with_caching(cache=False, check_cache=True, cache_with_nfluid=None)
     @document_vars.quant_tracking_top_level
+    @quant_planner.plan_tracking
     def _load_quantity(self, var, cgsunits=1.0, **kwargs):
         '''helper function for get_var; actually calls load_quantities for var.'''
         __tracebackhide__ = True  # hide this func from error traceback stack
@@ -798,7 +954,8 @@ class BifrostData():
 
         return val
 
-    def get_var(self, var, snap=None, *args, iix=None, iiy=None, iiz=None, printing_stats=None, **kwargs):
+    def get_var(self, var, snap=None, *args, iix=None, iiy=None, iiz=None, printing_stats=None,
+                chunks=None, **kwargs):
         """
         Reads a variable from the relevant files.
 
@@ -810,9 +967,22 @@ class BifrostData():
             Snapshot number to read. By default reads the loaded snapshot;
             if a different number is requested, will load that snapshot
             by running self.set_snap(snap).
+        chunks - None, False, tuple, or 'auto', optional
+            if provided, return a lazy_var.LazyVar instead of an array. The LazyVar calculates
+            var one block at a time (e.g. for a reduction, or to write to disk), so that
+            memory usage is capped by the block size instead of the size of the domain.
+            None  --> use self.chunks (default None --> return an array, as usual).
+            False --> return an array, as usual.
+            tuple --> shape of blocks, e.g. (None, None, 64). None --> don't split that axis.
+            'auto' --> choose the shape of blocks to use at most self.chunks_max_MB per block.
+            See help(helita.sim.lazy_var) for details.
 
         **kwargs go to load_..._quantities functions.
         """
+        if self._getting_lazy_var(chunks):
+            return lazy_var.LazyVar(self, var, self.chunks if chunks is None else chunks,
+                                    snap=snap, iix=iix, iiy=iiy, iiz=iiz, **kwargs)
+
         if self.verbose:
             print('(get_var): reading ', var, whsp*6, end="\r", flush=True)
 
@@ -856,6 +1026,68 @@ class BifrostData():
         val = self._get_var_postprocess(val, var=var, original_slice=original_slice, printing_stats=printing_stats)
         return val
 
+    def _getting_lazy_var(self, chunks=None):
+        '''returns whether get_var should return a LazyVar, for this value of chunks.
+        Internal calls to get_var never return a LazyVar.
+        '''
+        if chunks is None:
+            chunks = getattr(self, 'chunks', None)
+        return (chunks is not None) and (chunks is not False) and not self._getting_internal_var()
+
+    def plan_vars(self, vars, **kw__get_var):
+        '''returns a QuantPlan for getting all the vars in the list vars.
+        The plan discovers which intermediate quantities are shared between the vars,
+        so that each one is calculated only once while evaluating the plan.
+
+        Example:
+            plan = dd.plan_vars(['b2', 'rotbx', 'ux'])
+            result = plan.evaluate(snap=10)  # dict of {var: value}
+
+        **kw__get_var are passed to self.get_var for every var (e.g. iiz, ifluid).
+        See help(helita.sim.quant_planner) for more details.
+        '''
+        return quant_planner.QuantPlan(self, vars, **kw__get_var)
+
+    def get_vars(self, vars, snap=None, *, stack=False, preread=True, **kw__get_var):
+        '''gets all the vars in the list vars, at snap. returns dict of {var: value}.
+
+        Compared to calling get_var for each var:
+            - the snapshot is only set once.
+            - simple vars are all located first, then read into memory in on-disk order
+              (i.e. in a single pass through each file), if preread (default True).
+            - intermediate quantities shared by the vars are only calculated once.
+              (see self.plan_vars and helita.sim.quant_planner for details.)
+              The plan is remembered, and re-used when get_vars is called again with the same
+              vars, kwargs, and metadata (except snap and domain; see self._metadata), e.g. for another snap.
+
+        stack: bool, default False
+            if True, instead return np.stack of the results, in the same order as vars.
+            (all the vars must have the same shape for this to work.)
+        preread: bool, default True
+            whether to read the simple vars into memory first, in on-disk order.
+            if False, simple vars are read (via memmaps) only when they are used.
+
+        **kw__get_var go to get_var for every var (e.g. iiz, ifluid). (slices must be passed by keyword.)
+        '''
+        if (snap is not None) and not np.array_equal(snap, self.snap):
+            self.set_snap(snap)
+        # re-use the plan from a previous call with the same vars, kwargs, and metadata, if possible.
+        # (snap and the domain don't affect the graph, but other metadata (e.g. ifluid, do_stagger) might.)
+        metadata = {key: val for key, val in self._metadata().items()
+                    if key not in ('snap', 'snaps', 'iix', 'iiy', 'iiz')}
+        plan_id = (tuple(vars), repr(sorted(kw__get_var.items())), repr(sorted(metadata.items())))
+        plans = self.__dict__.setdefault('_get_vars_plans', collections.OrderedDict())
+        if plan_id in plans:
+            plan = plans[plan_id]
+        else:
+            plan = plans[plan_id] = self.plan_vars(vars, **kw__get_var)
+            while len(plans) > GET_VARS_NPLANS:
+                plans.popitem(last=False)
+        result = plan.evaluate(preread=preread)
+        if stack:
+            return np.stack([result[var] for var in vars])
+        return result
+
     def _get_var_postprocess(self, val, var='', printing_stats=None, original_slice=[slice(None) for x in ('x', 'y', 'z')]):
         '''does post-processing for get_var.
         This includes:
@@ -894,7 +1126,9 @@ class BifrostData():
 
         # set original_slice if do_stagger and we are at the outermost layer.
         if self.do_stagger and not self._getting_internal_var():
+            window = (self.iix, self.iiy, self.iiz)
             self.set_domain_iiaxes(*original_slice, internal=False)
+            val = self._slice_from_window(val, window)
 
         # reshape if necessary... E.g. if var is a simple var, and iix tells to slice array.
         if (np.ndim(val) >= self.ndim) and (np.shape(val) != self.shape):
@@ -927,6 +1161,32 @@ class BifrostData():
 
         return val
 
+    def _metadata(self, none=None, with_nfluid=2):
+        '''returns dict of metadata for self; the attrs of self which may affect the output of get_var.
+        if self.snap is an array, set result['snaps']=snap and result['snap']=snaps[self.snapInd].
+
+        none: any value (default None)
+            metadata attrs which are not yet set will be set to this value.
+        with_nfluid: ignored. (Included for compatibility with EbysusData._metadata.)
+        '''
+        METADATA_ATTRS = ['snap', 'iix', 'iiy', 'iiz', 'do_stagger', 'stagger_kind']
+        result = {attr: getattr(self, attr, none) for attr in METADATA_ATTRS}
+        if result['snap'] is not none:
+            if len(np.shape(result['snap'])) > 0:
+                result['snaps'] = result['snap']              # snaps is the array of snaps
+                result['snap'] = result['snap'][self.snapInd]  # snap is the single snap
+        return result
+
+    def _snapshot_files(self):
+        '''returns list of the files which store data for the current snapshot. (e.g. .idl, .snap, .aux)
+        Used to tell if results in the disk cache are outdated. (See helita.sim.disk_cache.)
+        '''
+        snap_str = self.snap_str[self.snapInd] if np.shape(self.snap) != () else self.snap_str
+        result = sorted(glob(self.file_root + snap_str + '.*'))
+        if (self.meshfile is not None) and os.path.isfile(self.meshfile):
+            result.append(self.meshfile)
+        return result
+
     def _getting_internal_var(self):
         '''returns whether we are currently inside of an internal call to _load_quantity.
         (_load_quantity is called inside of get_var.)
@@ -1054,6 +1314,17 @@ class BifrostData():
             print('(get_var): reading simple ', var, whsp*5,  # TODO: show np.shape(val) info somehow?
                   end="\r", flush=True)
 
+        filename, kw__memmap = self._get_simple_var_file_info(var, panic=panic, order=order)
+        if var in self.heliumvars:
+            return np.exp(np.memmap(filename, mode=mode, **kw__memmap))
+        else:
+            return np.memmap(filename, mode=mode, **kw__memmap)
+
+    def _get_simple_var_file_info(self, var, panic=False, order='F'):
+        '''gets file info but does not read memmap; helper function for _get_simple_var.
+
+        returns (filename, kwargs for np.memmap) corresponding to var.
+        '''
         if np.shape(self.snap) != ():
             currSnap = self.snap[self.snapInd]
             currStr = self.snap_str[self.snapInd]
@@ -1124,12 +1395,14 @@ class BifrostData():
                       (self.nzb + (self.nzb - self.nz) // 2) * idx * dsize)
             ss = (self.nx, self.ny, self.nz)
 
-        if var in self.heliumvars:
-            return np.exp(np.memmap(filename, dtype=self.dtype, order=order,
-                                    mode=mode, offset=offset, shape=ss))
-        else:
-            return np.memmap(filename, dtype=self.dtype, order=order,
-                             mode=mode, offset=offset, shape=ss)
+        return filename, dict(dtype=self.dtype, order=order, offset=offset, shape=ss)
+
+    def _simple_var_location(self, var):
+        '''returns (filename, offset) telling where var is stored.
+        Useful for sorting vars in on-disk order.
+        '''
+        filename, kw__memmap = self._get_simple_var_file_info(var)
+        return (filename, kw__memmap['offset'])
 
     def _get_simple_var_xy(self, *args, **kwargs):
         '''returns load_fromfile_quantities._get_simple_var_xy(self, *args, **kwargs).
@@ -1170,7 +1443,7 @@ class BifrostData():
         else:
             ee = self.get_var('ee')[sx, sy, sz]
             ee = ee * self.uni.u_ee
-            eostab = Rhoeetab(fdir=self.fdir)
+            eostab = get_rhoeetab(fdir=self.fdir)
             rho = self.r[sx, sy, sz] * self.uni.u_r   # to cm^-3
             ne = eostab.tab_interp(rho, ee, order=1)
         return Quantity(ne, unit='1/cm3')
@@ -1339,8 +1612,8 @@ class BifrostData():
         -------
         None.
         """
-        from .multi3d import Multi3dAtmos
-        from .multi3d import Multi3dMagnetic
+        from .multi3d import Multi3dAtmos, Multi3dMagnetic
+
         # unit conversion to cgs and km/s
         ul = self.params['u_l'][self.snapInd]   # to cm
         ur = self.params['u_r'][self.snapInd]   # to g/cm^3  (for ne_rt_table)
@@ -1410,7 +1683,7 @@ class BifrostData():
 
     def get_varTime(self, var, snap=None, iix=None, iiy=None, iiz=None,
                     print_freq=None, printing_stats=None,
-                    *args__get_var, **kw__get_var):
+                    *args__get_var, workers=None, **kw__get_var):
         """
         Reads a given variable as a function of time.
 
@@ -1437,6 +1710,17 @@ class BifrostData():
             False --> don't print stats. (This is the default value for self.printing_stats.)
             True  --> do print stats.
             dict  --> do print stats, passing this dictionary as kwargs.
+        workers - None or int
+            number of processes to use for getting the values.
+            None or 1 --> get the value at each snap, in order, in this process.
+            N > 1 --> get the value at the first snap here, then split the remaining snaps
+                      across a pool of N processes. Each process creates its own reader
+                      (by calling type(self) with the args originally used to create self),
+                      and writes its values directly into a shared-memory output array.
+                      The threads are split between the processes: each one uses numThreads // N threads
+                      (or (number of cores) // N, if numThreads is 1), and at least 1.
+                      CAUTION: processes are started via VARTIME_MP_START_METHOD (default 'spawn'),
+                      so scripts must protect their main code with if __name__ == '__main__'.
 
         additional *args and **kwargs are passed to get_var.
         """
@@ -1451,7 +1735,7 @@ class BifrostData():
             snap = kw__get_var.pop('snaps', None)  # look for 'snaps' kwarg
             if snap is None:
                 snap = self.snap
-        snap = np.array(snap, copy=False)
+        snap = np.asarray(snap)
         if len(snap.shape) == 0:
             raise ValueError('Expected snap to be list (in get_varTime) but got snap={}'.format(snap))
         if not np.array_equal(snap, self.snap):
@@ -1494,6 +1778,11 @@ class BifrostData():
                     value = np.empty_like(val0, shape=[*np.shape(val0), snapLen])
                     value[..., 0] = val0
                     firstit = False
+                    if (workers is not None) and (workers > 1) and (snapLen > 1):
+                        # get the values for all other snaps using a pool of workers.
+                        value = self._get_varTime_workers(value, var, snap, workers, print_freq,
+                                                          args__get_var, kw__get_var)
+                        break
                 else:
                     value[..., it] = self.get_var(var, snap=snap[it],
                                                   *args__get_var, **kw__get_var)
@@ -1514,6 +1803,101 @@ class BifrostData():
         self.print_stats(value, printing_stats=printing_stats)
         return value
 
+    def _get_varTime_workers(self, value, var, snaps, workers, print_freq, args__get_var, kw__get_var):
+        '''helper for get_varTime(workers=N). Fills value[..., 1:] using a pool of N processes.
+        value[..., 0] must already be filled (it is used to determine the shape and dtype of the output).
+
+        The pool's processes write into a shared-memory array; it is copied to a regular array at the end.
+        if crashing, sets self.recoverData to the values from the snaps before the first snap which crashed.
+        '''
+        shm = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+        shared = np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)
+        try:
+            shared[..., 0] = value[..., 0]
+            kw__get_var = dict(kw__get_var, iix=self.iix, iiy=self.iiy, iiz=self.iiz)
+            cls, init_args, init_kwargs, attrs = self._new_reader_args()
+            attrs['numThreads'] = _varTime_worker_num_threads(self, workers)
+            initargs = (cls, init_args, init_kwargs, attrs, shm.name, shared.shape, shared.dtype)
+            tasks = [(it, snaps[it], var, args__get_var, kw__get_var) for it in range(1, len(snaps))]
+            # get values.
+            timestart = now = time.time()
+            it = 1
+            context = multiprocessing.get_context(VARTIME_MP_START_METHOD)
+            with context.Pool(workers, initializer=_varTime_worker_init, initargs=initargs) as pool:
+                try:
+                    for it in pool.imap(_varTime_worker_get, tasks):
+                        if (print_freq >= 0) and (time.time() - now > print_freq):
+                            print('\r' + ' '*100 + '\r', end='')
+                            print(('Getting {:^10s} with {} workers; '
+                                   'done with snap={:2d} (snap_it={:2d} out of {:2d}).')
+                                  .format(var, workers, snaps[it], it, len(snaps)), end='')
+                            now = time.time()
+                            print(' Total time elapsed = {:.1f} s'.format(now - timestart), end='')
+                        it = it + 1  # number of snaps which are done.
+                except BaseException:   # here it is ok to except all errors, because we always raise.
+                    self.recoverData = np.array(shared[..., :it])   # save data
+                    if self.verbose:
+                        print(('Crashed during get_varTime, but managed to get data from {} '
+                               'snaps before crashing. Data was saved and can be recovered '
+                               'via self.recoverData.'.format(it)))
+                    raise
+            return np.array(shared)
+        finally:
+            del shared  # (the buffer can't be closed while any arrays still use it.)
+            shm.close()
+            shm.unlink()
+
+    def _new_reader_args(self):
+        '''returns (cls, init_args, init_kwargs, attrs) for creating a copy of self via _new_reader.
+        The copy is created like self was, then gets the VARTIME_WORKER_ATTRS of self.
+        '''
+        init_args, init_kwargs = self._init_args
+        init_kwargs = dict(init_kwargs, verbose=False)
+        attrs = {attr: getattr(self, attr) for attr in VARTIME_WORKER_ATTRS if hasattr(self, attr)}
+        return (type(self), init_args, init_kwargs, attrs)
+
+    def iter_varTime(self, var, snaps=None, *args__get_var, prefetch=VARTIME_PREFETCH,
+                     iix=None, iiy=None, iiz=None, **kw__get_var):
+        '''iterates over snaps, yielding (snap, time, value of var at snap), one snap at a time.
+        Useful for reducing each snapshot right away, without keeping the values from all snaps in memory.
+
+        snaps: None or list of snapshot numbers
+            None --> use self.snap.
+        prefetch: int, default VARTIME_PREFETCH
+            number of snaps to read ahead. While var is calculated for the current snap,
+            a background thread reads the simple vars needed for var (on the required domain)
+            from the next prefetch snaps, so that they are already in the page cache when needed.
+            0 --> don't read ahead.
+        time is in the units given by self.units_output (see self.get_coord).
+
+        additional *args and **kwargs are passed to get_var.
+        self.snap is restored when the iteration ends (or is stopped early).
+
+        Example:
+            means = [np.mean(val) for snap, t, val in dd.iter_varTime('tg', snaps=range(100, 200))]
+        '''
+        if snaps is None:
+            snaps = kw__get_var.pop('snap', self.snap)
+        snaps = np.atleast_1d(snaps)
+        kw__get_var.update(printing_stats=False)   # never print_stats in the middle of iter_varTime.
+        remembersnaps = self.snap
+        # use the same domain at every snap, even if self's domain is changed between iterations.
+        self.set_domain_iiaxes(iix=iix, iiy=iiy, iiz=iiz, internal=False)
+        kw__get_var.update(iix=self.iix, iiy=self.iiy, iiz=self.iiz)
+        prefetcher = None
+        if (prefetch > 0) and (len(snaps) > 1):
+            prefetcher = _SnapPrefetcher(self, var, **kw__get_var)
+        try:
+            for it, snap in enumerate(snaps):
+                if prefetcher is not None:
+                    prefetcher.request(snaps[it+1: it+1+prefetch])
+                value = self.get_var(var, snap, *args__get_var, **kw__get_var)
+                yield (snap, self.get_coord('t')[0], value)
+        finally:
+            if prefetcher is not None:
+                prefetcher.stop()
+            self.set_snap(remembersnaps)
+
     @tools.maintain_attrs('snap')
     def ddt(self, var, snap=None, *args__get_var, method='centered', printing_stats=None, **kw__get_var):
         '''time derivative of var, at current snapshot.
@@ -1964,6 +2348,136 @@ class BifrostData():
 SnapStuff = collections.namedtuple('SnapStuff', ('snapname', 'snaps'))
 
 
+_VARTIME_WORKER = dict()   # reader and output array for this process, if it is a get_varTime worker.
+
+
+def _new_reader(cls, init_args, init_kwargs, attrs):
+    '''returns cls(*init_args, **init_kwargs), then sets attrs (dict of {attr: value}) of the result.'''
+    obj = cls(*init_args, **init_kwargs)
+    for attr, val in attrs.items():
+        setattr(obj, attr, val)
+    return obj
+
+
+def _varTime_worker_num_threads(obj, workers):
+    '''returns the number of threads for each of the workers of obj.get_varTime(workers=N).
+    The threads of obj (or all the cores, if obj.numThreads is 1) are split between the workers,
+    so that N workers don't use N * obj.numThreads threads in total.
+    '''
+    return max(1, (tools.obj_num_threads(obj) or os.cpu_count() or 1) // workers)
+
+
+def _varTime_worker_init(cls, init_args, init_kwargs, attrs, shm_name, shape, dtype):
+    '''initializes a get_varTime worker process: creates a reader and attaches the shared output array.'''
+    obj = _new_reader(cls, init_args, init_kwargs, attrs)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    value = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _VARTIME_WORKER.update(obj=obj, shm=shm, value=value)
+
+
+def _varTime_worker_get(task):
+    '''gets var at snap in a get_varTime worker process, and puts it in the shared output at index it.
+    task = (it, snap, var, args__get_var, kw__get_var). returns it.
+    '''
+    it, snap, var, args__get_var, kw__get_var = task
+    obj = _VARTIME_WORKER['obj']
+    # (obj.numThreads is this worker's share of the threads; see _get_varTime_workers.)
+    with tools.parallelism(obj.numThreads):
+        _VARTIME_WORKER['value'][..., it] = obj.get_var(var, snap, *args__get_var, **kw__get_var)
+    return it
+
+
+class _SnapPrefetcher():
+    '''reads the simple vars needed for var at the requested snaps, in a background thread.
+    Used by iter_varTime to overlap reading from disk with calculations in the main thread.
+
+    The simple vars are only read (so that they are in the page cache when they are needed);
+    they are not kept in memory. The thread uses its own copy of obj (see obj._new_reader_args),
+    so it never changes the state of obj. Errors while prefetching are ignored;
+    they will appear (in the main thread) when the value at that snap is calculated.
+    '''
+
+    def __init__(self, obj, var, **kw__get_var):
+        # find which simple vars are needed, and on which domain.
+        plan = obj.plan_vars([var], **kw__get_var)
+        self.keys = [key for key in plan.nuses if key[0] in obj.simple_vars]
+        slices = tuple(kw__get_var[ii] for ii in ('iix', 'iiy', 'iiz'))
+        self.slices = obj._slices_with_halo(*slices) if obj.do_stagger else slices
+        self.requested = set()
+        self.queue = queue.Queue()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=obj._new_reader_args(), daemon=True)
+        self.thread.start()
+
+    def request(self, snaps):
+        '''requests to prefetch snaps which were not requested before.'''
+        for snap in snaps:
+            if snap not in self.requested:
+                self.requested.add(snap)
+                self.queue.put(snap)
+
+    def stop(self):
+        '''stops prefetching, and waits for the thread to finish.'''
+        self.stopping.set()
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self, *reader_args):
+        try:
+            reader = _new_reader(*reader_args)
+        except Exception:
+            return
+        while not self.stopping.is_set():
+            snap = self.queue.get()
+            if snap is None:
+                return
+            try:
+                self._prefetch(reader, snap)
+            except Exception:
+                pass
+
+    def _prefetch(self, reader, snap):
+        '''reads the simple vars at snap (via reader).'''
+        reader.set_snap(snap)
+        for key in self.keys:
+            if self.stopping.is_set():
+                return
+            quant_planner._set_key_fluids(reader, key)
+            val = reader._get_simple_var(key[0])
+            if key[3] == 0:  # (else, var is needed on the full domain.)
+                for i, ii in enumerate(self.slices):
+                    val = val[(slice(None),)*i + (ii,)]
+            np.max(np.asarray(val))  # reads val, but doesn't keep a copy of it.
+
+
+class _FullDomain():
+    '''context manager for calculating on the full domain,
+    but ending up with the same iix, iiy, iiz at the end.
+    upon enter, set iix, iiy, iiz to slice(None).
+    upon exit, restore original iix, iiy, iiz.
+
+    Example:
+    dd = BifrostData(..., iiz=5)
+    with _FullDomain(dd):
+        print(dd.iiz)  #>> slice(None, None, None)
+    print(dd.iiz)  #>> slice(5, 6, None)
+    '''
+
+    def __init__(self, obj):
+        self.obj = obj
+        self.orig_slices = (obj.iix, obj.iiy, obj.iiz)
+
+    def __enter__(self):
+        self.obj.set_domain_iiaxes(slice(None), slice(None), slice(None), internal=False)
+        depth = getattr(self.obj, quant_planner.FULL_DOMAIN_DEPTH, 0)
+        setattr(self.obj, quant_planner.FULL_DOMAIN_DEPTH, depth + 1)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.obj.set_domain_iiaxes(*self.orig_slices, internal=False)
+        depth = getattr(self.obj, quant_planner.FULL_DOMAIN_DEPTH)
+        setattr(self.obj, quant_planner.FULL_DOMAIN_DEPTH, depth - 1)
+
+
 def get_snapstuff(dd=None):
     '''return (get_snapname(), available_snaps()).
     dd: None or BifrostData object.
@@ -1996,8 +2510,11 @@ def get_snaps(dd=None, snapname=None):
     Doesn't look for: .pan, .scr, .aux files.
     snapname: None (default) or str
         snapname parameter from mhd.in. If None, get snapname.
-    if dd is not None, look in dd.fdir.
+    if dd is not None, look in dd.fdir. (use dd.snap_index instead, if dd has one.)
     '''
+    index = snap_index.get_snap_index(dd)
+    if (index is not None) and (snapname in (None, dd.snapname)):
+        return index.snaps()
     with tools.EnterDirectory(_get_dd_fdir(dd)):
         snapname = snapname if snapname is not None else get_snapname()
         snaps = [_snap_to_N(f, snapname) for f in os.listdir()]
@@ -2419,28 +2936,45 @@ class Rhoeetab:
             print('*** Read EOS table from ' + eostabfile, whsp*4, end="\r",
                   flush=True)
 
-    def load_ent_table(self, eostabfile=None):
+    def load_ent_table(self, eostabfile=None, cache=True):
         '''
         Generates Entropy table from Bifrost EOS table
-        '''
-        self.enttab = np.zeros((self.params['neibin'], self.params['nrhobin']))
-        for irho in range(1, self.params['nrhobin']):
-            dinvrho = (1.0 / np.exp(self.lnrho[irho]) - 1.0 / np.exp(
-                self.lnrho[irho - 1]))
-
-            self.enttab[0, irho] = self.enttab[0, irho - 1] + 1.0 / \
-                self.tgt[0, irho] * np.exp(self.lnpg[0, irho]) * dinvrho
 
-            for iei in range(1, self.params['neibin']):
-                dei = np.exp(self.lnei[iei]) - np.exp(self.lnei[iei - 1])
-                self.enttab[iei, irho] = self.enttab[iei - 1, irho] + 1.0 / \
-                    self.tgt[iei, irho] * dei
-        for iei in range(1, self.params['neibin']):
-            dei = np.exp(self.lnei[iei]) - np.exp(self.lnei[iei - 1])
-            self.enttab[iei, 0] = self.enttab[iei - 1, 0] + \
-                1.0 / self.tgt[iei, 0] * dei
-
-        self.enttab = np.log(self.enttab - np.min(self.enttab) - 5.0e8)
+        cache: bool, default True
+            whether to save the entropy table to (and read it from) a file next to the EOS table,
+            named eostabfile + '.ent.npy'. It is only reused while the EOS table is not modified.
+        '''
+        if eostabfile is None:
+            eostabfile = '%s/%s' % (self.fdir, self.params['eostablefile'])
+        cachefile = eostabfile + '.ent.npy'
+        shape = (self.params['neibin'], self.params['nrhobin'])
+        if cache and os.path.isfile(cachefile) and (os.stat(cachefile).st_mtime_ns >=
+                                                    os.stat(eostabfile).st_mtime_ns):
+            enttab = np.load(cachefile, allow_pickle=False)
+            if enttab.shape == shape:
+                self.enttab = enttab
+                return
+        if not self.eosload:
+            self.load_eos_table(eostabfile)
+        # enttab[0, irho] = sum over rho bins of pg / tg * d(1/rho), at the lowest ei;
+        # enttab[iei, irho] = enttab[0, irho] + sum over ei bins of 1 / tg * d(ei).
+        # (cumsum adds in the same order as a loop, so this gives the same result as looping.)
+        enttab = np.zeros(shape)
+        dinvrho = np.diff(1.0 / np.exp(self.lnrho))
+        enttab[0, 1:] = 1.0 / self.tgt[0, 1:] * np.exp(self.lnpg[0, 1:]) * dinvrho
+        dei = np.diff(np.exp(self.lnei))
+        enttab[1:, :] = 1.0 / self.tgt[1:, :] * dei[:, np.newaxis]
+        np.cumsum(enttab[0], out=enttab[0])
+        np.cumsum(enttab, axis=0, out=enttab)
+        self.enttab = np.log(enttab - np.min(enttab) - 5.0e8)
+        if cache:
+            try:
+                tmpfile = '%s.%d.tmp.npy' % (cachefile, os.getpid())
+                np.save(tmpfile, self.enttab, allow_pickle=False)
+                os.replace(tmpfile, cachefile)
+            except OSError as err:
+                if self.verbose:
+                    print('(WWW) could not save entropy table to %s: %s' % (cachefile, err))
 
     def load_rad_table(self, radtabfile=None):
         ''' Loads rhoei_radtab table. '''
@@ -2513,27 +3047,114 @@ class Rhoeetab:
             'opa'  : opacity
             'temt' : thermal emission
         '''
+        if out in ['opa', 'eps', 'temp'] and bin is None:
+            print("(WWW) tab_interp: radiation bin not set, using first.")
+            bin = 0
+        return self.tab_interp_multi(rho, ei, outs=[out], bins=bin, order=order)[out]
 
+    def tab_interp_multi(self, rho, ei, outs=('ne', 'tg', 'pg', 'kr'), bins=None, order=1):
+        '''
+        Interpolates the EOS/rad table for several quantities at once.
+        log(rho) and log(ei) are only calculated once, for all the quantities.
+        For order=1, all quantities are interpolated in one (parallel) pass
+        through rho and ei, by a numba function (see _eos_interp_linear).
+
+        Parameters
+        ----------
+        rho  : ndarray
+            Density in g/cm^3
+        ei   : ndarray
+            Internal energy in erg/g
+        outs : list of str
+            Quantities to interpolate. Options are the same as for out in
+            tab_interp: 'ne', 'tg', 'pg', 'kr', 'eps', 'opa', 'temp', 'ent'.
+        bins : None, int, or list of int, optional
+            Radiation bins for 'eps', 'opa', 'temp'. None --> all bins.
+            If int, the results for these quantities have the same shape as
+            rho; otherwise, they have an extra last axis, for the bins.
+        order: int, optional
+            Interpolation order (1: linear, 3: cubic)
+
+        Returns
+        -------
+        output : dict
+            {out: array} for each out in outs. (see tab_interp for details.)
+        '''
+        rho, ei = np.broadcast_arrays(np.asarray(rho), np.asarray(ei))
+        bins = bins if np.ndim(bins) == 0 else tuple(bins)
+        table, use_exp, columns = self._stacked_table(tuple(outs), bins)
+        # flatten rho and ei without copying, if possible (for Fortran-ordered arrays, use the transpose).
+        transpose = rho.flags.f_contiguous and ei.flags.f_contiguous and not rho.flags.c_contiguous
+        flat_shape = rho.T.shape if transpose else rho.shape
+        rho_flat = np.ravel(rho.T if transpose else rho)
+        ei_flat = np.ravel(ei.T if transpose else ei)
+        result = np.empty((table.shape[2], rho_flat.size), dtype=table.dtype)
+        if order == 1:
+            nout = _eos_interp_linear(rho_flat, ei_flat, table, self.lnrho[0], self.dlnrho,
+                                      self.lnei[0], self.dlnei, use_exp, result)
+            if np.any(nout):   # (some values are outside of the table)
+                self._warn_outside_table(rho, ei)
+        else:
+            self._warn_outside_table(rho, ei)
+            # translate to table coordinates
+            x = (np.log(ei_flat) - self.lnei[0]) / self.dlnei
+            y = (np.log(rho_flat) - self.lnrho[0]) / self.dlnrho
+            for i in range(table.shape[2]):
+                result[i] = ndimage.map_coordinates(table[:, :, i], [x, y], order=order, mode='nearest')
+                if use_exp[i]:
+                    np.exp(result[i], out=result[i])
+        # split result into the different outs.
+        output = dict()
+        for out, (start, stop, squeeze) in zip(outs, columns):
+            value = result[start:stop].reshape((stop - start,) + flat_shape)
+            if transpose:
+                value = value.transpose(0, *range(value.ndim - 1, 0, -1))
+            output[out] = value[0] if squeeze else np.moveaxis(value, 0, -1)
+        return output
+
+    def _stacked_table(self, outs, bins=None):
+        '''returns (table, use_exp, columns) for interpolating the quantities in outs (see tab_interp_multi).
+        table: float32 array with shape (neibin, nrhobin, number of columns); column i is one quantity
+            (or one radiation bin of one quantity). Each point's values are next to each other in memory.
+        use_exp: bool array; whether to take exp of each column after interpolating (i.e. all except tg).
+        columns: list of (start, stop, squeeze) for each out; the columns for out are table[:, :, start:stop].
+            squeeze is whether the result should not have an axis for the bins.
+        The result is cached, so it is only made once for each outs and bins.
+        '''
+        key = (outs, bins)
+        stacked = self.__dict__.setdefault('_stacked_tables', dict())
+        if key in stacked:
+            return stacked[key]
         qdict = {'ne': 'lnne', 'tg': 'tgt', 'pg': 'lnpg', 'kr': 'lnkr',
                  'eps': 'epstab', 'opa': 'opatab', 'temp': 'temtab',
                  'ent': 'enttab'}
-        if out in ['ne tg pg kr'.split()] and not self.eosload:
-            raise ValueError("(EEE) tab_interp: EOS table not loaded!")
-        if out in ['ent'] and not self.entload:
-            if not self.eosload:
+        arrays, use_exp, columns = [], [], []
+        for out in outs:
+            if out not in qdict:
+                raise ValueError(f"(EEE) tab_interp: unknown quantity {repr(out)}; options are {list(qdict)}")
+            if out in ['ne', 'tg', 'pg', 'kr', 'ent'] and not self.eosload:
                 raise ValueError("(EEE) tab_interp: EOS table not loaded!")
-            if not self.entload:
+            if out in ['opa', 'eps', 'temp'] and not self.radload:
+                raise ValueError("(EEE) tab_interp: rad table not loaded!")
+            if out == 'ent' and not self.entload:
                 self.load_ent_table()
                 self.entload = True
-        if out in ['opa eps temp'.split()] and not self.radload:
-            raise ValueError("(EEE) tab_interp: rad table not loaded!")
-        quant = getattr(self, qdict[out])
-        if out in ['opa', 'eps', 'temp']:
-            if bin is None:
-                print("(WWW) tab_interp: radiation bin not set, using first.")
-                bin = 0
-            quant = quant[:, :, bin]
-        # warnings for values outside of table
+            quant = getattr(self, qdict[out])
+            squeeze = (quant.ndim == 2) or (np.ndim(bins) == 0 and bins is not None)
+            if quant.ndim == 3:
+                quant = quant[:, :, bins if np.ndim(bins) == 0 else list(bins)] if bins is not None else quant
+            if quant.ndim == 2:
+                quant = quant[:, :, np.newaxis]
+            start = sum(array.shape[2] for array in arrays)
+            arrays.append(quant)
+            use_exp += [out != 'tg'] * quant.shape[2]
+            columns.append((start, start + quant.shape[2], squeeze))
+        table = np.ascontiguousarray(np.concatenate(arrays, axis=2), dtype=np.float32)
+        stacked[key] = (table, np.array(use_exp), columns)
+        return stacked[key]
+
+    def _warn_outside_table(self, rho, ei):
+        '''prints warnings if rho or ei are outside of the table bounds.'''
         rhomin = np.min(rho)
         rhomax = np.max(rho)
         eimin = np.min(ei)
@@ -2554,14 +3175,72 @@ class Rhoeetab:
             print('(WWW) tab_interp: Ei outside of table bounds. ' +
                   'Table Ei max=%.2f, requested Ei max=%.2f' %
                   (self.params['eimax'], eimax))
-        # translate to table coordinates
-        x = (np.log(ei) - self.lnei[0]) / self.dlnei
-        y = (np.log(rho) - self.lnrho[0]) / self.dlnrho
-        # interpolate quantity
 
-        result = map_coordinates(
-            quant, [x, y], order=order, mode='nearest')
-        return (np.exp(result) if out != 'tg' else result)
+
+# {(fdir, tabfile, big_endian, dtype): (modification time of tabfile, Rhoeetab)}. see get_rhoeetab.
+_RHOEETAB_CACHE = dict()
+
+
+def get_rhoeetab(fdir='.', tabfile=None, big_endian=False, dtype='f4', radtab=False, verbose=False):
+    '''returns Rhoeetab for these args, re-using the Rhoeetab from a previous call if possible.
+    So, tabparam.in and the units are only read once, and the tables are only memmapped once, for each fdir.
+    (A new Rhoeetab is made if the tabfile was modified since the previous call;
+    it replaces the old ones for that fdir and tabfile, so they can be deleted.)
+    if radtab, also ensure the rad table is loaded.
+    '''
+    if tabfile is None:
+        tabfile = os.path.join(fdir, 'tabparam.in')
+    tabfile = os.path.abspath(tabfile)
+    fdir = os.path.abspath(fdir)
+    mtime = os.stat(tabfile).st_mtime_ns
+    key = (fdir, tabfile, big_endian, dtype)
+    cached_mtime, result = _RHOEETAB_CACHE.get(key, (None, None))
+    if cached_mtime != mtime:
+        for other in [k for k, (t, _) in _RHOEETAB_CACHE.items() if k[:2] == key[:2] and t != mtime]:
+            del _RHOEETAB_CACHE[other]
+        result = Rhoeetab(tabfile=tabfile, fdir=fdir, big_endian=big_endian, dtype=dtype,
+                          verbose=verbose, radtab=radtab)
+        _RHOEETAB_CACHE[key] = (mtime, result)
+    elif radtab and not result.radload:
+        result.load_rad_table()
+    return result
+
+
+# numba is slow to import; _eos_interp_linear is compiled when it is first called (see tools.LazyNjit).
+prange = range   # replaced by numba.prange when the numba functions in this file are compiled.
+
+
+@tools.lazy_njit(parallel=True, cache=stagger.NUMBA_CACHE)
+def _eos_interp_linear(rho, ei, table, lnrho0, dlnrho, lnei0, dlnei, use_exp, out):
+    '''linear interpolation of all the columns of table, at (log(ei), log(rho)), in one pass.
+    Like ndimage.map_coordinates(table[:, :, i], [x, y], order=1, mode='nearest') for each column i,
+    with x = (log(ei) - lnei0) / dlnei, y = (log(rho) - lnrho0) / dlnrho.
+    rho, ei: 1D arrays. table: 3D array (nei, nrho, ncolumns). use_exp: bool array (ncolumns,).
+    out: 2D array (ncolumns, len(rho)). out[i] = result for column i (or exp of it, if use_exp[i]).
+    returns the number of points outside of the table (where the nearest table values are used).
+    '''
+    nei, nrho, ncol = table.shape
+    nout = 0
+    for p in prange(rho.shape[0]):
+        x = (np.log(ei[p]) - lnei0) / dlnei
+        y = (np.log(rho[p]) - lnrho0) / dlnrho
+        if (x != x) or (y != y):   # nan
+            for i in range(ncol):
+                out[i, p] = np.nan
+            continue
+        if (x < 0) or (x > nei - 1) or (y < 0) or (y > nrho - 1):
+            nout += 1
+            x = min(max(x, 0.0), nei - 1.0)
+            y = min(max(y, 0.0), nrho - 1.0)
+        ix = min(int(x), nei - 2)
+        iy = min(int(y), nrho - 2)
+        tx = x - ix
+        ty = y - iy
+        for i in range(ncol):
+            val = (1 - tx) * ((1 - ty) * table[ix, iy, i] + ty * table[ix, iy + 1, i]) + \
+                tx * ((1 - ty) * table[ix + 1, iy, i] + ty * table[ix + 1, iy + 1, i])
+            out[i, p] = np.exp(val) if use_exp[i] else val
+    return nout
 
 
 class Opatab:
@@ -2623,7 +3302,7 @@ class Opatab:
         ''' Loads ionizationstate table. '''
         if tabname is None:
             tabname = '%s/%s' % (self.fdir, 'ionization.dat')
-        eostab = Rhoeetab(fdir=self.fdir)
+        eostab = get_rhoeetab(fdir=self.fdir)
         nei = eostab.params['neibin']
         nrho = eostab.params['nrhobin']
         dtype = ('>' if self.big_endian else '<') + self.dtype
@@ -2648,9 +3327,9 @@ class Opatab:
         # translate to table coordinates
         x = ((tgTable) - self.teinit) / self.dte
         # interpolate quantity
-        self.ionh = map_coordinates(self.ionh1d, [x], order=order)
-        self.ionhe = map_coordinates(self.ionhe1d, [x], order=order)
-        self.ionhei = map_coordinates(self.ionhei1d, [x], order=order)
+        self.ionh = ndimage.map_coordinates(self.ionh1d, [x], order=order)
+        self.ionhe = ndimage.map_coordinates(self.ionhe1d, [x], order=order)
+        self.ionhei = ndimage.map_coordinates(self.ionhei1d, [x], order=order)
 
     def h_he_absorb(self, lambd=None):
         '''
@@ -2784,34 +3463,81 @@ class Cross_sect:
         Collects the information in the cross table files.
         '''
         self.cross_tab = dict()
+        self.logtg_tab = dict()
+        self._stacked_tables = dict()
         for itab in range(len(self.cross_tab_list)):
             self.cross_tab[itab] = read_cross_txt(self.cross_tab_list[itab], firstime=firstime,
                                                   obj=self.obj(), kelvin=self.kelvin)
+            self.logtg_tab[itab] = get_logtg_cross_tab(self.cross_tab_list[itab], self.cross_tab[itab],
+                                                       kelvin=self.kelvin)
 
     def tab_interp(self, tg, itab=0, out='el', order=1):
         ''' Interpolates the cross section tables in the simulated domain.
             IN:
                 tg  : Temperature [K]
-                order: interpolation order (1: linear, 3: cubic)
+                order: interpolation order (only linear interpolation is implemented)
             OUT:
                 'se'  : Spin exchange cross section [a.u.]
                 'el'  : Integral Elastic cross section [a.u.]
                 'mt'  : momentum transfer cross section [a.u.]
                 'vi'  : viscosity cross section [a.u.]
         '''
-
-        if out in ['se el vi mt'.split()] and not self.load_cross_tables:
-            raise ValueError("(EEE) tab_interp: EOS table not loaded!")
-
-        finterp = interpolate.interp1d(np.log(self.cross_tab[itab]['tg']),
-                                       self.cross_tab[itab][out])
-        tgreg = np.array(tg, copy=True)
-        max_temp = np.max(self.cross_tab[itab]['tg'])
-        tgreg[tg > max_temp] = max_temp
-        min_temp = np.min(self.cross_tab[itab]['tg'])
-        tgreg[tg < min_temp] = min_temp
-
-        return finterp(np.log(tgreg))
+        return self.tab_interp_multi(tg, itabs=[itab], outs=[out])[out][0]
+
+    def tab_interp_multi(self, tg, itabs=None, outs=('el',)):
+        '''interpolates several cross sections, for several tables, in one pass over tg.
+        Linear interpolation in log(tg), using a uniform grid in log(tg) to look up table indices
+        (see get_logtg_cross_tab), and the values at the nearest table edge for tg outside of a table.
+
+        tg: array (or number)
+            temperature [K] (or [eV] if not self.kelvin).
+        itabs: None or list of ints
+            indices of tables to use. None --> all tables.
+        outs: list of strs from 'el', 'mt', 'vi', 'se'.
+            cross sections to get. See tab_interp for details.
+
+        returns dict of {out: array with shape (len(itabs),) + np.shape(tg)}.
+        The result has the same dtype as tg if tg is float32 or float64; else float64.
+        '''
+        if itabs is None:
+            itabs = list(self.cross_tab)
+        tables = self._stacked_table(tuple(itabs), tuple(outs))
+        tg = np.asanyarray(tg)
+        dtype = tg.dtype if tg.dtype in (np.float32, np.float64) else np.float64
+        order = 'F' if (tg.flags.f_contiguous and not tg.flags.c_contiguous) else 'C'
+        flat = tg.ravel(order=order)
+        result = np.empty((len(outs), len(itabs), flat.size), dtype=dtype)
+        _cross_interp_linear(flat, *tables, result)
+        return {out: result[i].reshape((len(itabs),) + tg.shape, order=order) for i, out in enumerate(outs)}
+
+    def _stacked_table(self, itabs, outs):
+        '''returns the args for _cross_interp_linear which describe the tables, for itabs and outs.
+        The tables are padded to the same length by repeating their last values.
+        '''
+        key = (itabs, outs)
+        if key not in self._stacked_tables:
+            tabs = [self.logtg_tab[itab] for itab in itabs]
+            for itab, tab in zip(itabs, tabs):
+                missing = [out for out in outs if out not in tab.values]
+                if len(missing) > 0:
+                    raise KeyError(f'cross section(s) {missing} not found in {self.cross_tab_list[itab]!r}')
+            nlntg = np.array([len(tab.lntg) for tab in tabs], dtype='int64')
+            nlookup = np.array([len(tab.lookup) for tab in tabs], dtype='int64')
+            lntg = np.empty((len(tabs), max(nlntg, default=2)))
+            values = np.empty((len(tabs), lntg.shape[1], len(outs)))
+            lookup = np.zeros((len(tabs), max(nlookup, default=1)), dtype='int64')
+            for i, tab in enumerate(tabs):
+                n = nlntg[i]
+                lntg[i, :n] = tab.lntg
+                lntg[i, n:] = tab.lntg[-1]
+                for j, out in enumerate(outs):
+                    values[i, :n, j] = tab.values[out]
+                    values[i, n:, j] = tab.values[out][-1]
+                lookup[i, :nlookup[i]] = tab.lookup
+            lntg0 = np.array([tab.lntg0 for tab in tabs], dtype='float64')
+            dlntg = np.array([tab.dlntg for tab in tabs], dtype='float64')
+            self._stacked_tables[key] = (lntg, nlntg, values, lntg0, dlntg, lookup, nlookup)
+        return self._stacked_tables[key]
 
     def __call__(self, tg, *args, **kwargs):
         '''alias for self.tab_interp.'''
@@ -2839,6 +3565,83 @@ def cross_sect_for_obj(obj=None):
         return Cross_sect(cross_tab, fdir, *args__Cross_sect, **kw__Cross_sect, obj=obj)
     return _init_cross_sect
 
+
+# {(filename, kelvin): (modification time of filename, LogTgCrossTab)}. see get_logtg_cross_tab.
+_CROSS_TAB_CACHE = dict()
+CROSS_TAB_MAX_NGRID = 2**15   # max number of points in the uniform log(tg) lookup grids for cross sections.
+
+LogTgCrossTab = collections.namedtuple('LogTgCrossTab', ('lntg', 'values', 'lntg0', 'dlntg', 'lookup'))
+
+
+def get_logtg_cross_tab(filename, cross_tab, kelvin=True):
+    '''returns cross sections from cross_tab (as read by read_cross_txt), arranged for fast lookups.
+    result is a LogTgCrossTab with:
+        lntg: log(tg) in the table, sorted.
+        values: {out: cross section at lntg} for each out in 'el', 'mt', 'vi', 'se' which is in cross_tab.
+        lntg0, dlntg, lookup: uniform grid in log(tg), which tells where to look in lntg.
+            lookup[k] = index of the last lntg <= lntg0 + k * dlntg.
+            The grid spacing is the smallest spacing in lntg (but at most CROSS_TAB_MAX_NGRID points),
+            so finding the interval of lntg which contains any log(tg) takes one or two steps from the grid.
+    Results are remembered, for each filename, until the file is modified.
+    (A modified file replaces the old results for that filename, so they can be deleted.)
+    '''
+    filename = os.path.abspath(filename)
+    mtime = os.stat(filename).st_mtime_ns
+    key = (filename, kelvin)
+    cached_mtime, result = _CROSS_TAB_CACHE.get(key, (None, None))
+    if cached_mtime != mtime:
+        for other in [k for k, (t, _) in _CROSS_TAB_CACHE.items() if k[0] == filename and t != mtime]:
+            del _CROSS_TAB_CACHE[other]
+        lntg = np.log(np.asarray(cross_tab['tg'], dtype='float64'))
+        isort = np.argsort(lntg, kind='stable')
+        if len(isort) == 1:
+            isort = np.array([0, 0])   # linear interpolation needs at least 2 points.
+        lntg = lntg[isort]
+        values = {out: np.asarray(cross_tab[out], dtype='float64')[isort]
+                  for out in ('el', 'mt', 'vi', 'se') if out in cross_tab}
+        steps = np.diff(lntg)
+        steps = steps[steps > 0]
+        if len(steps) == 0:
+            ngrid, dlntg = 1, 1.0
+        else:
+            ngrid = min(int(np.ceil((lntg[-1] - lntg[0]) / np.min(steps))) + 1, CROSS_TAB_MAX_NGRID)
+            dlntg = (lntg[-1] - lntg[0]) / max(ngrid - 1, 1)
+        grid = lntg[0] + dlntg * np.arange(ngrid)
+        lookup = np.clip(np.searchsorted(lntg, grid, side='right') - 1, 0, len(lntg) - 2)
+        result = LogTgCrossTab(lntg, values, lntg[0], dlntg, lookup)
+        _CROSS_TAB_CACHE[key] = (mtime, result)
+    return result
+
+
+@tools.lazy_njit(parallel=True, cache=stagger.NUMBA_CACHE)
+def _cross_interp_linear(tg, lntg, nlntg, values, lntg0, dlntg, lookup, nlookup, out):
+    '''linear interpolation in log(tg), for all the tables and columns in values, in one pass over tg.
+    Like np.interp(np.log(tg), lntg[i, :nlntg[i]], values[i, :nlntg[i], j]) for each table i and column j.
+    tg: 1D array. lntg: 2D array (ntab, npoints). values: 3D array (ntab, npoints, ncolumns).
+    lntg0, dlntg, lookup, nlookup: uniform grids in log(tg), lookup[i, :nlookup[i]], for each table.
+        See get_logtg_cross_tab for details.
+    out: 3D array (ncolumns, ntab, len(tg)). Uses the nearest table value for tg outside of the table.
+    '''
+    ntab, npoints, ncol = values.shape
+    for p in prange(tg.shape[0]):
+        x = np.log(np.float64(tg[p]))
+        for i in range(ntab):
+            if x != x:   # nan
+                for j in range(ncol):
+                    out[j, i, p] = np.nan
+                continue
+            n = nlntg[i]
+            xi = min(max(x, lntg[i, 0]), lntg[i, n - 1])
+            k = min(max(int((xi - lntg0[i]) / dlntg[i]), 0), nlookup[i] - 1)
+            m = lookup[i, k]
+            while (m < n - 2) and (lntg[i, m + 1] <= xi):
+                m += 1
+            width = lntg[i, m + 1] - lntg[i, m]
+            t = (xi - lntg[i, m]) / width if width > 0 else 0.0
+            for j in range(ncol):
+                out[j, i, p] = (1 - t) * values[i, m, j] + t * values[i, m + 1, j]
+
+
 ## Tools for making cross section table such that colfreq is independent of temperature ##
 
 
@@ -3038,6 +3841,21 @@ def read_idl_ascii(filename, firstime=False):
     return params
 
 
+def read_mesh_ascii(meshfile):
+    '''Reads Bifrost mesh file into dictionary.
+    For each axis p in ('x', 'y', 'z'), result contains:
+        'n'+p (number of cells), p (coordinates), p+'dn' (coordinates "down"),
+        'd'+p+'id'+p+'up' (up derivative of coordinates), 'd'+p+'id'+p+'dn' (down derivative of coordinates).
+    '''
+    mesh = {}
+    with open(meshfile, 'r') as f:
+        for p in ['x', 'y', 'z']:
+            mesh['n' + p] = int(f.readline().strip('\n').strip())
+            for attr in (p, p + 'dn', 'd%sid%sup' % (p, p), 'd%sid%sdn' % (p, p)):
+                mesh[attr] = np.array([float(v) for v in f.readline().strip('\n').split()])
+    return mesh
+
+
 @file_memory.remember_and_recall('_memory_read_cross_txt', kw_mem=['kelvin'])
 def read_cross_txt(filename, firstime=False, kelvin=True):
     ''' Reads IDL-formatted (command style) ascii file into dictionary.
@@ -3147,7 +3965,7 @@ def read_cross_txt(filename, firstime=False, kelvin=True):
                                   'in line %i, skipping' % li)
                         li += 1
                         continue
-                if not hasattr(params, 'vi'):
+                if not ('vi' in params.keys()):
                     params['vi'] = cross
                 else:
                     params['vi'] = np.append(params['vi'], cross)
@@ -3168,7 +3986,7 @@ def read_cross_txt(filename, firstime=False, kelvin=True):
                                   'in line %i, skipping' % li)
                         li += 1
                         continue
-                if not hasattr(params, 'se'):
+                if not ('se' in params.keys()):
                     params['se'] = cross
                 else:
                     params['se'] = np.append(params['se'], cross)
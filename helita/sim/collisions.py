@@ -0,0 +1,278 @@
+"""
+File purpose:
+    Collision frequencies for many pairs of fluids at once, for EbysusData.
+
+    get_var('nu_ij') works on one pair of fluids at a time; sums over fluids (e.g. 'nu_ssum')
+    then do one get_var call per pair, each with its own fluid switching, cache lookups,
+    and cross section table lookup. Here, the number density and temperature of each fluid are read once,
+    then nu_ij for all the requested pairs is computed in one (numba) pass over the grid.
+    Only the requested sums are stored, so e.g. sum_j nu_ij never needs memory for all the nu_ij.
+
+    The formulas are the same as for 'nu_ij_el', 'nu_ij_mx', and 'nu_ij_cl' in load_mf_quantities.get_mf_colf.
+    If obj.match_aux(), nu_ij has special cases (e.g. constant collision frequencies, or missing coll_keys),
+    so these functions get each nu_ij via get_var instead. (Same if numba is not installed.)
+
+    Examples:
+        collisions.nu_tensor(dd)          # nu_ij for all pairs of fluids (including electrons)
+        collisions.nu_sum(dd, dd.fluid_SLs(), dd.fluid_SLs())   # sum_{j != i} nu_ij, for each fluid i
+"""
+
+# import external public modules
+import numpy as np
+
+# import internal modules
+from . import fluid_tools, stagger, tools
+
+# set constants
+ELECTRONS = (-1, 0)   # SL for electrons. (same as in fluid_tools.iter_fluid_SLs)
+COLL_EL = 0   # elastic collisions. nu_ij = coeff * nr_j * cross(tgij) * sqrt(tgij)
+COLL_MX = 1   # maxwell collisions. nu_ij = coeff * nr_j
+COLL_CL = 2   # coulomb collisions. nu_ij = coeff * logcul * nr_j / tgij**1.5
+
+# numba is slow to import; _colfreq_sums is compiled when it is first called (see tools.LazyNjit).
+prange = range   # replaced by numba.prange when the numba functions in this file are compiled.
+
+
+''' --------------------- user-facing functions --------------------- '''
+
+
+def nu_tensor(obj, fluids=None):
+    '''returns nu_ij [simu. frequency units] for all pairs of fluids,
+    as an array with shape (nfluids, nfluids) + grid shape.
+    result[i, j] = obj.get_var('nu_ij', ifluid=fluids[i], jfluid=fluids[j]).
+    result[i, i] = 0, since collisions of a fluid with itself don't transfer momentum.
+
+    fluids: None or list of (species, level) tuples
+        None --> obj.fluid_SLs(with_electrons=True)
+
+    Note: this needs nfluids**2 times the memory of a single var; consider nu_row or nu_sum instead.
+    '''
+    if fluids is None:
+        fluids = obj.fluid_SLs(with_electrons=True)
+    nf = len(fluids)
+    pairs = [(iSL, jSL) for iSL in fluids for jSL in fluids]
+    result = colfreq_sums(obj, pairs, dest=range(len(pairs)), nout=len(pairs))
+    return result.reshape((nf, nf) + result.shape[1:])
+
+
+def nu_row(obj, ifluid, jfluids=None):
+    '''returns nu_ij [simu. frequency units] for ifluid and each of jfluids,
+    as an array with shape (len(jfluids),) + grid shape.
+    result[j] = obj.get_var('nu_ij', ifluid=ifluid, jfluid=jfluids[j]); 0 if jfluids[j] is ifluid.
+
+    jfluids: None or list of (species, level) tuples
+        None --> obj.fluid_SLs(with_electrons=True)
+    '''
+    if jfluids is None:
+        jfluids = obj.fluid_SLs(with_electrons=True)
+    pairs = [(ifluid, jSL) for jSL in jfluids]
+    return colfreq_sums(obj, pairs, dest=range(len(pairs)), nout=len(pairs))
+
+
+def nu_sum(obj, ifluids, jfluids):
+    '''returns sum_{j in jfluids, j != i} nu_ij [simu. frequency units], for each i in ifluids.
+    result has shape (len(ifluids),) + grid shape.
+
+    E.g. nu_sum(obj, [obj.ifluid], obj.fluid_SLs(with_electrons=True))[0] gives get_var('nu_ssum').
+    '''
+    pairs = []
+    dest = []
+    for i, iSL in enumerate(ifluids):
+        for jSL in jfluids:
+            if not fluid_tools.fluid_equals(iSL, jSL):
+                pairs.append((iSL, jSL))
+                dest.append(i)
+    return colfreq_sums(obj, pairs, dest=dest, nout=len(ifluids))
+
+
+def colfreq_sums(obj, pairs, dest, nout, weights=None):
+    '''returns array with shape (nout,) + grid shape, with result[dest[k]] = sum of weights[k] * nu_ij,
+    for (ifluid, jfluid) in pairs[k]. [simu. frequency units]. nu_ij for pairs of the same fluid are 0.
+    This is the engine behind nu_tensor, nu_row, and nu_sum.
+
+    pairs: list of ((ispecies, ilevel), (jspecies, jlevel))
+    dest: list of ints, same length as pairs
+    nout: int. result has nout arrays; result[n] = 0 if n does not appear in dest.
+    weights: None or list of numbers, same length as pairs. None --> all weights are 1.
+    '''
+    pairs = [(tuple(iSL), tuple(jSL)) for iSL, jSL in pairs]
+    dest = np.asarray(dest, dtype='int64')
+    weights = np.ones(len(pairs)) if weights is None else np.asarray(weights, dtype='float64')
+    result = None
+    with obj.MaintainFluids():
+        if not obj.match_aux():
+            try:
+                result = _colfreq_sums_via_numba(obj, pairs, dest, nout, weights)
+            except tools.ImportFailedError:   # numba is not installed.
+                pass
+        if result is None:
+            result = _colfreq_sums_via_get_var(obj, pairs, dest, nout, weights)
+    if getattr(obj, 'mesh_location_tracking', False):
+        result = stagger.ArrayOnMesh(result, stagger.mesh_location_center())
+    return result
+
+
+''' --------------------- calculations --------------------- '''
+
+
+def _colfreq_sums_via_get_var(obj, pairs, dest, nout, weights):
+    '''colfreq_sums, but getting each nu_ij via obj.get_var('nu_ij').'''
+    result = None
+    for (iSL, jSL), n, weight in zip(pairs, dest, weights):
+        if fluid_tools.fluid_equals(iSL, jSL):
+            continue
+        nu_ij = np.asarray(obj.get_var('nu_ij', ifluid=iSL, jfluid=jSL))
+        if result is None:
+            result = np.zeros((nout,) + nu_ij.shape, dtype=np.result_type(nu_ij, np.float32))
+        result[n] += nu_ij if weight == 1 else weight * nu_ij
+    if result is None:
+        zero = np.asarray(obj.zero_at_mesh_center())
+        result = np.zeros((nout,) + zero.shape, dtype=np.result_type(zero, np.float32))
+    return result
+
+
+def _colfreq_sums_via_numba(obj, pairs, dest, nout, weights):
+    '''colfreq_sums, reading nr and tg of each fluid once, then computing all nu_ij in one numba pass.'''
+    keep = [k for k, (iSL, jSL) in enumerate(pairs) if not fluid_tools.fluid_equals(iSL, jSL)]
+    pairs = [pairs[k] for k in keep]
+    dest = dest[keep]
+    weights = weights[keep]
+    fluids = list(dict.fromkeys(SL for pair in pairs for SL in pair))
+    ifluid = {SL: f for f, SL in enumerate(fluids)}
+    # per-fluid info
+    nr = [np.asarray(obj.get_var('nr', ifluid=SL)) for SL in fluids]   # [simu. number density units]
+    tg = [np.asarray(obj.get_var('tg', ifluid=SL)) for SL in fluids]   # [K]
+    if len(fluids) == 0:
+        zero = np.asarray(obj.zero_at_mesh_center())
+        return np.zeros((nout,) + zero.shape, dtype=np.result_type(zero, np.float32))
+    shape = nr[0].shape
+    dtype = np.result_type(*nr, *tg, np.float32)
+    order = 'F' if (nr[0].flags.f_contiguous and not nr[0].flags.c_contiguous) else 'C'
+    nr = np.stack([np.ravel(v, order=order) for v in nr])
+    tg = np.stack([np.ravel(v, order=order) for v in tg])
+    mass = np.array([obj.get_mass(SL) for SL in fluids], dtype='float64')   # [amu]
+    # per-pair info
+    kind = np.empty(len(pairs), dtype='int64')
+    coeff = np.empty(len(pairs), dtype='float64')
+    itab = np.zeros(len(pairs), dtype='int64')
+    cross_tabs = []
+    for k, (iSL, jSL) in enumerate(pairs):
+        kind[k], coeff[k], cross_tab = _pair_coefficients(obj, iSL, jSL)
+        if cross_tab is not None:
+            if cross_tab not in cross_tabs:
+                cross_tabs.append(cross_tab)
+            itab[k] = cross_tabs.index(cross_tab)
+    coeff *= weights
+    if len(cross_tabs) > 0:
+        crossobj = obj.cross_sect(cross_tab=cross_tabs)
+        tables = crossobj._stacked_table(tuple(range(len(cross_tabs))), ('el',))
+        crossunits = np.array([crossobj.cross_tab[i]['crossunits'] for i in range(len(cross_tabs))])
+        coeff[kind == COLL_EL] *= crossunits[itab[kind == COLL_EL]]
+    else:
+        tables = _EMPTY_CROSS_TABLES
+    if np.any(kind == COLL_CL):
+        logcul = np.ravel(np.asarray(obj.get_var('logcul')), order=order)
+    else:
+        logcul = np.zeros(1, dtype=dtype)
+    result = np.zeros((nout, nr.shape[1]), dtype=dtype)
+    ipair = np.array([ifluid[iSL] for iSL, jSL in pairs], dtype='int64')
+    jpair = np.array([ifluid[jSL] for iSL, jSL in pairs], dtype='int64')
+    args = (nr, tg, logcul, mass, ipair, jpair, kind, coeff, itab, *tables, dest, result)
+    with tools.parallelism(tools.obj_num_threads(obj)):
+        stagger._numba_call(_colfreq_sums, args)
+    return result.reshape((nout,) + shape, order=order)
+
+
+# args for _colfreq_sums which describe the cross section tables, when there are no tables.
+_EMPTY_CROSS_TABLES = (np.zeros((1, 2)), np.full(1, 2, dtype='int64'), np.zeros((1, 2, 1)),
+                       np.zeros(1), np.ones(1), np.zeros((1, 1), dtype='int64'), np.ones(1, dtype='int64'))
+
+
+def _pair_coefficients(obj, iSL, jSL):
+    '''returns (kind, coeff, cross_tab) for nu_ij with ifluid=iSL, jfluid=jSL, as needed by _colfreq_sums.
+    kind: COLL_EL, COLL_MX, or COLL_CL. coeff: number.
+    cross_tab: None, or cross section table filename for COLL_EL.
+    Same formulas as 'nu_ij_el', 'nu_ij_mx', and 'nu_ij_cl' in load_mf_quantities.get_mf_colf,
+    with the unit conversions (e.g. of nr_j) included in coeff.
+    '''
+    coll_type = obj.get_coll_type(iSL=iSL, jSL=jSL)   # gets 'EL', 'MX', 'CL', or ('EE', implied coll_type)
+    if coll_type is not None and coll_type[0] == 'EE':
+        coll_type = coll_type[1]
+    if coll_type not in ('EL', 'MX', 'CL'):
+        mf_param_file = obj.get_param('mf_param_file', default='mf_params.in')
+        errmsg = (f"Found no valid coll_keys for ifluid={iSL}, jfluid={jSL}. "
+                  "looked for 'CL' for coulomb collisions, or 'EL' or 'MX' for other collisions. "
+                  f"You can enter coll_keys in the COLL_KEYS section in mf_param_file='{mf_param_file}'.")
+        raise ValueError(errmsg)
+    uni = obj.uni
+    m_i = obj.get_mass(iSL)                # [amu]
+    m_j = obj.get_mass(jSL)                # [amu]
+    m_jfrac = m_j / (m_i + m_j)            # [(dimensionless)]
+    m_ij = m_i * m_jfrac                   # [amu]
+    if coll_type == 'EL':
+        # nu_ij = 4/3 * n_j * m_jfrac * cross * tg_speed, with tg_speed = sqrt(8 kB tgij / (pi m_ij)).
+        tg_speed_coeff = np.sqrt(8 * (uni.kboltzmann / uni.amu) / (np.pi * m_ij))   # [cm s^-1 K^-1/2]
+        coeff = 4./3. * uni.u_nr * m_jfrac * tg_speed_coeff / uni.u_hz   # (times crossunits, later.)
+        return (COLL_EL, coeff, obj.get_cross_tab(iSL=iSL, jSL=jSL))
+    elif coll_type == 'CL':
+        icharge = obj.get_charge(iSL)   # [elementary charge == 1]
+        jcharge = obj.get_charge(jSL)   # [elementary charge == 1]
+        m_h = uni.m_h / uni.amu         # [amu]
+        scalars = 1.7 * 1/20.0 * (m_h/m_i) * (m_ij/m_h)**0.5 * icharge**2 * jcharge**2 / uni.u_hz
+        return (COLL_CL, scalars * uni.u_nr, None)
+    else:  # coll_type == 'MX'
+        # see 'nu_ij_mx' in load_mf_quantities.get_mf_colf for details.
+        CONST_MULT = 1.96
+        CONST_ALPHA_N = 6.67e-31  # [m^3]
+        eps0 = 8.854187e-12
+        CONST_RATIO = (uni.qsi_electron / uni.amusi) * (uni.qsi_electron / eps0) * CONST_ALPHA_N  # [s^-2]
+        coeff = CONST_MULT * uni.usi_nr * np.sqrt(CONST_RATIO * m_j / (m_i * (m_i + m_j))) / uni.usi_hz
+        return (COLL_MX, coeff, None)
+
+
+@tools.lazy_njit(parallel=True, cache=stagger.NUMBA_CACHE)
+def _colfreq_sums(nr, tg, logcul, mass, ipair, jpair, kind, coeff, itab,
+                  lntg, nlntg, values, lntg0, dlntg, lookup, nlookup, dest, out):
+    '''out[dest[k]] += nu_ij for each pair k, in one pass over the grid.
+    nr, tg: 2D arrays (nfluids, npoints). number density [simu. units] and temperature [K] of each fluid.
+    logcul: 1D array (npoints,), coulomb logarithm. (unused, and can be length 1, if no kind is COLL_CL)
+    mass: 1D array (nfluids,), mass [amu] of each fluid.
+    ipair, jpair, kind, coeff, itab: 1D arrays (npairs,). fluids (indices for nr), collision type,
+        coefficient, and cross section table index (for COLL_EL) of each pair. See _pair_coefficients.
+    lntg, ..., nlookup: cross section tables; see bifrost._cross_interp_linear.
+    out: 2D array (nout, npoints). Must be initialized (usually to 0) before calling.
+    '''
+    npoints = nr.shape[1]
+    for k in range(ipair.shape[0]):
+        i = ipair[k]
+        j = jpair[k]
+        wi = mass[j] / (mass[i] + mass[j])   # tgij = wi * tg_i + wj * tg_j   [K]
+        wj = mass[i] / (mass[i] + mass[j])
+        c = coeff[k]
+        n = dest[k]
+        if kind[k] == COLL_EL:
+            tab = itab[k]
+            for p in prange(npoints):
+                tgij = wi * tg[i, p] + wj * tg[j, p]
+                # find m, t for interpolating in table tab at log(tgij).
+                # (same as in bifrost._cross_interp_linear.)
+                x = np.log(np.float64(tgij))
+                if not (x > lntg[tab, 0]):   # (also catches nan; then nu_ij is nan via sqrt(tgij) below.)
+                    x = lntg[tab, 0]
+                if x > lntg[tab, nlntg[tab] - 1]:
+                    x = lntg[tab, nlntg[tab] - 1]
+                ilookup = min(max(int((x - lntg0[tab]) / dlntg[tab]), 0), nlookup[tab] - 1)
+                m = lookup[tab, ilookup]
+                while (m < nlntg[tab] - 2) and (lntg[tab, m + 1] <= x):
+                    m += 1
+                width = lntg[tab, m + 1] - lntg[tab, m]
+                t = (x - lntg[tab, m]) / width if width > 0 else 0.0
+                cross = (1 - t) * values[tab, m, 0] + t * values[tab, m + 1, 0]
+                out[n, p] += c * nr[j, p] * cross * np.sqrt(tgij)
+        elif kind[k] == COLL_CL:
+            for p in prange(npoints):
+                tgij = wi * tg[i, p] + wj * tg[j, p]
+                out[n, p] += c * logcul[p] * nr[j, p] / (tgij * np.sqrt(tgij))
+        else:
+            for p in prange(npoints):
+                out[n, p] += c * nr[j, p]
@@ -0,0 +1,334 @@
+"""
+purpose:
+
+    - remember results of get_var on disk, across python sessions. (see DiskCache)
+
+DiskCache is an optional disk tier for the caching in file_memory.with_caching.
+Results of top-level calls to get_var (for quantities which are not simple vars) are
+saved as .npy files, and read as memmaps (np.load(..., mmap_mode='r')) when requested again
+by a top-level call. (Internal calls always calculate their values, since getters may edit them in-place.)
+
+Each result is keyed by the run (obj.file_root), the variable, obj._metadata()
+(which tells e.g. the snapshot, fluids, domain, and stagger settings), and the other attrs
+of obj which affect the result (KEY_ATTRS, e.g. sel_units).
+Each result also remembers the modification times of the source files of its snapshot
+(obj._snapshot_files()); if any of those files change, the result is ignored (and deleted),
+similar to how file_memory.remember_and_recall ignores remembered data from modified files.
+
+The total size of the cache is capped at max_MB; when full, the least-recently-used
+results are deleted first.
+
+Example:
+    dd = BifrostData(..., disk_cache=True)   # use DISK_CACHE_DIR
+    dd = BifrostData(..., disk_cache='/scratch/me/helita_cache')
+    dd.get_var('tg')    # calculates tg; saves it to the disk cache.
+    # later, in another python session:
+    dd.get_var('tg')    # memmap of tg, from the disk cache.
+
+For inspecting and pruning the cache from the command line, see disk_cache_cli.
+"""
+
+# import builtins
+import os
+import json
+import time
+import hashlib
+import warnings
+
+# import external public modules
+import numpy as np
+
+# import internal modules
+from . import document_vars
+
+# set defaults
+DISK_CACHE_DIR = os.environ.get('HELITA_CACHE_DIR',
+                                os.path.join(os.path.expanduser('~'), '.cache', 'helita', 'get_var'))
+DISK_CACHE_MAX_MB = 10 * 1024   # default max size of the disk cache.
+DATA_EXT = '.npy'     # extension for files with values.
+META_EXT = '.meta'    # extension for files with info about values, as JSON. (modified time tells last use.)
+# attrs of obj which affect the results of get_var, other than the ones in obj._metadata().
+KEY_ATTRS = ('sel_units', 'internal_means', 'ghost_analyse', 'dtype')
+
+
+''' --------------------- keys --------------------- '''
+
+
+def _hashable(x):
+    '''returns a deterministic, hashable representation of x, for making keys.'''
+    if isinstance(x, dict):
+        return tuple((key, _hashable(val)) for key, val in sorted(x.items()))
+    elif isinstance(x, (list, tuple)):
+        return tuple(_hashable(val) for val in x)
+    elif isinstance(x, np.ndarray):
+        return ('ndarray', x.tolist())
+    elif isinstance(x, np.generic):
+        return x.item()
+    else:
+        return x
+
+
+def key_metadata(obj):
+    '''returns dict telling the current state of obj, for keys: obj._metadata() and KEY_ATTRS.'''
+    result = obj._metadata(with_nfluid=2)
+    result.update({attr: getattr(obj, attr, None) for attr in KEY_ATTRS})
+    return result
+
+
+def make_key(obj, var):
+    '''returns key for var, at the current state of obj (see key_metadata).'''
+    metadata = key_metadata(obj)
+    info = (os.path.abspath(obj.file_root), var, _hashable(metadata))
+    return hashlib.sha1(repr(info).encode()).hexdigest()
+
+
+def _source_mtimes(obj):
+    '''returns dict of {filename: modification time} for the source files of obj's current snap.'''
+    result = dict()
+    for filename in obj._snapshot_files():
+        try:
+            result[filename] = os.stat(filename).st_mtime
+        except OSError:
+            result[filename] = None
+    return result
+
+
+''' --------------------- meta info --------------------- '''
+# meta info is stored as JSON (not pickle),
+# so that reading a (possibly shared) cache directory never runs arbitrary code.
+
+
+def _json_default(x):
+    '''returns JSON-serializable version of x, for the values which json doesn't know how to serialize.'''
+    if isinstance(x, np.generic):
+        return x.item()
+    elif isinstance(x, np.ndarray):
+        return x.tolist()
+    else:
+        return repr(x)   # e.g. slices. (only used for displaying meta info; keys come from make_key.)
+
+
+def _quant_tree_to_json(tree):
+    '''returns dict with the info from document_vars.QuantTree tree, which can be stored as JSON.'''
+    data = list(tree.data) if isinstance(tree.data, document_vars.QuantInfo) else None
+    children = [_quant_tree_to_json(child) for child in tree.children]
+    return dict(data=data, level=tree._level, children=children)
+
+
+def _quant_tree_from_json(info):
+    '''returns document_vars.QuantTree from info (see _quant_tree_to_json).'''
+    data = None if info['data'] is None else document_vars.QuantInfo(*info['data'])
+    tree = document_vars.QuantTree(data, level=info['level'])
+    tree.children = [_quant_tree_from_json(child) for child in info['children']]
+    return tree
+
+
+def _qtracking_state_to_json(state):
+    '''returns the quant tracking state (see document_vars.get_quant_tracking_state), as dict for JSON.'''
+    if state is None:
+        return None
+    return dict(quants_tree=_quant_tree_to_json(state['quants_tree']),
+                quant_selected=list(state['quant_selected']))
+
+
+def _qtracking_state_from_json(info):
+    '''returns the quant tracking state from info (see _qtracking_state_to_json).'''
+    if info is None:
+        return None
+    return dict(quants_tree=_quant_tree_from_json(info['quants_tree']),
+                quant_selected=document_vars.QuantInfo(*info['quant_selected']),
+                _from_internal=False, _ever_restored=False)
+
+
+''' --------------------- DiskCache --------------------- '''
+
+
+class DiskCache():
+    '''cache of results of get_var, stored in files in directory dir.
+
+    dir: None or string
+        directory for the cache. None --> use DISK_CACHE_DIR.
+    max_MB: number, default DISK_CACHE_MAX_MB
+        maximum total size of the files in the cache. Least-recently-used files are deleted first.
+    min_calctime: number, default 0
+        only save results which took at least this many seconds to calculate.
+
+    self.performance tells the number of values read from the cache (N_recalled),
+    the number of values saved to the cache (N_saved),
+    and the total time saved by reading values (time_saved_estimate).
+    '''
+
+    def __init__(self, dir=None, max_MB=DISK_CACHE_MAX_MB, min_calctime=0):
+        self.dir = os.path.abspath(DISK_CACHE_DIR if dir is None else dir)
+        self.max_MB = max_MB
+        self.min_calctime = min_calctime
+        self.performance = dict(time_saved_estimate=0, N_recalled=0, N_saved=0)
+
+    def _paths(self, key):
+        '''returns (path to data file, path to meta file) for key.'''
+        base = os.path.join(self.dir, key)
+        return base + DATA_EXT, base + META_EXT
+
+    ## GETTING AND SAVING VALUES ##
+    def get(self, obj, var):
+        '''returns (value, meta) for var at the current state of obj, if it is in self; else (None, None).
+        value is a read-only memmap (or a scalar). meta is a dict of info about value.
+        '''
+        datapath, metapath = self._paths(make_key(obj, var))
+        if not os.path.exists(metapath):
+            return (None, None)
+        try:
+            meta = self.read_meta(metapath)
+            if meta['sources'] != _source_mtimes(obj):
+                self.remove(datapath, metapath)   # a source file was modified; this value is outdated.
+                return (None, None)
+            value = np.load(datapath, mmap_mode='r', allow_pickle=False)
+        except (json.JSONDecodeError, UnicodeDecodeError):   # e.g. meta from an older version of helita.
+            self.remove(datapath, metapath)
+            return (None, None)
+        except Exception as err:
+            warnings.warn(f'failed to read {repr(var)} from disk cache (at {repr(metapath)}): {err!r}')
+            return (None, None)
+        if np.ndim(value) == 0:
+            value = value[()]
+        os.utime(metapath)   # bookkeeping for LRU. (the modification time of metapath tells the last use.)
+        self.performance['N_recalled'] += 1
+        self.performance['time_saved_estimate'] += meta.get('calctime', 0) or 0
+        return (value, meta)
+
+    def cacheable(self, obj, var, val, calctime=None):
+        '''returns whether val (the value of var at current state of obj) should be saved to self.'''
+        if var in getattr(obj, 'simple_vars', []):
+            return False   # simple vars are already read via memmaps.
+        if (calctime is not None) and (calctime < self.min_calctime):
+            return False
+        if isinstance(val, np.ndarray):
+            # only plain arrays. (e.g. stagger.ArrayOnMesh would lose its mesh location.)
+            return (type(val) in (np.ndarray, np.memmap)) and (val.dtype != object)
+        return isinstance(val, (int, float, complex, np.number))
+
+    def cache(self, obj, var, val, calctime=None, qtracking_state=None):
+        '''saves val (the value of var at the current state of obj) to self.'''
+        os.makedirs(self.dir, exist_ok=True)
+        datapath, metapath = self._paths(make_key(obj, var))
+        meta = dict(run=os.path.abspath(obj.file_root), var=var, snap=getattr(obj, 'snap', None),
+                    metadata=key_metadata(obj), sources=_source_mtimes(obj),
+                    nbytes=np.asarray(val).nbytes, calctime=calctime, created=time.time(),
+                    qtracking_state=_qtracking_state_to_json(qtracking_state))
+        # write to temporary files first, then rename, so other processes never see partial files.
+        tmpsuffix = '.tmp{}'.format(os.getpid())
+        with open(datapath + tmpsuffix, 'wb') as f:
+            np.save(f, np.asarray(val), allow_pickle=False)
+        with open(metapath + tmpsuffix, 'w') as f:
+            json.dump(meta, f, default=_json_default)
+        os.replace(datapath + tmpsuffix, datapath)
+        os.replace(metapath + tmpsuffix, metapath)
+        self.performance['N_saved'] += 1
+        self.prune(max_MB=self.max_MB)
+
+    ## MANAGING CONTENTS ##
+    def entries(self):
+        '''returns list of (metapath, last used time, nbytes), sorted from least- to most-recently used.'''
+        result = []
+        if not os.path.isdir(self.dir):
+            return result
+        for name in os.listdir(self.dir):
+            if not name.endswith(META_EXT):
+                continue
+            metapath = os.path.join(self.dir, name)
+            datapath = metapath[:-len(META_EXT)] + DATA_EXT
+            try:
+                result.append((metapath, os.stat(metapath).st_mtime, os.stat(datapath).st_size))
+            except OSError:
+                continue   # (e.g. removed by another process.)
+        return sorted(result, key=lambda entry: entry[1])
+
+    def read_meta(self, metapath):
+        '''returns the meta info (dict) saved at metapath.
+        meta['qtracking_state'] is None or a quant tracking state
+        (see document_vars.get_quant_tracking_state).
+        '''
+        with open(metapath) as f:
+            meta = json.load(f)
+        meta['qtracking_state'] = _qtracking_state_from_json(meta.get('qtracking_state'))
+        return meta
+
+    def remove(self, datapath, metapath):
+        '''removes the files for one entry in self.'''
+        for path in (metapath, datapath):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def nbytes(self):
+        '''returns total number of bytes of data in self.'''
+        return sum(entry[2] for entry in self.entries())
+
+    def prune(self, max_MB=None, older_than=None, stale=False):
+        '''removes entries from self. returns (number of entries removed, number of bytes removed).
+
+        max_MB: None or number
+            remove least-recently-used entries until total size is at most max_MB.
+        older_than: None or number
+            remove entries which were not used within this many seconds.
+        stale: bool, default False
+            remove entries whose source files have been modified or removed.
+        '''
+        entries = self.entries()
+        total = sum(entry[2] for entry in entries)
+        max_nbytes = None if max_MB is None else max_MB * 1024 * 1024
+        now = time.time()
+        nremoved = nbytes_removed = 0
+        for metapath, last_used, nbytes in entries:
+            remove = False
+            if (max_nbytes is not None) and (total > max_nbytes):
+                remove = True
+            elif (older_than is not None) and (now - last_used > older_than):
+                remove = True
+            elif stale:
+                try:
+                    remove = _stale(self.read_meta(metapath))
+                except Exception:
+                    remove = True   # unreadable entry.
+            if remove:
+                self.remove(metapath[:-len(META_EXT)] + DATA_EXT, metapath)
+                total -= nbytes
+                nremoved += 1
+                nbytes_removed += nbytes
+        return nremoved, nbytes_removed
+
+    def clear(self):
+        '''removes all entries from self. returns (number of entries removed, number of bytes removed).'''
+        return self.prune(max_MB=0)
+
+    def __repr__(self):
+        entries = self.entries()
+        return '<{} at {} containing {} values totaling {:.3f} MB (max_MB={})>'.format(
+            type(self).__name__, repr(self.dir), len(entries), sum(e[2] for e in entries) / 1024**2,
+            self.max_MB)
+
+
+def _stale(meta):
+    '''returns whether any of the source files for the entry with this meta info were modified or removed.'''
+    for filename, mtime in meta['sources'].items():
+        try:
+            if os.stat(filename).st_mtime != mtime:
+                return True
+        except OSError:
+            if mtime is not None:
+                return True
+    return False
+
+
+def get_disk_cache(obj):
+    '''returns obj.disk_cache as a DiskCache, or None if obj doesn't use a disk cache.
+    Also converts obj.disk_cache to a DiskCache if it is True (--> DISK_CACHE_DIR) or a string (--> dir).
+    '''
+    disk_cache = getattr(obj, 'disk_cache', None)
+    if (disk_cache is None) or (disk_cache is False):
+        return None
+    if not isinstance(disk_cache, DiskCache):
+        disk_cache = DiskCache(dir=None if (disk_cache is True) else disk_cache)
+        obj.disk_cache = disk_cache
+    return disk_cache
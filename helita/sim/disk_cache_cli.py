@@ -0,0 +1,70 @@
+"""
+purpose:
+
+    - command line interface for inspecting and pruning the get_var disk cache. (see disk_cache)
+
+Usage:
+    python -m helita.sim.disk_cache_cli info
+    python -m helita.sim.disk_cache_cli list
+    python -m helita.sim.disk_cache_cli prune --max-MB 5000 --stale
+    python -m helita.sim.disk_cache_cli clear
+    (use --dir DIR to specify a directory other than disk_cache.DISK_CACHE_DIR.)
+
+(This is separate from disk_cache, which is imported whenever helita.sim is imported,
+so that python -m runs this module without it being imported already.)
+"""
+
+# import builtins
+import sys
+import time
+import argparse
+
+# import internal modules
+from .disk_cache import DISK_CACHE_DIR, DiskCache, _stale
+
+
+def main(args=None):
+    '''command line interface for inspecting and pruning a DiskCache. See module docstring for usage.'''
+    parser = argparse.ArgumentParser(prog='python -m helita.sim.disk_cache_cli',
+                                     description='inspect and prune the helita get_var disk cache.')
+    parser.add_argument('--dir', default=None, help=f'cache directory (default: {DISK_CACHE_DIR})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('info', help='show size and number of entries')
+    subparsers.add_parser('list', help='list entries, from least- to most-recently used')
+    p_prune = subparsers.add_parser('prune', help='remove some entries')
+    p_prune.add_argument('--max-MB', type=float, default=None,
+                         help='remove least-recently-used entries above this size')
+    p_prune.add_argument('--older-than-days', type=float, default=None,
+                         help='remove entries not used for this many days')
+    p_prune.add_argument('--stale', action='store_true',
+                         help='remove entries whose source files were modified')
+    subparsers.add_parser('clear', help='remove all entries')
+    args = parser.parse_args(args)
+
+    cache = DiskCache(dir=args.dir)
+    if args.command == 'info':
+        print(cache)
+    elif args.command == 'list':
+        for metapath, last_used, nbytes in cache.entries():
+            try:
+                meta = cache.read_meta(metapath)
+            except Exception:
+                print(f'(unreadable entry) {metapath}')
+                continue
+            print(('{last_used}  {MB:10.3f} MB  stale={stale!s:5s}  snap={snap!s:>6s}  '
+                   'var={var:20s}  run={run}').format(
+                last_used=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_used)),
+                MB=nbytes / 1024**2, stale=_stale(meta), snap=meta['metadata'].get('snap', None),
+                var=meta['var'], run=meta['run']))
+    elif args.command == 'prune':
+        older_than = None if args.older_than_days is None else args.older_than_days * 24 * 3600
+        N, nbytes = cache.prune(max_MB=args.max_MB, older_than=older_than, stale=args.stale)
+        print(f'removed {N} entries ({nbytes / 1024**2:.3f} MB). Now: {cache}')
+    elif args.command == 'clear':
+        N, nbytes = cache.clear()
+        print(f'removed {N} entries ({nbytes / 1024**2:.3f} MB).')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
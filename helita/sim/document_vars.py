@@ -571,6 +571,8 @@ class QuantTree:
         self.children = []
         self._level = level
         self.hide_level = None
+        # key for this quant in a quant_planner.QuantPlan. (only set while recording one)
+        self.plan_key = None
 
     def add_child(self, child, adjusted_level=False):
         '''add child to self.
@@ -29,12 +29,17 @@ TODO:
 
 # import built-in modules
 import os
+import json
 import time
 import shutil
+import tempfile
 import warnings
+import functools
+import itertools
 import collections
+from glob import glob
 
-from . import document_vars, file_memory, fluid_tools, stagger, tools
+from . import document_vars, file_memory, fluid_tools, lazy_var, quant_planner, stagger, tools
 # import local modules
 from .bifrost import (  # for historical reasons / convenience, also import directly:
     Bifrost_units,
@@ -70,10 +75,9 @@ except ImportError:
 # import external public modules
 import numpy as np
 
-try:
-    import zarr
-except ImportError:
-    zarr = tools.ImportFailed('zarr')
+# zarr is slow to import, so it is only imported when first used (e.g. for read_mode='zc').
+zarr = tools.lazy_import('zarr')
+numcodecs = tools.lazy_import('numcodecs')   # (installed with zarr.)
 
 # import external private modules
 try:
@@ -96,6 +100,26 @@ MATCH_TYPE_DEFAULT = MATCH_PHYSICS  # can change this one. Tells whether to matc
 
 AXES = ('x', 'y', 'z')
 
+# chunk shapes (along x, y, z) for each array in .zc files. None --> the full length of that axis.
+ZC_CHUNKS = {
+    'array': (None, None, None),   # each 3D array is one chunk. (default) best for reading whole arrays.
+    'zslab': (None, None, 16),     # slabs of 16 z-planes. best for reading a few z-planes (e.g. iiz=10).
+    'pencil': (32, 32, None),      # columns along z. best for reading a few columns (e.g. iix=5, iiy=7).
+}
+ZC_CHUNKS_DEFAULT = 'array'
+ZC_METADATA_FILE = 'zc_metadata.json'   # file in the .zc folder which tells how the data was stored.
+ZC_PARTIAL_SUFFIX = '.partial'   # files are written here during (de)compression, then renamed when complete.
+# codecs for .zc files (see zc_compressor).
+#   All use blosc with byte-shuffle (unless shuffle='bit' is specified),
+#   which usually helps a lot for float data.
+ZC_CODECS = {
+    'blosc-lz4': dict(cname='lz4', clevel=5),    # fast.
+    'blosc-zstd': dict(cname='zstd', clevel=3),  # usually smaller files, but slower.
+    'blosc-blosclz': dict(cname='blosclz', clevel=5),
+    'blosc-zstd-bitshuffle': dict(cname='zstd', clevel=3, shuffle='bit'),  # best for bit-rounded data.
+}
+ZC_LOSSY_CODEC = 'blosc-zstd-bitshuffle'   # default codec when compressing with lossy=...
+
 
 class EbysusData(BifrostData, fluid_tools.Multifluid):
 
@@ -586,6 +610,19 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
         # << if we reached this line, then we know ifluid and jfluid "match" between alt and self.
         return file_memory._dict_equals(m1, m2, ignore_keys=['ifluid', 'jfluid'])
 
+    def _snapshot_files(self):
+        '''returns list of the files which store data for the current snapshot.
+        Includes the files inside self.file_root_with_io_ext,
+        e.g. snapname.io/mf_01_01/mfe/snapname_mfe_01_01_001.snap
+        '''
+        result = super()._snapshot_files()
+        snap_str = self.snap_str[self.snapInd] if np.shape(self.snap) != () else self.snap_str
+        if os.path.isdir(self.file_root_with_io_ext) and snap_str != '':
+            pattern = os.path.join(self.file_root_with_io_ext, '**', f'*{snap_str}.*')
+            snapdir_files = glob(pattern, recursive=True)
+            result.extend(sorted(snapdir_files))
+        return result
+
     # MATCH TYPE ##  # (MATCH_AUX --> match simulation values; MATCH_PHYSICS --> match physical values)
     @property
     def match_type(self):
@@ -616,8 +653,9 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
         # look for var in self.variables, if metadata is appropriate.
         if var in self.variables and self._metadata_matches(self.variables.get('metadata', dict())):
             return self.variables[var]
-        # load quantities.
-        val = load_fromfile_quantities(self, var, panic=panic, save_if_composite=False)
+        # load quantities. (simple vars are read only on the current domain, when possible.)
+        val = load_fromfile_quantities(self, var, panic=panic, save_if_composite=False,
+                                       window=(self.iix, self.iiy, self.iiz))
         if val is None:
             val = load_quantities(self, var, PLASMA_QUANT='',
                                   CYCL_RES='', COLFRE_QUANT='', COLFRI_QUANT='',
@@ -633,6 +671,7 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
     @tools.maintain_attrs('match_type', 'ifluid', 'jfluid')
     @file_memory.with_caching(cache=False, check_cache=True, cache_with_nfluid=None)
     @document_vars.quant_tracking_top_level
+    @quant_planner.plan_tracking
     def _load_quantity(self, var, panic=False):
         '''helper function for get_var; actually calls load_quantities for var.
         Also, restores self.ifluid and self.jfluid afterwards.
@@ -645,7 +684,7 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
                 mf_ispecies=None, mf_ilevel=None, mf_jspecies=None, mf_jlevel=None,
                 ifluid=None, jfluid=None, panic=False,
                 match_type=None, check_cache=True, cache=False, cache_with_nfluid=None,
-                read_mode=None, printing_stats=None,
+                read_mode=None, printing_stats=None, chunks=None, fluids=None,
                 *args, **kwargs):
         """
         Reads a given variable from the relevant files.
@@ -689,6 +728,13 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
             0 -> neither; 1 -> just ifluid; 2 -> both ifluid and jfluid.
         read_mode - None (default), 'io', or 'zc'
             if not None, first set self.read_mode to the value provided.
+        chunks - None (default), False, tuple, or 'auto'
+            if provided, return a lazy_var.LazyVar which calculates var one block at a time.
+            None --> use self.chunks. See help(BifrostData.get_var) for details.
+        fluids - None (default), 'all', or list of fluids
+            if provided, return var for each of these fluids (as ifluid), stacked along a new axis 0.
+            'all' --> self.fluid_SLs(with_electrons=False). (Use -1 or (-1,0) in a list for electrons.)
+            The get_var pre-processing is done only once; see self.get_var_stacked.
         **kwargs may contain the following:
             iSL    - alias for ifluid
             jSL    - alias for jfluid
@@ -708,6 +754,14 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
                               internal=True,  # we are inside get_var.
                               **kwargs,
                               )
+        if fluids is not None:
+            kw__preprocess.pop('internal')
+            return self.get_var_stacked(var, fluids, printing_stats=printing_stats, chunks=chunks,
+                                        **kw__preprocess)
+        if self._getting_lazy_var(chunks):
+            kw__preprocess.pop('internal')
+            return lazy_var.LazyVar(self, var, self.chunks if chunks is None else chunks, **kw__preprocess)
+
         # do pre-processing
         kw__load_quantity, kw__postprocess = self._get_var_preprocess(var, **kw__preprocess)
 
@@ -718,6 +772,71 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
         val = self._get_var_postprocess(val, var=var, printing_stats=printing_stats, **kw__postprocess)
         return val
 
+    def get_var_stacked(self, var, fluids='all', **kw__get_var):
+        """returns var for each of the fluids, stacked along a new axis 0; shape (len(fluids),) + self.shape.
+        result[i] = self.get_var(var, ifluid=fluids[i], **kw__get_var).
+        This is what get_var(var, fluids=fluids) does.
+
+        fluids: 'all' or list of fluids
+            'all' --> self.fluid_SLs(with_electrons=False).
+            list --> each fluid can be an (species, level) tuple, or -1 for electrons.
+
+        The values are put into the result one fluid at a time (see self.iter_var_fluids).
+        """
+        fluids = self._interpret_fluids(fluids)
+        vals = self.iter_var_fluids(var, fluids, **kw__get_var)
+        val = next(vals)
+        result = np.empty((len(fluids), *np.shape(val)), dtype=np.result_type(val))
+        if isinstance(val, stagger.ArrayOnMesh):
+            result = stagger.ArrayOnMesh(result, val.meshloc)
+        result[0] = val
+        for i, val in enumerate(vals, start=1):
+            result[i] = val
+        return result
+
+    def iter_var_fluids(self, var, fluids='all', panic=False, printing_stats=None, chunks=None,
+                        **kw__get_var):
+        """yields var for each of the fluids; the same values as self.get_var(var, ifluid=fluid, ...).
+        Useful for reducing over fluids (e.g. sums) without keeping the values of all fluids in memory.
+
+        fluids: 'all' or list of fluids. See self.get_var_stacked.
+
+        The get_var pre-processing (e.g. snapshot, domain, and jfluid) is done only once;
+        then each fluid goes through the usual caching and quant tracking (see self._load_quantity).
+        self.ifluid is restored when the iteration ends (or is stopped early).
+        """
+        fluids = self._interpret_fluids(fluids)
+        kw__fluids = {key: kw__get_var.pop(key, None) for key in ('ifluid', 'mf_ispecies', 'mf_ilevel',
+                                                                  'iSL', 'iS', 'iL')}
+        if any(val is not None for val in kw__fluids.values()):
+            raise ValueError(f'Cannot use fluids={fluids} together with ifluid kwargs: {kw__fluids}')
+        with self.MaintainFluids():
+            if self._getting_lazy_var(chunks):
+                for SL in fluids:
+                    yield self.get_var(var, ifluid=SL, panic=panic, chunks=chunks, **kw__get_var)
+                return
+            kw__load_quantity, kw__postprocess = self._get_var_preprocess(var, ifluid=fluids[0], panic=panic,
+                                                                          internal=True, **kw__get_var)
+            var = self.varn.get(var, var)
+            window = (self.iix, self.iiy, self.iiz)   # domain for calculating (e.g. with halo; see get_var).
+            for SL in fluids:
+                self.set_domain_iiaxes(*window)   # (top-level postprocessing restores the original domain.)
+                self.ifluid = SL
+                val = self._load_quantity(var, **kw__load_quantity)
+                yield self._get_var_postprocess(val, var=var, printing_stats=printing_stats,
+                                                **kw__postprocess)
+
+    def _interpret_fluids(self, fluids):
+        """returns list of fluids (each as (species, level) tuple), from fluids ('all' or list of fluids)."""
+        if isinstance(fluids, str):
+            if fluids != 'all':
+                raise ValueError(f"Invalid fluids={repr(fluids)}; expected 'all' or list of fluids.")
+            fluids = self.fluid_SLs(with_electrons=False)
+        fluids = [(-1, 0) if np.ndim(SL) == 0 else tuple(SL) for SL in fluids]
+        if len(fluids) == 0:
+            raise ValueError('fluids must contain at least one fluid.')
+        return fluids
+
     def _get_var_preprocess(self, var, snap=None, iix=None, iiy=None, iiz=None,
                             mf_ispecies=None, mf_ilevel=None, mf_jspecies=None, mf_jlevel=None,
                             ifluid=None, jfluid=None, panic=False, internal=False,
@@ -975,8 +1094,14 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
             return stagger.mesh_location_center()
         raise ValueError(f"Mesh location for var={var} unknown. Locations are only known for: (bx,by,bz,r,px,py,pz,e)")
 
-    def _load_simple_var_from_file(self, var, order='F', mode='r', panic=False, **kwargs):
-        '''loads the var data directly from the appropriate file. returns an array.'''
+    def _load_simple_var_from_file(self, var, order='F', mode='r', panic=False, window=None, **kwargs):
+        '''loads the var data directly from the appropriate file. returns an array.
+
+        window: None or (iix, iiy, iiz)
+            if provided, the result may be only this part of the data (for read_mode='zc').
+            In that case only the chunks which overlap with window are decompressed (see load_zarr).
+            (for read_mode='io', window is ignored, since memmaps only read the parts which are used anyway.)
+        '''
         if self.read_mode == 'io':
             assert mode in ('r', 'r+'), f"invalid mode: {mode}. Halted before deleting data. Valid modes are: 'r', 'r+'."
             filename, kw__get_mmap = self._get_simple_var_file_info(var, order=order, panic=panic, **kwargs)
@@ -984,7 +1109,7 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
         elif self.read_mode == 'zc':
             # << note that 'zc' read_mode ignores order, mode, and **kwargs
             filename, array_n = self._get_simple_var_file_meta(var, panic=panic, _meta_as_index=True)
-            result = load_zarr(filename, array_n)
+            result = load_zarr(filename, array_n, window=window)
         else:
             raise NotImplementedError(f'EbysusData.read_mode = {read_mode}')
         return result
@@ -999,6 +1124,12 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
         _kw__memmap.update(**kw__get_memmap, order=order)
         return filename, _kw__memmap
 
+    def _simple_var_location(self, var):
+        '''returns (filename, index of array in file) telling where var (for the current fluids) is stored.
+        Useful for sorting vars in on-disk order.
+        '''
+        return self._get_simple_var_file_meta(var, _meta_as_index=True)
+
     def _get_simple_var_file_meta(self, var, panic=False, _meta_as_index=False):
         '''returns "meta" info about reading var from file.
 
@@ -1220,7 +1351,14 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
         The resulting, compressed data will be stored in a folder with .{mode} at the end of it.
             e.g. self.compress(mode='zc') if data is stored in snapname.io will create snapname.zc.
         **kwargs go to the compression algorithm for the given mode.
-            e.g. for mode='zc', kwargs go to zarr.array(**kwargs).
+            e.g. for mode='zc', kwargs go to self._zc_compress, then zarr.open_array(**kwargs).
+            In particular, for mode='zc', chunks tells the chunk shape for each array; see help(zc_chunks).
+            E.g. chunks='zslab' makes it faster to read a few z-planes, e.g. get_var(var, iiz=10).
+            And codec tells how to compress each chunk; see help(zc_compressor), and self.benchmark_codecs().
+            And lossy={var: rel_tol} stores those vars with bounded relative error,
+            which compresses them much more.
+            E.g. lossy={'mfe_qcolue': 1e-3}. Reading is unchanged. See help(self._zc_compress) for details.
+            Compression is done in parallel, using self.numThreads threads.
 
         smash_mode: None (default), 'trash' or one of ('destroy', 'delete', 'rm')
             mode for smashing the original folder (containing the non-compressed data).
@@ -1236,6 +1374,7 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
         skip_existing: bool, default False
             if True, skip compressing each file for which a compressed version exists
             (only checking destination filepath to determine existence.)
+            Use this to resume compression after an interruption. (files only appear once they are complete.)
 
         returns name of created folder.
         '''
@@ -1275,6 +1414,11 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
             CAUTION: be very careful about using warn=False!
         kw_smash: dict
             additional kwargs to pass to smash_folder().
+        **kwargs go to the decompression algorithm for the given mode.
+            e.g. for mode='zc', kwargs go to self._zc_decompress.
+            (e.g. skip_existing=True to resume decompression.)
+            Decompression is done in parallel, using self.numThreads threads.
+            (vars compressed with lossy=... are decompressed with the rounding, not as the original values.)
 
         The resulting data will be stored in a folder with .io at the end of it, like the original .io folder.
         returns name of created folder.
@@ -1297,7 +1441,7 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
                 smash_folder(ORIGINAL, mode=smash_mode, warn=warn, **kw_smash)
             return result
 
-    def _zc_compress(self, verbose=1, skip_existing=False, **kw__zarr):
+    def _zc_compress(self, verbose=1, skip_existing=False, chunks=None, codec=None, lossy=None, **kw__zarr):
         '''compress the .io folder into a .zc folder.
         Converts data to format readable by zarr.
         Testing indicates the .zc data usually takes less space AND is faster to read.
@@ -1305,15 +1449,54 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
         skip_existing: bool, default False
             if True, skip compressing each file for which a compressed version exists
             (only checking destination filepath to determine existence.)
+            Each file is written to a temporary name, and renamed only when it is complete,
+            so skip_existing=True can be used to resume compression after an interruption.
+            (ValueError if the .zc folder was made with different settings; see read_zc_metadata.)
+        chunks: None, str, or tuple
+            chunk shape (along x, y, z) for each array. See help(zc_chunks) for options.
+            When reading with read_mode='zc', only the chunks which overlap iix, iiy, iiz are decompressed.
+            The chunking is recorded in the .zc folder; see read_zc_metadata.
+        codec: None, str, or numcodecs codec
+            how to compress each chunk. See help(zc_compressor) for options;
+            self.benchmark_codecs() to compare them.
+            None --> use zarr's default.
+        lossy: None or dict of {var: rel_tol}
+            if provided, round the mantissa of each var in lossy (see bitround) before compressing,
+            keeping the fewest bits which guarantee relative error <= rel_tol (see zc_keepbits).
+            E.g. lossy={'mfe_qcolue': 1e-3} keeps 9 of the 23 mantissa bits of mfe_qcolue;
+            other vars are lossless.
+            The error is checked while writing (by reading back each chunk); ValueError if it exceeds rel_tol.
+            The rounded data is still float32, so reading it requires nothing special.
+            The error bounds are recorded in the .zc folder; see read_zc_metadata.
+            Also, codec None --> ZC_LOSSY_CODEC, and zarr filters default to delta (of the bits, as int32),
+            since these compress bit-rounded data much better. (E.g. for smooth data, about 4x smaller with
+            rel_tol=1e-3, and 7x smaller with rel_tol=1e-2, compared to about 1.3x without lossy.)
+
+        Files, and the chunks within each file, are compressed in parallel using self.numThreads threads.
+        (compression in blosc releases the GIL, so threads are enough for parallelism here.)
 
         returns (the name of the new folder, the number of bytes originally, the number of bytes after compression)
         '''
         # bookkeeping - parameters
         SNAPNAME = self.get_param('snapname')
-        SHAPE = self.shape        # (nx, ny, nz). reshape the whole file to shape (nx, ny, nz, -1).
-        CHUNKS = (*(None for dim in self.shape), 1)   # (None, None, None, 1).     "1 chunk per array for each var".
+        SHAPE = (self.nxb, self.nyb, self.nzb)   # reshape the whole file to shape (nx, ny, nz, -1).
+        CHUNKS = (*zc_chunks(chunks), 1)   # e.g. (None, None, None, 1) --> "1 chunk per array for each var".
         ORDER = 'F'        # data order. 'F' for 'fortran'. Results are nonsense if the wrong order is used.
         DTYPE = '<f4'
+        lossy = dict() if lossy is None else dict(lossy)
+        unknown = [var for var in lossy if var not in self.simple_vars]
+        if len(unknown) > 0:
+            raise ValueError(f'lossy got vars which are not simple vars: {unknown}. '
+                             'Expected vars from self.simple_vars.')
+        keepbits = {var: zc_keepbits(rel_tol) for var, rel_tol in lossy.items()}
+        if len(lossy) > 0:
+            # bit-rounded values have long runs of zero bits, and neighbors usually share their leading bits.
+            # delta of the bits (as int32; exactly reversible) then bitshuffle
+            # turns both into long runs of zeros.
+            codec = ZC_LOSSY_CODEC if codec is None else codec
+            kw__zarr.setdefault('filters', [numcodecs.Delta(dtype='<i4')])
+        if codec is not None:
+            kw__zarr['compressor'] = zc_compressor(codec)
 
         # iterator through existing files
         def snapfiles_iter(makedirs=False):
@@ -1329,6 +1512,8 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
                     if makedirs:
                         os.makedirs(new_dir, exist_ok=True)
                     for base in files:
+                        if base.endswith(ZC_PARTIAL_SUFFIX):
+                            continue   # leftover from an interrupted decompression.
                         src = os.path.join(root,    base)
                         dst = os.path.join(new_dir, base)
                         if skip_existing and os.path.exists(dst):
@@ -1352,28 +1537,90 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
             print(' '*clearline, end='\r')   # cover the first <clearline> characters with empty space.
             print(*args, **kw)
 
-        # the actual compression happens in this loop.
-        file_str_len = 0
-        original_bytes_total = 0
-        compressed_bytes_total = 0
-        for file_n, (src, dst) in enumerate(snapfiles_iter(makedirs=True)):
-            z = save_filebinary_to_filezarr(src, dst, shape=SHAPE, dtype=DTYPE, order=ORDER, chunks=CHUNKS, **kw__zarr)
-            original_bytes_total += z.nbytes
-            compressed_bytes_total += z.nbytes_stored
+        # record how the data is stored, so that readers can plan which parts to read.
+        metadata = dict(shape=SHAPE, dtype=DTYPE, order=ORDER, codec=_zc_codec_name(codec),
+                        chunks=tuple(n if c is None else min(c, n) for c, n in zip(CHUNKS, SHAPE)),
+                        filters=[f.get_config()['id'] for f in (kw__zarr.get('filters') or [])],
+                        lossy={var: dict(rel_tol=lossy[var], keepbits=keepbits[var]) for var in lossy})
+        existing = read_zc_metadata(f'{SNAPNAME}.zc')
+        if skip_existing and (existing is not None):
+            metadata = json.loads(json.dumps(metadata))   # (e.g. tuples --> lists, to compare with existing.)
+            changed = [key for key in metadata if metadata[key] != existing.get(key)]
+            if len(changed) > 0:
+                raise ValueError(f'skip_existing=True, but {SNAPNAME}.zc was made with different {changed}. '
+                                 'Resume with the same settings, '
+                                 'or use skip_existing=False to redo all files.')
+        os.makedirs(f'{SNAPNAME}.zc', exist_ok=True)
+        with open(os.path.join(f'{SNAPNAME}.zc', ZC_METADATA_FILE), 'w') as f:
+            json.dump(metadata, f)
+
+        # the actual compression happens here. (see _copy_blocks_in_parallel)
+        totals = dict(file_n=0, file_str_len=0, original_bytes=0, compressed_bytes=0)
+
+        def finish_file(tmp, dst, z):
+            totals['original_bytes'] += z.nbytes
+            # (before moving z, since z still points to tmp.)
+            totals['compressed_bytes'] += _zarr_nbytes_stored(z)
+            _replace_path(tmp, dst)
             # printing updates
             if verbose:
-                file_str_len = max(file_str_len, len(dst))
-            print_if_verbose(f'{dst}', end='\r', vreq=1, file_n=file_n, clearline=40+file_str_len)
+                totals['file_str_len'] = max(totals['file_str_len'], len(dst))
+            print_if_verbose(f'{dst}', end='\r', vreq=1, file_n=totals['file_n'],
+                             clearline=40+totals['file_str_len'])
+            totals['file_n'] += 1
+
+        def copies():
+            for src, dst in snapfiles_iter(makedirs=True):
+                tmp = dst + ZC_PARTIAL_SUFFIX
+                arr = np.memmap(src, dtype=DTYPE, mode='r').reshape((*SHAPE, -1), order=ORDER)
+                chunks = tuple(n if c is None else min(c, n) for c, n in zip(CHUNKS, arr.shape))
+                z = _zarr_open_array(tmp, mode='w', shape=arr.shape, dtype=arr.dtype, chunks=chunks,
+                                     **kw__zarr)
+                if len(lossy) > 0:
+                    varnames = self._zc_file_vars(src, narr=arr.shape[-1])
+                    copy_block = functools.partial(_copy_block_lossy, arr, z,
+                                                   keepbits=[keepbits.get(var) for var in varnames],
+                                                   rel_tol=[lossy.get(var) for var in varnames])
+                else:
+                    copy_block = functools.partial(_copy_block, arr, z)
+                yield (copy_block, _chunk_blocks(z.shape, z.chunks),
+                       functools.partial(finish_file, tmp, dst, z))
+
+        _copy_blocks_in_parallel(tools.thread_pool(self), copies(), max_files=2 * max(1, self.numThreads))
 
+        original_bytes_total = totals['original_bytes']
+        compressed_bytes_total = totals['compressed_bytes']
         print_if_verbose('_zc_compress complete!' +
                          f' Compressed {tools.pretty_nbytes(original_bytes_total)}' +
                          f' into {tools.pretty_nbytes(compressed_bytes_total)}' +
                          f' (net compression ratio = {original_bytes_total/(compressed_bytes_total+1e-10):.2f}).',
-                         print_time=True, vreq=1, clearline=40+file_str_len)
+                         print_time=True, vreq=1, clearline=40+totals['file_str_len'])
         return (f'{SNAPNAME}.zc', original_bytes_total, compressed_bytes_total)
 
-    def _zc_decompress(self, verbose=1):
+    def _zc_file_vars(self, filename, narr):
+        '''returns list of the var stored in each of the narr arrays in filename (a file in the .io folder).
+        (This is the inverse of _get_simple_var_file_meta.) None for arrays which can't be identified.
+        '''
+        kind = os.path.basename(os.path.dirname(filename))   # e.g. 'mf_common', 'mfr', 'mm'.
+        if '.aux' in os.path.basename(filename):
+            varnames = dict(mf_common=self.auxvars, mfa=self.varsmf, mfr=self.varsmfr, mfp=self.varsmfp,
+                            mfe=self.varsmfe, mfc=self.varsmfc, mm=self.varsmm).get(kind, [])
+        else:
+            varnames = dict(mf_common=self.mhdvars, mfr=self.snaprvars, mfp=self.snappvars,
+                            mfe=self.snapevars, mf_e=self.snapevars).get(kind, [])
+        mf_arr_size = self.mf_total_nlevel if kind == 'mm' else 1   # number of fluids per var in the file.
+        return [varnames[i // mf_arr_size] if i // mf_arr_size < len(varnames) else None for i in range(narr)]
+
+    def _zc_decompress(self, verbose=1, skip_existing=False):
         '''use the data from the .zc folder to recreate the original .io folder.
+
+        skip_existing: bool, default False
+            if True, skip decompressing each file for which a decompressed version exists.
+            Each file is written to a temporary name, and renamed only when it is complete,
+            so skip_existing=True can be used to resume decompression after an interruption.
+
+        Files, and the chunks within each file, are decompressed in parallel using self.numThreads threads.
+
         returns the name of the new (.io) folder.
         '''
         # notes:
@@ -1386,9 +1633,20 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
         SNAPNAME = self.get_param('snapname')
         ORDER = 'F'    # data order. 'F' for 'fortran'. Results are nonsense if the wrong order is used.
 
+        def zarrays_iter():
+            '''returns iterator through zarrays to be decompressed, yielding (src, dst).'''
+            for root, dirs, files in os.walk(f'{SNAPNAME}.zc'):
+                # (if so, root is a complete zarray.)
+                if ('.zarray' in files) and not root.endswith(ZC_PARTIAL_SUFFIX):
+                    src = root
+                    dst = src.replace(f'{SNAPNAME}.zc', f'{SNAPNAME}.io')
+                    if skip_existing and os.path.exists(dst):
+                        continue
+                    yield (src, dst)
+
         # bookeeping - printing updates
         if verbose >= 1:   # calculate total number of files and print progress as fraction.
-            nfiles = sum(1 for _, _, files in os.walk(f'{SNAPNAME}.zc') if '.zarray' in files)
+            nfiles = sum(1 for _ in zarrays_iter())
             nfstr = len(str(nfiles))
             start_time = time.time()
 
@@ -1402,24 +1660,55 @@ class EbysusData(BifrostData, fluid_tools.Multifluid):
             print(' '*clearline, end='\r')   # cover the first <clearline> characters with empty space.
             print(*args, **kw)
 
-        # the actual decompression happens in this loop.
-        file_n = 0
-        file_str_len = 0
-        for root, dirs, files in os.walk(f'{SNAPNAME}.zc'):
-            if '.zarray' in files:   # then this root is actually a zarray folder.
-                file_n += 1  # bookkeeping
-                src = root
-                dst = src.replace(f'{SNAPNAME}.zc', f'{SNAPNAME}.io')
+        # the actual decompression happens here. (see _copy_blocks_in_parallel)
+        totals = dict(file_n=0, file_str_len=0)
+
+        def finish_file(tmp, dst, out):
+            out.flush()
+            _replace_path(tmp, dst)
+            # printing updates
+            totals['file_n'] += 1
+            if verbose:
+                totals['file_str_len'] = max(totals['file_str_len'], len(dst))
+            print_if_verbose(f'{dst}', end='\r', vreq=1, file_n=totals['file_n'],
+                             clearline=40+totals['file_str_len'])
+
+        def copies():
+            for src, dst in zarrays_iter():
                 os.makedirs(os.path.dirname(dst), exist_ok=True)   # make dst dir if necessary.
-                save_filezarr_to_filebinary(src, dst, order=ORDER)
-                # printing updates
-                if verbose:
-                    file_str_len = max(file_str_len, len(dst))
-                print_if_verbose(f'{dst}', end='\r', vreq=1, file_n=file_n, clearline=40+file_str_len)
+                tmp = dst + ZC_PARTIAL_SUFFIX
+                z = zarr.open(src, mode='r')
+                out = np.memmap(tmp, dtype=z.dtype, mode='w+', shape=z.shape, order=ORDER)
+                yield (functools.partial(_copy_block, z, out), _chunk_blocks(z.shape, z.chunks),
+                       functools.partial(finish_file, tmp, dst, out))
+
+        _copy_blocks_in_parallel(tools.thread_pool(self), copies(), max_files=2 * max(1, self.numThreads))
 
-        print_if_verbose('_zc_decompress complete!', print_time=True, vreq=1, clearline=40+file_str_len)
+        print_if_verbose('_zc_decompress complete!', print_time=True, vreq=1,
+                         clearline=40+totals['file_str_len'])
         return f'{SNAPNAME}.io'
 
+    def benchmark_codecs(self, codecs=None, snap=None, nfiles=4, chunks=None, verbose=True):
+        '''compresses some of the .io files of snap with each codec, and reports the compression ratio,
+        and throughput of compression and decompression. Helps to choose self.compress(codec=...).
+
+        codecs: None or list of codecs (see help(zc_compressor) for options).
+            None --> [None, *ZC_CODECS]. (None means zarr's default codec.)
+        snap: None or int. None --> self.get_snap_here().
+        nfiles: int. use the nfiles largest files from snap.
+        chunks: chunk shape (along x, y, z) for each array. See help(zc_chunks) for options.
+
+        returns dict of {codec name: dict(ratio=..., write_MBps=..., read_MBps=...)}.
+        See help(benchmark_codecs).
+        '''
+        snap = snap if snap is not None else self.get_snap_here()
+        with tools.EnterDirectory(self.fdir):
+            files = [f for f in get_snap_files(snap, dd=self, read_mode='io')
+                     if f.endswith(('.snap', '.aux'))]
+            files = sorted(files, key=os.path.getsize, reverse=True)[:nfiles]
+            return benchmark_codecs(files, shape=(self.nxb, self.nyb, self.nzb), codecs=codecs, chunks=chunks,
+                                    verbose=verbose)
+
     ## SNAPSHOT FILES - SELECTING / MOVING ##
     def get_snap_files(self, snap=None, include_aux=True):
         '''returns the minimal list of filenames for all files specific to this snap.
@@ -1950,27 +2239,75 @@ def get_numpy_memmap(filename, **kw__np_memmap):
     return np.memmap(filename, **kw__np_memmap)
 
 
-def load_zarr(filename, array_n=None):
-    '''reads zarr from file. if array_n is provided, index by [..., array_n].'''
+def load_zarr(filename, array_n=None, window=None):
+    '''reads zarr from file. if array_n is provided, index by [..., array_n].
+    window: None or (iix, iiy, iiz)
+        if provided, only read this part of the data (along the first 3 axes).
+        Each of iix, iiy, iiz can be a slice, int, or list or array of indices (or of bools).
+        Only the chunks which overlap with the bounding box of the window are decompressed.
+        ints are treated like slice(i, i+1), i.e. they do not remove that axis from the result.
+    '''
     if not os.path.exists(filename):
         raise FileNotFoundError(filename)
         # zarr error for non-existing file is confusing and doesn't include filename (as of 02/28/22)
         # so we instead do our own check if file exists, and raise a nice error if it doesn't exist.
     z = zarr.open(filename, mode='r')   # we use 'open' instead of 'load' to ensure we only read the required chunks.
+    if window is None:
+        bounds, relative = (Ellipsis,), ()
+    else:
+        bounds, relative = zip(*(_window_selection(ii, n) for ii, n in zip(window, z.shape)))
     if array_n is None:
-        result = z[...]
+        result = z[(*bounds, Ellipsis) if window is not None else Ellipsis]
     else:
-        result = z[..., array_n]
+        result = z[(*bounds, array_n) if window is not None else (Ellipsis, array_n)]
+    for i, ii in enumerate(relative):
+        if not isinstance(ii, slice):   # (ii is slice(None) if no more indexing is needed.)
+            result = result[(slice(None),)*i + (ii,)]
     return result
 
 
+def _window_selection(ii, n):
+    '''returns (bounds, relative) such that arr[bounds][relative] == arr[ii], for 1D arr with length n.
+    bounds is a slice with step 1, so it can be read from a zarr array by reading only the overlapping chunks.
+    relative is slice(None) when no more indexing is needed after arr[bounds].
+    '''
+    if isinstance(ii, slice):
+        start, stop, step = ii.indices(n)
+        if step == 1:
+            return slice(start, max(start, stop)), slice(None)
+    # (handles ints, negative steps, and lists or arrays of indices or bools.)
+    idx = np.atleast_1d(np.arange(n)[ii])
+    if idx.size == 0:
+        return slice(0, 0), slice(None)
+    lo = idx.min()
+    return slice(lo, idx.max() + 1), idx - lo
+
+
+def _zarr_open_array(store, **kw__zarr):
+    '''zarr.open_array(store, **kw__zarr), but always using zarr format 2, the format of .zc folders.
+    (zarr >= 3 uses format 3 by default; zarr 2 only knows about format 2.)
+    '''
+    if int(zarr.__version__.split('.')[0]) >= 3:
+        kw__zarr.setdefault('zarr_format', 2)
+    return zarr.open_array(store, **kw__zarr)
+
+
+def _zarr_nbytes_stored(z):
+    '''returns number of bytes stored for zarr array z.
+    (nbytes_stored is a method in zarr >= 3; a property in zarr 2.)
+    '''
+    nbytes = z.nbytes_stored
+    return nbytes() if callable(nbytes) else nbytes
+
+
 def save_filebinary_to_filezarr(src, dst, shape, dtype='<f4', order='F',
                                 chunks=(None, None, None, 1), **kw__zarr):
     '''converts file of binary data (at src) to saved zarr (at dst).
     shape: tuple
         the shape of a single array at src. reshapes memmap to (*shape, -1).
         E.g. src with 6 arrays, each of shape=(3,4,5) will end up as array with shape (3,4,5,6).
-    chunks: chunking rule for zarr.
+    chunks: chunking rule for zarr; one value per axis of the reshaped data.
+        None --> the full length of that axis.
         default is to make each full 3D array its own chunk.
         E.g. src with 6 arrays, each of shape=(3,4,5) will be stored in 6 chunks, one for each array.
         if using a non-3D shape, a different value for chunks is required.
@@ -1978,11 +2315,224 @@ def save_filebinary_to_filezarr(src, dst, shape, dtype='<f4', order='F',
     returns a zarr.array of the data from src.
     '''
     arr = np.memmap(src, dtype=dtype).reshape((*shape, -1), order=order)
-    z = zarr.array(arr, chunks=chunks, **kw__zarr)
-    zarr.save(dst, z)
+    chunks = tuple(n if c is None else min(c, n) for c, n in zip(chunks, arr.shape))
+    z = _zarr_open_array(dst, mode='w', shape=arr.shape, dtype=arr.dtype, chunks=chunks, **kw__zarr)
+    z[...] = arr
     return z
 
 
+def zc_compressor(codec=None):
+    '''returns numcodecs compressor for codec.
+    codec: None, str, or numcodecs codec
+        None --> return None. (Use zarr's default compressor.)
+        str --> blosc with the options from ZC_CODECS[codec]. (byte-shuffle, unless shuffle='bit' there.)
+        numcodecs codec --> return codec, unchanged.
+    '''
+    if (codec is None) or not isinstance(codec, str):
+        return codec
+    try:
+        kw__blosc = dict(ZC_CODECS[codec])
+    except KeyError:
+        raise ValueError(f'Invalid codec={repr(codec)}; '
+                         f'expected numcodecs codec or one of {list(ZC_CODECS)}.') from None
+    shuffle = kw__blosc.pop('shuffle', 'byte')
+    shuffle = numcodecs.Blosc.BITSHUFFLE if shuffle == 'bit' else numcodecs.Blosc.SHUFFLE
+    return numcodecs.Blosc(shuffle=shuffle, **kw__blosc)
+
+
+def _zc_codec_name(codec):
+    '''returns name for codec. 'default' if codec is None, codec if codec is a str, else repr(codec).'''
+    return 'default' if codec is None else (codec if isinstance(codec, str) else repr(codec))
+
+
+def zc_keepbits(rel_tol):
+    '''returns the smallest number of mantissa bits to keep (of the 23 in float32) such that bitround
+    guarantees relative error <= rel_tol. rel_tol must be between 0 and 1.
+    E.g. rel_tol=1e-3 --> 9 bits; rel_tol=1e-5 --> 16 bits.
+    '''
+    if not (0 < rel_tol < 1):
+        raise ValueError(f'Expected 0 < rel_tol < 1, but got rel_tol={rel_tol}.')
+    return int(min(max(np.ceil(-np.log2(rel_tol) - 1), 0), 23))
+
+
+def bitround(arr, keepbits):
+    '''returns a copy of float32 arr, with each mantissa rounded (to nearest, ties to even) to keepbits bits.
+    The relative error is at most 2**-(keepbits+1); see zc_keepbits.
+    The zeroed trailing bits do not change how the data is read, but make it much more compressible.
+    Zero, subnormal, and non-finite values are kept unchanged.
+    '''
+    arr = np.ascontiguousarray(arr, dtype='<f4')
+    maskbits = 23 - keepbits
+    if maskbits <= 0:
+        return arr.copy()
+    bits = arr.view(np.uint32)
+    half = np.uint32((1 << (maskbits - 1)) - 1)
+    mask = np.uint32((0xFFFFFFFF >> maskbits) << maskbits)
+    rounded = ((bits + half + ((bits >> maskbits) & 1)) & mask).view('<f4')
+    keep = ~(np.abs(arr) >= np.finfo(np.float32).tiny) | ~np.isfinite(rounded)
+    return np.where(keep, arr, rounded)
+
+
+def zc_rel_error(original, rounded):
+    '''returns the maximum of |rounded - original| / |original|.
+    Entries where rounded == original count as 0 (even if original is 0 or inf);
+    NaN in both places counts as 0.
+    '''
+    original = np.asarray(original, dtype='float64')
+    rounded = np.asarray(rounded, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        err = np.abs(rounded - original) / np.abs(original)
+    err[(rounded == original) | (np.isnan(rounded) & np.isnan(original))] = 0
+    return float(np.max(err, initial=0))
+
+
+def _chunk_blocks(shape, chunks):
+    '''returns list of tuples of slices; one for each chunk of an array with this shape and chunk shape.'''
+    ranges = [range(0, n, c) for n, c in zip(shape, chunks)]
+    return [tuple(slice(i, i + c) for i, c in zip(corner, chunks)) for corner in itertools.product(*ranges)]
+
+
+def _copy_block(src, dst, block):
+    '''dst[block] = src[block]. Used by _copy_blocks_in_parallel.'''
+    dst[block] = np.asarray(src[block])
+
+
+def _copy_block_lossy(src, dst, block, keepbits, rel_tol):
+    '''dst[block] = bitround(src[block], keepbits[i]),
+    where i is the index of the array (along the last axis) of block.
+    Then reads dst[block] back, and checks that the relative error is at most rel_tol[i];
+    raise ValueError if not.
+    keepbits[i] None --> copy without rounding. (blocks must be one array thick along the last axis.)
+    Used by _copy_blocks_in_parallel.
+    '''
+    i = block[-1].start
+    if keepbits[i] is None:
+        return _copy_block(src, dst, block)
+    original = np.asarray(src[block])
+    dst[block] = bitround(original, keepbits[i])
+    err = zc_rel_error(original, np.asarray(dst[block]))
+    if not (err <= rel_tol[i]):
+        raise ValueError(f'Relative error ({err:.3g}) exceeds rel_tol ({rel_tol[i]:.3g}) '
+                         f'for array {i}, block {block}.')
+
+
+def _copy_blocks_in_parallel(pool, copies, max_files):
+    '''does copy_block(block) for (copy_block, blocks, done) in copies, and each block in blocks, using pool.
+    (e.g. copy_block = functools.partial(_copy_block, src, dst) --> dst[block] = src[block].)
+    done() is called (in this thread) when all the blocks of that file are copied.
+    copies is iterated lazily, so that at most max_files files are being copied at once.
+        (e.g. max_files = 2 * (number of workers in pool), so that the workers always have blocks to copy.)
+    This gives file-level parallelism (many files at once),
+    and chunk-level parallelism (many blocks of each file),
+    without ever waiting for a task of pool inside of another task of pool.
+    '''
+    in_progress = collections.deque()
+
+    def finish_oldest():
+        futures, done = in_progress.popleft()
+        for future in futures:
+            future.result()   # (raises the error, if the copy failed.)
+        done()
+    for copy_block, blocks, done in copies:
+        in_progress.append(([pool.submit(copy_block, block) for block in blocks], done))
+        if len(in_progress) > max_files:
+            finish_oldest()
+    while len(in_progress) > 0:
+        finish_oldest()
+
+
+def _replace_path(tmp, dst):
+    '''moves tmp to dst, replacing dst if it exists. (tmp and dst can be files or directories.)'''
+    if os.path.isdir(dst):
+        shutil.rmtree(dst)
+    os.replace(tmp, dst)
+
+
+def benchmark_codecs(files, shape, codecs=None, chunks=None, dtype='<f4', order='F', verbose=True):
+    '''compresses files with each codec, then reports compression ratio and throughput of writing and reading.
+    Helps to choose codec for EbysusData.compress(codec=...). See also EbysusData.benchmark_codecs.
+
+    files: list of binary files (e.g. from a snapshot in the .io folder).
+    shape: shape of a single array in files, e.g. (nx, ny, nz).
+    codecs: None or list of codecs (see help(zc_compressor) for options).
+        None --> [None, *ZC_CODECS]. (None means zarr's default codec.)
+    chunks: chunk shape (along x, y, z) for each array. See help(zc_chunks) for options.
+
+    The files are read once before the benchmark, so that the times don't depend on the order of the codecs.
+    Data is written to a temporary directory, which is deleted afterwards.
+
+    returns dict of {codec name: dict(ratio=compression ratio,
+                                      write_MBps=MB/s compressed, read_MBps=MB/s decompressed)}.
+        (MB of uncompressed data, in both cases.)
+    '''
+    if codecs is None:
+        codecs = [None, *ZC_CODECS]
+    chunks = (*zc_chunks(chunks), 1)
+    for src in files:
+        np.fromfile(src, dtype=dtype)   # read the files once, so that they are in the OS file cache.
+    result = dict()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for codec in codecs:
+            kw__zarr = dict() if codec is None else dict(compressor=zc_compressor(codec))
+            nbytes, nbytes_stored, write_time, read_time = 0, 0, 0, 0
+            for i, src in enumerate(files):
+                dst = os.path.join(tmpdir, f'{i}.zarr')
+                start = time.perf_counter()
+                z = save_filebinary_to_filezarr(src, dst, shape=shape, dtype=dtype, order=order,
+                                                chunks=chunks, **kw__zarr)
+                write_time += time.perf_counter() - start
+                start = time.perf_counter()
+                load_zarr(dst)
+                read_time += time.perf_counter() - start
+                nbytes += z.nbytes
+                nbytes_stored += _zarr_nbytes_stored(z)
+                shutil.rmtree(dst)
+            name = _zc_codec_name(codec)
+            result[name] = dict(ratio=nbytes / max(nbytes_stored, 1),
+                                write_MBps=nbytes / 1e6 / max(write_time, 1e-9),
+                                read_MBps=nbytes / 1e6 / max(read_time, 1e-9))
+            if verbose:
+                print(f'{name:>16s}: ratio = {result[name]["ratio"]:5.2f}, '
+                      f'write = {result[name]["write_MBps"]:7.1f} MB/s, '
+                      f'read = {result[name]["read_MBps"]:7.1f} MB/s')
+    return result
+
+
+def zc_chunks(chunks=None):
+    '''returns chunk shape (along x, y, z) for each array in .zc files, from chunks.
+    chunks: None, str, or tuple of 3 ints (or None)
+        None --> use ZC_CHUNKS_DEFAULT.
+        str --> use ZC_CHUNKS[chunks]. Options: 'array', 'zslab', 'pencil'.
+        tuple --> use this tuple. None --> the full length of that axis.
+    '''
+    if chunks is None:
+        chunks = ZC_CHUNKS_DEFAULT
+    if isinstance(chunks, str):
+        try:
+            chunks = ZC_CHUNKS[chunks]
+        except KeyError:
+            raise ValueError(f'Invalid chunks={repr(chunks)}; '
+                             f'expected tuple or one of {list(ZC_CHUNKS)}.') from None
+    if len(chunks) != 3:
+        raise ValueError(f'Expected chunks for 3 axes (x, y, z), but got chunks={chunks}.')
+    return tuple(chunks)
+
+
+def read_zc_metadata(zcfolder):
+    '''returns the metadata (dict) telling how the data in zcfolder (e.g. snapname.zc) was stored.
+    Keys are 'shape', 'dtype', 'order', 'chunks' (chunk shape along x, y, z, for each array),
+    'codec', 'filters', and 'lossy' ({var: dict(rel_tol, keepbits)} for each var stored with bounded error;
+    see EbysusData._zc_compress).
+    returns None if there is no metadata (e.g. zcfolder was made before the metadata was recorded);
+        in that case the data was stored with ZC_CHUNKS['array'].
+    '''
+    filename = os.path.join(zcfolder, ZC_METADATA_FILE)
+    if not os.path.isfile(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f)
+
+
 def save_filezarr_to_filebinary(src, dst, order='F'):
     '''converts saved zarr file to file of binary data.
     (creates a new file; does not delete the source file.)
@@ -26,6 +26,7 @@ TODO:
 import os
 import sys  # for debugging 'too many files' crash; will be removed in the future
 import time  # for time profiling for caching
+import heapq
 import weakref  # for refering to parent in cache without making circular reference.
 # import builtins
 import resource
@@ -34,7 +35,7 @@ import functools
 from collections import OrderedDict, namedtuple
 
 # import local modules
-from . import document_vars
+from . import disk_cache, document_vars
 
 # import external public modules
 try:
@@ -64,6 +65,9 @@ SOFT_PER_OBJ = 0.1     # limit number of open memmaps in one object to SOFT_PER_
 
 HIDE_DECORATOR_TRACEBACKS = True  # whether to hide decorators from this file when showing error traceback.
 
+CACHE_POLICIES = ('greedydual', 'lru')  # options for which entries Cache deletes first. See help(Cache).
+CACHE_POLICY = 'greedydual'             # default policy for Cache.
+
 
 DEBUG_MEMORY_LEAK = False  # whether to turn on debug messages to tell when Cache and/or EbysusData are deleted.
 # There is currently a memory leak which seems unrelated to file_memory.py,
@@ -354,16 +358,24 @@ CacheEntry.__str__ = _new_cache_entry_str_
 class Cache():
     '''cache results of get_var.
     can contain up to self.max_MB MB of data, and up to self.max_Narr entries.
-    Deletes oldest entries first when needing to free up space.
+    When needing to free up space, deletes entries based on self.policy:
+        'greedydual' --> GreedyDual-Size: delete entries with the smallest calctime / nbytes first,
+                        i.e. keep the values which are expensive to calculate but small to store.
+                        Each entry's priority is refreshed whenever it is recalled, and the priority of
+                        the most recently deleted entry is added to new priorities ("aging"), so that
+                        entries which were expensive once but haven't been used in a while
+                        are eventually deleted.
+        'lru' --> delete least-recently-used entries first.
 
     self.performance tells total number of times arrays have been recalled,
     and total amount of time saved (estimate based on time it took to read the first time.)
     (Note the time saved is usually an overestimate unless you have N_memmap=0.)
+    self.stats() also tells the hit rate and number of bytes recalled.
 
     self.contents() shows a human-readable view of cache contents.
     '''
 
-    def __init__(self, obj=None, max_MB=10, max_Narr=20):
+    def __init__(self, obj=None, max_MB=10, max_Narr=20, policy=CACHE_POLICY):
         '''initialize Cache.
 
         obj: None or object with _metadata() and _metadata_matches() methods.
@@ -374,18 +386,27 @@ class Cache():
             maximum number of MB of data which cache is allowed to store at once.
         max_Narr: 20 (default) or number
             maximum number of arrays which cache is allowed to store at once.
+        policy: CACHE_POLICY (default) or string ('greedydual' or 'lru')
+            which entries to delete first when needing to free up space. See help(Cache) for details.
         '''
         # set attrs which dictate max size of cache
         self.max_MB = max_MB
         self.max_Narr = max_Narr
+        assert policy in CACHE_POLICIES, f"Expected policy in {CACHE_POLICIES} but got {repr(policy)}"
+        self.policy = policy
         # set parent, using weakref, to ensure we don't keep parent alive just because Cache points to it.
         self.parent = (lambda: None) if (obj is None) else weakref.ref(obj)
         # initialize self.performance, which will track the performance of Cache.
-        self.performance = dict(time_saved_estimate=0, N_recalled=0, N_recalled_unknown_time_savings=0)
+        self.performance = dict(time_saved_estimate=0, N_recalled=0, N_recalled_unknown_time_savings=0,
+                                N_missed=0, N_evicted=0, nbytes_recalled=0)
         # initialize attrs for internal use.
-        self._content = dict()
+        self._content = dict()   # {var: {id: entry}}
         self._next_cacheid = 0   # unique id associated to each cache entry (increases by 1 each time)
-        self._order = []  # list of (var, id)
+        self._vars = dict()      # {id: var} for all entries in self.
+        self._priority = dict()  # {id: priority}. Lowest priority is deleted first.
+        self._heap = []          # heap of (priority, id). (may have outdated items; see _pop_lowest_priority)
+        self._inflation = 0      # priority of most recently deleted entry (the "L" in GreedyDual-Size).
+        self._clock = 0          # number of times entries have been added or recalled (priority for 'lru').
         self._nbytes = 0   # number of bytes of data stored in self.
         self.debugging = False   # if true, print some helpful debugging statements.
 
@@ -459,15 +480,17 @@ class Cache():
         except KeyError:
             if self.debugging >= 2:
                 print(' > Getting {:15s}; var not found in cache.'.format(var))
+            self.performance['N_missed'] += 1
             return CacheEntry(None)   # var is not in self.
         # else (var is in self):
-        for entry in var_cache_entries:
+        for entry in var_cache_entries.values():
             if self._metadata_matches(entry.metadata, metadata=metadata, obj=obj):
                 # we found a match! So, return this entry (after doing some bookkeeping).
                 if self.debugging >= 1:
                     print(' -> Loaded   {:^15s} -> {}'.format(var, entry))
-                # update performance tracker.
+                # update performance tracker and priority of entry.
                 self._update_performance_tracker(entry)
+                self._set_priority(entry)
                 # update QUANT_SELECTED in self.parent()
                 parent = self.parent()
                 if parent is not None:
@@ -476,6 +499,7 @@ class Cache():
         # else (var is in self but not associated with this metadata):
         if self.debugging >= 2:
             print(' > Getting {:15s}, var in cache but not with this metadata.'.format(var))
+        self.performance['N_missed'] += 1
         return CacheEntry(None)
 
     def cache(self, var, val, metadata=None, obj=None, with_nfluid=2, calctime=None, from_internal=False):
@@ -492,41 +516,43 @@ class Cache():
                            qtracking_state=quant_tracking_state)
         if self.debugging >= 1:
             print(' <- Caching {:^15s} <- {}'.format(var, entry))
-        if var in self._content.keys():
-            self._content[var] += [entry]
-        else:
-            self._content[var] = [entry]
-        self._order += [(var, entry.id)]
+        self._content.setdefault(var, dict())[entry.id] = entry
+        self._vars[entry.id] = var
+        self._set_priority(entry)
         self._shrink_cache_as_needed()
 
     def remove_one_entry(self, id=None):
-        '''removes the oldest entry in self. returns id of entry removed.
+        '''removes the lowest-priority entry in self (see help(type(self))). returns id of entry removed.
         if id is not None, instead removes the entry with id==id.
         '''
         if id is None:
-            oidx = 0
-            var, eid = self._order[oidx]
-        else:
-            try:
-                oidx, (var, eid) = next(((i, x) for i, x in enumerate(self._order) if x[1] == id))
-            except StopIteration:
-                raise KeyError('id={} not found in cache {}'.format(id, self))
+            id = self._pop_lowest_priority()
+        elif id not in self._vars:
+            raise KeyError('id={} not found in cache {}'.format(id, self))
+        var = self._vars.pop(id)
         var_entries = self._content[var]
-        i = next((i for i, entry in enumerate(var_entries) if entry.id == eid))
-        self._nbytes -= var_entries[i].nbytes
-        del var_entries[i]
-        del self._order[oidx]
-        return eid
+        self._nbytes -= var_entries.pop(id).nbytes
+        if len(var_entries) == 0:
+            del self._content[var]
+        del self._priority[id]
+        return id
 
     def clear(self):
         '''remove all entries from self.
         Returns (Original number of entries, Original number of bytes).
         '''
-        result = (len(self._order), self._nbytes)
-        while len(self._order) > 0:
-            self.remove_one_entry()
+        result = (len(self), self._nbytes)
+        self._content.clear()
+        self._vars.clear()
+        self._priority.clear()
+        self._heap.clear()
+        self._nbytes = 0
         return result
 
+    def __len__(self):
+        '''number of entries in self.'''
+        return len(self._vars)
+
     def __repr__(self):
         '''pretty print of self'''
         s = '<{self:} totaling {MB:0.3f} MB, containing {N:} cached values from {k:} vars: {vars:}>'
@@ -535,7 +561,7 @@ class Cache():
             svars = '[' + ', '.join(vars[:20]) + ', ...]'
         else:
             svars = '[' + ', '.join(vars) + ']'
-        return s.format(self=object.__repr__(self), MB=self._nMB(), N=len(self._order), k=len(vars), vars=svars)
+        return s.format(self=object.__repr__(self), MB=self._nMB(), N=len(self), k=len(vars), vars=svars)
 
     def contents(self):
         '''pretty display of contents (as CacheEntryView tuples).
@@ -544,13 +570,27 @@ class Cache():
         result = dict()
         for var, content in self._content.items():
             result[var] = []
-            for entry in content:
+            for entry in content.values():
                 result[var] += [str(entry)]
         return result
 
+    def stats(self):
+        '''returns dict of statistics about the performance of self. Includes:
+            hit_rate: fraction of self.get() calls which found a value.
+            nbytes_recalled: total number of bytes of values which were found (instead of recalculated).
+            and everything from self.performance.
+        '''
+        result = self.performance.copy()
+        N_gets = result['N_recalled'] + result['N_missed']
+        result['hit_rate'] = result['N_recalled'] / N_gets if N_gets > 0 else None
+        result['N_entries'] = len(self)
+        result['nbytes'] = self._nbytes
+        return result
+
     def _update_performance_tracker(self, entry):
         '''update self.performance as if we just got entry from cache once.'''
         self.performance['N_recalled'] += 1
+        self.performance['nbytes_recalled'] += entry.nbytes
         savedtime = entry.calctime
         if savedtime is None:
             self.performance['N_recalled_unknown_time_savings'] += 1
@@ -562,6 +602,33 @@ class Cache():
         self._next_cacheid += 1
         return result
 
+    def _set_priority(self, entry):
+        '''sets priority of entry, as if it was just added or recalled.'''
+        self._clock += 1
+        if self.policy == 'lru':
+            priority = self._clock
+        else:  # 'greedydual'
+            cost = 0 if entry.calctime is None else entry.calctime
+            priority = self._inflation + cost / max(entry.nbytes, 1)
+        self._priority[entry.id] = priority
+        heapq.heappush(self._heap, (priority, self._clock, entry.id))
+        if len(self._heap) > 2 * len(self._priority) + 32:
+            # too many outdated items in heap; rebuild it.
+            self._heap = [item for item in self._heap if self._priority.get(item[2], None) == item[0]]
+            heapq.heapify(self._heap)
+
+    def _pop_lowest_priority(self):
+        '''returns id of the entry with lowest priority, and forgets its priority in the heap.
+        Items in the heap are outdated if the entry was removed or its priority changed; skip those.
+        '''
+        while True:
+            priority, _, id = heapq.heappop(self._heap)
+            if self._priority.get(id, None) == priority:
+                if self.policy != 'lru':
+                    self._inflation = priority
+                self.performance['N_evicted'] += 1
+                return id
+
     def _max_nbytes(self):
         return self.max_MB * 1024 * 1024
 
@@ -570,7 +637,7 @@ class Cache():
 
     def _shrink_cache_as_needed(self):
         '''shrink cache to stay within limits of number of entries and amount of data.'''
-        while len(self._order) > self.max_Narr:
+        while len(self) > self.max_Narr:
             self.remove_one_entry()
         max_nbytes = self._max_nbytes()
         while self._nbytes > max_nbytes:
@@ -598,6 +665,11 @@ def with_caching(check_cache=True, cache=False, cache_with_nfluid=None):
     cache_with_nfluid - None (default), 0, 1, or 2
         if not None, cache result and associate it with this many fluids.
         0 -> neither; 1 -> just ifluid; 2 -> both ifluid and jfluid.
+
+    Additionally, if obj.disk_cache is enabled (see disk_cache.get_disk_cache), for top-level calls,
+    check the disk cache (if check_cache) after checking obj.cache, and save results to the disk cache.
+    (internal calls never read the disk cache, since its values are read-only memmaps,
+    but getters may edit the values of the quantities they get, in-place.)
     '''
     def decorator(f):
         @functools.wraps(f)
@@ -608,36 +680,55 @@ def with_caching(check_cache=True, cache=False, cache_with_nfluid=None):
             i.e. check cache first (if check_cache) and store result (if cache).
             '''
             __tracebackhide__ = HIDE_DECORATOR_TRACEBACKS
+            disk = disk_cache.get_disk_cache(obj)
+            if kwargs_f.get('cgsunits', 1.0) != 1.0:
+                disk = None   # the disk cache only stores values in simulation units.
+            check_disk = check_cache
             if getattr(obj, '_force_disable_memory', False):
                 cache = check_cache = False
+                disk = None
 
             val = None
+            if not getattr(obj, 'do_caching', True):
+                disk = None
             if (not getattr(obj, 'do_caching', True)) or (not hasattr(obj, 'cache')) or (obj.cache.is_NoneCache()):
                 cache = check_cache = False
             elif cache_with_nfluid is not None:
                 cache = True
+            track_timing = (cache or (disk is not None))
             if (cache or check_cache):
-                track_timing = True
                 # check cache for result (if check_cache==True)
                 if check_cache:
                     entry = obj.cache.get(var)
                     val = entry.value
-                    if cache and (val is not None):
-                        # remove entry from cache to prevent duplicates (because we will re-add entry soon)
-                        obj.cache.remove_one_entry(id=entry.id)
-                        # use timing from original entry
-                        track_timing = False
-                        calctime = entry.calctime
-                if cache and track_timing:
-                    now = time.time()   # track timing, so we can estimate how much time cache is saving.
+                    if val is not None:
+                        # don't re-add entry to cache; getting it already updated its priority.
+                        cache = track_timing = False
+            # check disk cache for result (if check_cache==True, at the top level)
+            top_level = (getattr(obj, document_vars.LOADING_LEVEL, -1) == -1)
+            calculated = False
+            if (val is None) and (disk is not None) and check_disk and top_level:
+                val, meta = disk.get(obj, var)
+                if val is not None:
+                    track_timing = False
+                    calctime = meta['calctime']
+                    if meta['qtracking_state'] is not None:
+                        document_vars.restore_quant_tracking_state(obj, meta['qtracking_state'])
+            if track_timing:
+                now = time.time()   # track timing, so we can estimate how much time cache is saving.
             # calculate result (if necessary)
             if val is None:
                 val = f(obj, var, *args_f, **kwargs_f)
+                calculated = True
+            if track_timing:
+                calctime = time.time() - now
             # save result to obj.cache (if cache==True)
             if cache:
-                if track_timing:
-                    calctime = time.time() - now
                 obj.cache.cache(var, val, with_nfluid=cache_with_nfluid, calctime=calctime)
+            # save result to disk cache (if calculated here, at the top level)
+            if calculated and top_level and (disk is not None) and disk.cacheable(obj, var, val, calctime):
+                qtracking_state = document_vars.get_quant_tracking_state(obj, from_internal=False)
+                disk.cache(obj, var, val, calctime=calctime, qtracking_state=qtracking_state)
             # return result
             return val
         return f_but_caching
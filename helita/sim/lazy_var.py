@@ -0,0 +1,269 @@
+"""
+purpose:
+
+    - lazily evaluate quantities block by block, to cap memory usage. (see LazyVar)
+
+Some quantities need several intermediate (e.g. staggered) arrays, so getting them on
+the full domain of a large snapshot may require more memory than is available.
+LazyVar instead gets the quantity one block of the domain at a time, via get_var.
+Each block is calculated on the block plus a halo of cells (see BifrostData.slice_halo),
+so the result is the same as getting the quantity on the full domain at once.
+The blocks can be streamed to a reduction (e.g. sum, max) or to disk (e.g. to_memmap).
+
+Example:
+    dd = BifrostData(...)
+    tg = dd.get_var('tg', chunks=(None, None, 64))   # LazyVar; nothing is calculated yet.
+    tg.max()                 # max of tg, calculated with only 1 block in memory at a time.
+    tg.mean(axis=(0, 1))     # horizontal average of tg.
+    tg.to_memmap('tg.dat')   # write tg to disk, 1 block at a time.
+    np.asarray(tg)           # all of tg, in memory.
+
+    # or, pick the block size automatically based on a memory budget:
+    dd = BifrostData(..., chunks='auto', chunks_max_MB=500)
+    tg = dd.get_var('tg')    # LazyVar
+
+TODO:
+    blocks are only expected to match the full-domain result if do_stagger (or for quantities
+    which don't use stagger operations). Quantities which depend on the whole domain
+    (e.g. means, delta_, horvar) get the parts they need on the full domain (via _full_domain
+    in load_arithmetic_quantities) for each block, so they save less memory.
+    A new quantity of that kind must use _full_domain too, else its blocks will be wrong.
+"""
+
+# import builtins
+import itertools
+
+# import external public modules
+import numpy as np
+
+# import internal modules
+from . import tools
+
+# set defaults
+CHUNKS_MAX_MB = 1000   # default memory budget for chunks='auto'.
+AXES = ('x', 'y', 'z')
+
+
+''' --------------------- choosing blocks --------------------- '''
+
+
+def auto_chunks(shape, halo, bytes_per_cell, max_bytes):
+    '''returns block shape for a domain with this shape, so that a block uses at most max_bytes.
+    Splits the domain along z first, then y, then x, as necessary.
+    Each block is calculated on the block plus halo cells on each side (within the domain);
+    bytes_per_cell tells how many bytes are used per cell of that expanded block.
+    '''
+    chunks = list(shape)
+    halo = 0 if (halo is False) else halo
+
+    def expanded(c, n):
+        return min(c + 2 * halo, n)
+
+    for i in reversed(range(len(shape))):
+        nbytes = bytes_per_cell * np.prod([expanded(c, n) for c, n in zip(chunks, shape)])
+        if nbytes <= max_bytes:
+            break
+        other_bytes = bytes_per_cell * np.prod([expanded(c, n) for j, (c, n) in enumerate(zip(chunks, shape))
+                                                if j != i])
+        chunks[i] = int(max(1, min(shape[i], max_bytes // other_bytes - 2 * halo)))
+    return tuple(chunks)
+
+
+def _axis_blocks(ii, n, chunk):
+    '''returns list of (index in result, index in domain) for blocks along one axis.
+    ii: domain along this axis (slice or list of indices). n: length of the axis.
+    chunk: length of blocks along this axis (None --> 1 block).
+    '''
+    if isinstance(ii, slice) and ii.step in (None, 1):
+        start, stop, _ = ii.indices(n)
+        length = stop - start
+        chunk = length if (chunk is None) else max(1, min(chunk, length))
+        return [(slice(i, min(i + chunk, length)), slice(start + i, start + min(i + chunk, length)))
+                for i in range(0, length, chunk)]
+    # else, non-contiguous domain; use a single block.
+    length = len(range(n)[ii]) if isinstance(ii, slice) else len(ii)
+    return [(slice(0, length), ii)]
+
+
+''' --------------------- LazyVar --------------------- '''
+
+
+class LazyVar():
+    '''lazily evaluated quantity, which is calculated block by block via get_var.
+
+    obj: BifrostData object (or subclass, e.g. EbysusData)
+    var: string
+        the quantity to get.
+    chunks: tuple of (int or None) for each axis, or 'auto'
+        shape of the blocks. None --> don't split that axis.
+        'auto' --> choose the shape of the blocks based on obj.chunks_max_MB, the memory budget.
+            The memory used by a block is estimated as the number of intermediate quantities
+            needed for var (see obj.plan_vars) times the size of the block plus its halo.
+        Splitting a periodic axis is allowed but not very useful; the blocks at the edges of
+        a periodic axis are calculated on the full axis (see obj.slice_halo). z is split first,
+        and is usually not periodic.
+    **kw__get_var are passed to obj.get_var for every block (e.g. snap, ifluid).
+        The domain (iix, iiy, iiz) and snap are fixed when the LazyVar is created.
+    '''
+
+    def __init__(self, obj, var, chunks, **kw__get_var):
+        self.obj = obj
+        self.var = var
+        self.domain = tuple(kw__get_var.pop('ii'+x, None) for x in AXES)
+        self.domain = tuple(getattr(obj, 'ii'+x, slice(None)) if ii is None else ii
+                            for x, ii in zip(AXES, self.domain))
+        self.domain = tuple(slice(ii, ii + 1) if isinstance(ii, (int, np.integer)) else ii
+                            for ii in self.domain)
+        snap = kw__get_var.pop('snap', None)
+        self.snap = obj.snap if snap is None else snap
+        self.kw__get_var = kw__get_var
+        self.shape = tuple(len(range(getattr(obj, 'n'+x+'b'))[ii]) if isinstance(ii, slice) else len(ii)
+                           for x, ii in zip(AXES, self.domain))
+        self._dtype = None
+        if isinstance(chunks, str) and (chunks == 'auto'):
+            chunks = self._auto_chunks()
+        self.chunks = tuple(chunks)
+
+    def _auto_chunks(self):
+        '''returns block shape based on self.obj.chunks_max_MB. See help(type(self)) for details.'''
+        obj = self.obj
+        plan = obj.plan_vars([self.var], chunks=False, snap=self.snap, **self.kw__get_var)
+        bytes_per_cell = np.dtype(obj.dtype).itemsize * max(len(plan), 1)
+        halo = obj.slice_halo if obj.do_stagger else 0
+        max_MB = getattr(obj, 'chunks_max_MB', CHUNKS_MAX_MB)
+        return auto_chunks(self.shape, halo, bytes_per_cell, max_MB * 1024**2)
+
+    ## PROPERTIES ##
+    ndim = property(lambda self: len(self.shape))
+    size = property(lambda self: int(np.prod(self.shape)))
+    nbytes = property(lambda self: self.size * self.dtype.itemsize)
+
+    @property
+    def dtype(self):
+        '''dtype of the result. (If not known yet, get var at a single cell to find out.)'''
+        if self._dtype is None:
+            idx = tuple(_axis_blocks(ii, getattr(self.obj, 'n'+x+'b'), 1)[0][1]
+                        for x, ii in zip(AXES, self.domain))
+            self._dtype = np.asarray(self._get_block(idx)).dtype
+        return self._dtype
+
+    @property
+    def nblocks(self):
+        '''number of blocks.'''
+        return len(self._block_indices())
+
+    ## EVALUATION ##
+    def _block_indices(self):
+        '''returns list of (index in result, index in domain) for all blocks.'''
+        per_axis = [_axis_blocks(ii, getattr(self.obj, 'n'+x+'b'), chunk)
+                    for x, ii, chunk in zip(AXES, self.domain, self.chunks)]
+        return [tuple(zip(*block)) for block in itertools.product(*per_axis)]
+
+    def _get_block(self, idx):
+        '''returns var on the domain idx = (iix, iiy, iiz). Restores the domain of self.obj afterwards.'''
+        obj = self.obj
+        orig_slices = (obj.iix, obj.iiy, obj.iiz)
+        try:
+            with tools.MaintainingAttrs(obj, 'squeeze_output', 'internal_means'):
+                obj.squeeze_output = False
+                obj.internal_means = False
+                return obj.get_var(self.var, snap=self.snap, chunks=False,
+                                   iix=idx[0], iiy=idx[1], iiz=idx[2], **self.kw__get_var)
+        finally:
+            obj.set_domain_iiaxes(*orig_slices, internal=False)
+
+    def blocks(self):
+        '''yields (index in result, value) for each block.'''
+        for index, idx in self._block_indices():
+            val = self._get_block(idx)
+            expected_shape = tuple(s.stop - s.start for s in index)
+            if np.shape(val) != expected_shape:
+                errmsg = ('LazyVar expected block of {} with shape {} but got shape {}. '
+                          'LazyVar only works for quantities which have a value at each cell of the domain.')
+                raise ValueError(errmsg.format(repr(self.var), expected_shape, np.shape(val)))
+            self._dtype = np.asarray(val).dtype
+            yield index, val
+
+    def store(self, out):
+        '''puts the values from all blocks into out (e.g. np.memmap, h5py or zarr array); returns out.'''
+        for index, val in self.blocks():
+            out[index] = val
+        return out
+
+    def to_memmap(self, filename, order='F', dtype=None):
+        '''writes the values to the file filename, one block at a time. returns np.memmap of the file.'''
+        dtype = self.dtype if dtype is None else dtype
+        out = np.memmap(filename, dtype=dtype, mode='w+', shape=self.shape, order=order)
+        self.store(out)
+        out.flush()
+        return out
+
+    def compute(self):
+        '''returns the values from all blocks, as a numpy array.'''
+        out = None
+        for index, val in self.blocks():
+            if out is None:
+                out = np.empty(self.shape, dtype=np.asarray(val).dtype)
+            out[index] = val
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        result = self.compute()
+        return result if dtype is None else result.astype(dtype, copy=False)
+
+    ## REDUCTIONS ##
+    def _axes(self, axis):
+        '''returns tuple of the (non-negative) axes for axis.
+        axis: None (--> all axes), int, or tuple of ints.
+        '''
+        if axis is None:
+            return tuple(range(self.ndim))
+        return tuple(int(ax) % self.ndim for ax in np.atleast_1d(axis))
+
+    def reduce(self, ufunc, axis=None, keepdims=False, **kw__reduce):
+        '''returns ufunc.reduce of the values along axis, computed one block at a time.
+        ufunc: numpy ufunc, e.g. np.add, np.maximum, np.minimum.
+        axis: None, int, or tuple of ints.
+            None --> reduce along all axes.
+        '''
+        axes = self._axes(axis)
+        result = None
+        done = set()   # parts of result which have been assigned already.
+        for index, val in self.blocks():
+            part = ufunc.reduce(np.asarray(val), axis=axes, keepdims=True, **kw__reduce)
+            rindex = tuple(slice(None) if i in axes else s for i, s in enumerate(index))
+            if result is None:
+                shape = tuple(1 if i in axes else n for i, n in enumerate(self.shape))
+                result = np.empty(shape, dtype=part.dtype)
+            rkey = tuple((s.start, s.stop) for s in rindex if s != slice(None))
+            if rkey in done:
+                result[rindex] = ufunc(result[rindex], part)
+            else:
+                result[rindex] = part
+                done.add(rkey)
+        if not keepdims:
+            result = np.squeeze(result, axis=axes)
+        return result
+
+    def sum(self, axis=None, **kw__reduce):
+        '''sum along axis, computed one block at a time.'''
+        return self.reduce(np.add, axis=axis, **kw__reduce)
+
+    def max(self, axis=None, **kw__reduce):
+        '''max along axis, computed one block at a time.'''
+        return self.reduce(np.maximum, axis=axis, **kw__reduce)
+
+    def min(self, axis=None, **kw__reduce):
+        '''min along axis, computed one block at a time.'''
+        return self.reduce(np.minimum, axis=axis, **kw__reduce)
+
+    def mean(self, axis=None, dtype=np.float64, **kw__reduce):
+        '''mean along axis, computed one block at a time. (sums are accumulated using dtype.)'''
+        axes = self._axes(axis)
+        count = np.prod([self.shape[i] for i in axes])
+        return self.sum(axis=axis, dtype=dtype, **kw__reduce) / count
+
+    ## CONVENIENCE ##
+    def __repr__(self):
+        return '<{} {} with shape {}, in {} blocks of {} at {}>'.format(
+            type(self).__name__, repr(self.var), self.shape, self.nblocks, self.chunks, hex(id(self)))
@@ -26,12 +26,12 @@ Interpolation guide:
 """
 
 
-import warnings
 # import built-ins
-from multiprocessing.dummy import Pool as ThreadPool
+import warnings
+import contextlib
 
 # import internal modules
-from . import document_vars, tools
+from . import document_vars, quant_planner, tools
 
 try:
     from . import cstagger
@@ -45,6 +45,8 @@ except ImportError:
 # import external public modules
 import numpy as np
 
+scipy_fft = tools.lazy_import('scipy.fft')
+
 # import the relevant things from the internal module "units"
 from .units import DIMENSIONLESS, UNI, UNITS_FACTOR_1, UNI_length, Usym
 
@@ -52,6 +54,8 @@ from .units import DIMENSIONLESS, UNI, UNITS_FACTOR_1, UNI_length, Usym
 AXES = ('x', 'y', 'z')
 YZ_FROM_X = dict(x=('y', 'z'), y=('z', 'x'), z=('x', 'y'))  # right-handed coord system x,y,z given x.
 EPSILON = 1.0e-20   # small number which is added in denominators of some operations.
+STREAM_SLAB_NZ = 32  # minimum number of z-levels per slab, for streaming reductions. (see _iter_zslabs)
+STREAM_SLAB_NHALO = 8  # slabs have at least this many times as many z-levels as the halo. (see _iter_zslabs)
 
 
 # we need to convert to float32 before doing cstagger.do.
@@ -61,8 +65,8 @@ EPSILON = 1.0e-20   # small number which is added in denominators of some operat
 CSTAGGER_TYPES = ['float32']  # these are the allowed types
 
 
-def do_stagger(arr, operation, default_type=CSTAGGER_TYPES[0], obj=None):
-    '''does stagger of arr.
+def do_stagger(arr, operation, default_type=CSTAGGER_TYPES[0], obj=None, out=None):
+    '''does stagger of arr. if out is provided, put the result there.
     For stagger_kind='cstagger', first does some preprocessing:
       - ensure arr is the correct type, converting if necessary.
         if type conversion is necessary, convert to default_type.
@@ -76,10 +80,14 @@ def do_stagger(arr, operation, default_type=CSTAGGER_TYPES[0], obj=None):
         arr = np.array(arr, copy=False)     # make numpy array, if necessary.
         if arr.dtype not in CSTAGGER_TYPES:  # if necessary,
             arr = arr.astype(default_type)      # convert type
-        return cstagger.do(arr, operation)  # call the original cstagger function
+        result = cstagger.do(arr, operation)  # call the original cstagger function
+        if out is not None:
+            out[...] = result
+            return out
+        return result
     else:                  # use stagger routine.
         assert obj is not None, f'obj must be provided to use stagger, with stagger_kind = {stagger_kind}.'
-        return obj.stagger.do(arr, operation)
+        return obj.stagger.do(arr, operation, out=out)
 
 
 do_cstagger = do_stagger   # << alias, for backwards compatibility.
@@ -110,6 +118,148 @@ def _can_interp(obj, axis, warn=True):
     return True
 
 
+def _can_deriv_sum(obj):
+    '''returns whether obj.stagger.deriv_sum can be used to compute sums of derivatives (e.g. div, rot),
+    instead of getting each derivative separately (see get_deriv).
+    '''
+    return (getattr(obj, 'do_stagger', False) and
+            getattr(obj, 'stagger_kind', stagger.DEFAULT_STAGGER_KIND) in stagger.VALID_STAGGER_KINDS and
+            getattr(obj, 'numThreads', 1) <= 1 and not getattr(obj, 'lowbus', False) and
+            hasattr(obj, 'stagger'))
+
+
+def _full_domain(obj):
+    '''returns context manager inside of which get_var calculates on the full domain, if obj.do_stagger.
+    (if do_stagger, internal calls to get_var otherwise only calculate on the domain near iix, iiy, iiz.)
+    Use this for quantities which depend on the whole domain, e.g. averages.
+    returns a context manager which does nothing if not obj.do_stagger, or obj doesn't support it.
+    '''
+    full_domain = getattr(obj, '_full_domain', None)
+    if (full_domain is None) or not getattr(obj, 'do_stagger', False):
+        return contextlib.nullcontext()
+    return full_domain()
+
+
+def _iter_zslabs(obj, var, slab_nz=None):
+    '''yields (iiz, value of var at the z-levels iiz) for slabs of z-levels which together cover
+    the domain (the full domain, if obj.do_stagger; see _full_domain). iiz is relative to the domain.
+    Only one slab of var is in memory at a time, so this is useful for streaming reductions.
+
+    slab_nz: None or int
+        number of z-levels per slab. None --> max(STREAM_SLAB_NZ, STREAM_SLAB_NHALO * obj.slice_halo),
+        so that the halos add at most 2 / STREAM_SLAB_NHALO to the work.
+        The z-levels are split evenly between the slabs.
+
+    Each slab is calculated on the slab plus a halo of obj.slice_halo z-levels on each side, so the
+    slabs match the value of var on the whole domain. If z is periodic, the halo wraps around.
+    If the first slab doesn't use any stagger operations, the other slabs are calculated without a halo.
+    This requires obj.do_stagger; if not obj.do_stagger, if not obj.slice_halo, if var doesn't have
+    a value at each cell, or if the domain can't be split, instead
+    yields (slice(None), value of var on the whole domain), once.
+    '''
+    with _full_domain(obj):
+        iiz = getattr(obj, 'iiz', None)
+        nz = getattr(obj, 'nzb', 0)
+        halo = getattr(obj, 'slice_halo', False)
+        splittable = getattr(obj, 'do_stagger', False) and (halo is not False) and \
+            hasattr(obj, 'set_domain_iiaxes') and isinstance(iiz, slice) and (iiz.step in (None, 1))
+        start, stop = iiz.indices(nz)[:2] if splittable else (0, 0)
+        if slab_nz is None:
+            slab_nz = max(STREAM_SLAB_NZ, STREAM_SLAB_NHALO * (halo or 0))
+        nslabs = -(-(stop - start) // slab_nz)  # (ceil division)
+        if (not splittable) or (nslabs <= 1):
+            yield slice(None), obj.get_var(var)
+            return
+        edges = [start + (i * (stop - start)) // nslabs for i in range(nslabs + 1)]
+        periodic = obj.get_param('periodic_z', default=(stagger.PAD_DEFAULTS['z'] == stagger.PAD_PERIODIC))
+        orig_slices = (obj.iix, obj.iiy, obj.iiz)
+        try:
+            for i, (z0, z1) in enumerate(zip(edges[:-1], edges[1:])):
+                window, offset = _zslab_window(nz, z0, z1, halo, periodic)
+                obj.set_domain_iiaxes(iiz=window, internal=False)
+                if i == 0:
+                    val, nops = _get_var_counting_stagger_ops(obj, var)
+                    if (nops == 0) and (getattr(obj, 'stagger_kind', None) != 'cstagger'):
+                        halo = 0  # var doesn't need a halo. (cstagger isn't counted, so always use the halo.)
+                else:
+                    val = obj.get_var(var)
+                if np.shape(val) != (obj.xLength, obj.yLength, obj.zLength):
+                    # var doesn't have a value at each cell; get it on the whole domain instead.
+                    obj.set_domain_iiaxes(*orig_slices, internal=False)
+                    yield slice(None), obj.get_var(var)
+                    return
+                yield slice(z0 - start, z1 - start), val[:, :, offset: offset + z1 - z0]
+        finally:
+            obj.set_domain_iiaxes(*orig_slices, internal=False)
+
+
+def _zslab_window(nz, z0, z1, halo, periodic):
+    '''returns (iiz, offset) for calculating a quantity at the z-levels z0 to z1, plus halo on each side.
+    iiz is the domain to calculate on (staying within 0 to nz, or wrapping around if periodic);
+    the z-levels z0 to z1 start at index offset of iiz.
+    '''
+    lo, hi = z0 - halo, z1 + halo
+    if (lo < 0 or hi > nz) and periodic:
+        window, offset = list(np.arange(lo, hi) % nz), halo
+    else:
+        lo, hi = max(lo, 0), min(hi, nz)
+        window, offset = slice(lo, hi), z0 - lo
+    if (hi - lo >= nz) or (halo > 0 and hi - lo <= 5):
+        # stagger.do skips axes with length 5 or less, so we can't use a window that small.
+        return slice(None), z0
+    return window, offset
+
+
+def _get_var_counting_stagger_ops(obj, var):
+    '''returns (obj.get_var(var), number of stagger operations done to get it).
+    Caches are disabled meanwhile, so that any operations needed for var are actually done.
+    '''
+    interface = getattr(obj, 'stagger', None)
+    nops = getattr(interface, 'nops', None)
+    with tools.MaintainingAttrs(obj, 'do_caching', quant_planner.PLAN_ATTR):
+        if hasattr(obj, 'do_caching'):
+            obj.do_caching = False
+        if hasattr(obj, quant_planner.PLAN_ATTR):
+            setattr(obj, quant_planner.PLAN_ATTR, None)
+        val = obj.get_var(var)
+    if nops is None:
+        return val, None   # can't tell how many operations were done.
+    return val, interface.nops - nops
+
+
+def _stream_moments(obj, var):
+    '''returns (n, mean, M2) for var, in a single streaming pass over z-slabs (see _iter_zslabs).
+    M2 is the sum of squared deviations from the mean, so the variance is M2 / n.
+
+    The slabs are combined via the pairwise algorithm of Chan, Golub & LeVeque (1979),
+    a numerically stable generalization of Welford's algorithm.
+    Within each slab, sums are taken with (at least) float64 precision.
+    '''
+    n, mean, M2 = 0, 0, 0
+    for _, val in _iter_zslabs(obj, var):
+        nb = np.size(val)
+        if nb == 0:
+            continue
+        dtype = np.result_type(np.asarray(val).dtype, np.float64)
+        meanb = np.mean(val, dtype=dtype)
+        M2b = np.var(val, dtype=dtype) * nb
+        delta = meanb - mean
+        ntot = n + nb
+        mean = mean + delta * (nb / ntot)
+        M2 = M2 + M2b + np.abs(delta)**2 * (n * nb / ntot)
+        n = ntot
+    return n, mean, M2
+
+
+def _stream_reduce(obj, var, ufunc):
+    '''returns ufunc.reduce of var over all axes, in a single streaming pass over z-slabs.'''
+    result = None
+    for _, val in _iter_zslabs(obj, var):
+        valb = ufunc.reduce(np.asarray(val), axis=None)
+        result = valb if (result is None) else ufunc(result, valb)
+    return result
+
+
 ''' --------------------- functions to load quantities --------------------- '''
 
 
@@ -125,7 +275,7 @@ def load_arithmetic_quantities(obj, quant, *args__None, **kwargs__None):
     # tell which funcs to use for getting things. (funcs will be called in the order listed here)
     _getter_funcs = (
         get_center, get_deriv, get_interp,
-        get_module, get_horizontal_average,
+        get_module, get_horizontal_average, get_horizontal_profile,
         get_gradients_vect, get_gradients_scalar,
         get_dot_product,
         get_square, get_lg, get_numop, get_ratios, get_parens,
@@ -207,7 +357,7 @@ def get_deriv(obj, quant):
 
     # calculate derivative with interpolations
     # -- bookkeeping:
-    threading = (obj.numThreads > 1)
+    threading = (obj.numThreads > 1) and (np.ndim(var) == 3)
     lowbusing = obj.lowbus
     # -- default case --
     if not (threading or lowbusing):
@@ -221,14 +371,11 @@ def get_deriv(obj, quant):
     if threading:
         if obj.verbose:
             print('Threading', whsp*8, end="\r", flush=True)
-        quantlist = [quant[-4:] for numb in range(obj.numThreads)]
 
-        def deriv_loop(var, quant):
-            return do_stagger(var, 'd' + quant[0], obj=obj)
-        if axis != 'z':
-            return threadQuantity_z(deriv_loop, obj.numThreads, var, quantlist)
-        else:
-            return threadQuantity_y(deriv_loop, obj.numThreads, var, quantlist)
+        def deriv_slab(var, out=None):
+            return do_stagger(var, 'd' + quant[-4:], obj=obj, out=out)
+        # split into z-slabs (or y-slabs, for derivatives along z), done in parallel by obj's thread pool.
+        return tools.map_slabs(obj, deriv_slab, var, axis=(2 if axis != 'z' else 1))
     # -- "using lowbus" case (False by default) --
     else:
         if lowbusing:
@@ -317,8 +464,15 @@ def get_center(obj, quant, *args, **kwargs):
                         output[slicer] = staggered
     else:
         # do "regular" version of interpolation
-        for interp in transf:
-            if _can_interp(obj, interp[0]):
+        transf = [interp for interp in transf if _can_interp(obj, interp[0])]
+        if (len(transf) > 1) and (getattr(obj, 'stagger_kind', stagger.DEFAULT_STAGGER_KIND) != 'cstagger'):
+            # do all interpolations in one pass. e.g. ['yup', 'zup'] --> obj.stagger.zup.yup(var).
+            chain = obj.stagger
+            for interp in transf[::-1]:
+                chain = chain.op(interp)
+            var = chain(var)
+        else:
+            for interp in transf:
                 var = do_stagger(var, interp, obj=obj)
     return var
 
@@ -419,13 +573,11 @@ def get_horizontal_average(obj, quant):
 
     # Compares the variable with the horizontal mean
     if getq == 'horvar':
-        result = np.zeros_like(obj.r)
-        result += obj.get_var(quant[6:])  # base variable
-        horv = np.mean(np.mean(result, 0), 0)
-        for iix in range(0, getattr(obj, 'nx')):
-            for iiy in range(0, getattr(obj, 'ny')):
-                result[iix, iiy, :] = result[iix, iiy, :] / horv[:]
-        return result
+        with _full_domain(obj):
+            val = obj.get_var(quant[6:])  # base variable
+        # (sum with float64 precision)
+        horv = np.mean(val, axis=(0, 1), dtype=np.result_type(val.dtype, np.float64))
+        return val / horv.astype(val.dtype, copy=False)
     else:
         # quant is a horizontal_average quant but we did not handle it.
         raise NotImplementedError(f'{repr(getq)} in get_horizontal_average')
@@ -479,7 +631,7 @@ def get_gradients_vect(obj, quant):
     # do calculations and return result
     if getq == 'chkdiv':
         if getattr(obj, 'nx') < 5:  # 2D or close
-            varx = np.zeros_like(obj.r)
+            varx = np.zeros_like(obj.get_var('r'))
         else:
             varx = obj.get_var('d' + q + 'xdxup')
 
@@ -514,11 +666,8 @@ def get_gradients_vect(obj, quant):
             varx * varx + vary * vary + varz * varz) + EPSILON))
 
     elif getq == 'chhdiv':
-        varx = obj.get_var(q + 'x')
-        vary = obj.get_var(q + 'y')
-        varz = obj.get_var(q + 'z')
         if getattr(obj, 'nx') < 5:  # 2D or close
-            result = np.zeros_like(varx)
+            result = np.zeros_like(obj.get_var(q + 'x'))
         else:
             result = obj.get_var('d' + q + 'xdxup')
 
@@ -528,14 +677,22 @@ def get_gradients_vect(obj, quant):
         if getattr(obj, 'nz') > 5:
             result += obj.get_var('d' + q + 'zdzup')
 
-        for iiz in range(0, obj.nz):
-            result[:, :, iiz] = np.abs(result[:, :, iiz]) / np.mean((
-                np.sqrt(varx[:, :, iiz]**2 + vary[:, :, iiz]**2 +
-                        varz[:, :, iiz]**2)))
+        # the horizontal means depend on the whole horizontal planes.
+        with _full_domain(obj):
+            varx = obj.get_var(q + 'x')
+            vary = obj.get_var(q + 'y')
+            varz = obj.get_var(q + 'z')
+            hmean = np.mean(np.sqrt(varx**2 + vary**2 + varz**2), axis=(0, 1))
+        if len(hmean) != result.shape[2]:  # hmean is on the full domain; result is on the domain near iiz.
+            hmean = hmean[obj.iiz]
+        for iiz in range(0, result.shape[2]):
+            result[:, :, iiz] = np.abs(result[:, :, iiz]) / hmean[iiz]
         return result
 
     elif getq in ['div', 'divup', 'divdn']:  # divergence of vector quantity
         up = 'dn' if (getq == 'divdn') else 'up'
+        if _can_deriv_sum(obj):
+            return obj.stagger.deriv_sum([(q + x, f'dd{x}{up}', 1) for x in AXES])
         result = 0
         for xdx in ['xdx', 'ydy', 'zdz']:
             result += obj.get_var('d' + q + xdx + up)
@@ -556,6 +713,8 @@ def get_gradients_vect(obj, quant):
         # interpolation notes:
         ## qz is at (0, 0, -0.5); dqzdydn is at (0, -0.5, -0.5)
         ## qy is at (0, -0.5, 0); dqydzdn is at (0, -0.5, -0.5)
+        if _can_deriv_sum(obj):
+            return obj.stagger.deriv_sum([(q + z, f'dd{y}dn', 1), (q + y, f'dd{z}dn', -1)])
         dqz_dydn = obj.get_var('d' + q + z + 'd' + y + 'dn')
         dqy_dzdn = obj.get_var('d' + q + y + 'd' + z + 'dn')
         return dqz_dydn - dqy_dzdn
@@ -563,9 +722,13 @@ def get_gradients_vect(obj, quant):
     elif getq in ['rot', 'she']:
         q = q[:-1]  # base variable
         qaxis = quant[-1]
+        if _can_deriv_sum(obj):
+            y, z = YZ_FROM_X[qaxis]
+            sign = -1 if getq == 'rot' else 1
+            return obj.stagger.deriv_sum([(q + z, f'dd{y}up', 1), (q + y, f'dd{z}up', sign)])
         if qaxis == 'x':
             if getattr(obj, 'ny') < 5:  # 2D or close
-                result = np.zeros_like(obj.r)
+                result = np.zeros_like(obj.get_var('r'))
             else:
                 result = obj.get_var('d' + q + 'zdyup')
             if getattr(obj, 'nz') > 5:
@@ -575,7 +738,7 @@ def get_gradients_vect(obj, quant):
                     result += obj.get_var('d' + q + 'ydzup')
         elif qaxis == 'y':
             if getattr(obj, 'nz') < 5:  # 2D or close
-                result = np.zeros_like(obj.r)
+                result = np.zeros_like(obj.get_var('r'))
             else:
                 result = obj.get_var('d' + q + 'xdzup')
             if getattr(obj, 'nx') > 5:
@@ -585,7 +748,7 @@ def get_gradients_vect(obj, quant):
                     result += obj.get_var('d' + q + 'zdxup')
         elif qaxis == 'z':
             if getattr(obj, 'nx') < 5:  # 2D or close
-                result = np.zeros_like(obj.r)
+                result = np.zeros_like(obj.get_var('r'))
             else:
                 result = obj.get_var('d' + q + 'ydxup')
             if getattr(obj, 'ny') > 5:
@@ -626,6 +789,8 @@ def get_gradients_scalar(obj, quant):
     # do calculations and return result
     if getq == 'gra':
         q = quant[3:]  # base variable
+        if _can_deriv_sum(obj):
+            return obj.stagger.deriv_sum([(q, f'dd{x}up', 1) for x in AXES])
         result = obj.get_var('d' + q + 'dxup')
         result += obj.get_var('d' + q + 'dyup')
         result += obj.get_var('d' + q + 'dzup')
@@ -733,7 +898,11 @@ def get_numop(obj, quant):
     document_vars.setattr_quant_selected(obj, getq, _NUMOP_QUANT[0], delay=True)
 
     # do calculations and return result
-    v = obj.get_var(base)
+    if getq in ('delta_', 'deltafrac_'):
+        with _full_domain(obj):  # (the mean depends on the whole domain.)
+            v = obj.get_var(base)
+    else:
+        v = obj.get_var(base)
     if getq == 'delta_':
         return (v - np.mean(v))
     elif getq == 'deltafrac_':
@@ -849,27 +1018,26 @@ def get_projections(obj, quant):
     y_b = obj.get_var(v2 + 'yc')
     z_b = obj.get_var(v2 + 'zc')
 
-    def proj_task(x1, y1, z1, x2, y2, z2):
-        '''do projecting; can be used in threadQuantity() or as is'''
+    def proj_task(x1, y1, z1, x2, y2, z2, out=None):
+        '''do projecting; can be used in tools.map_slabs() or as is'''
         v2Mag = np.sqrt(x2 ** 2 + y2 ** 2 + z2 ** 2)
         v2x, v2y, v2z = x2 / v2Mag, y2 / v2Mag, z2 / v2Mag
         parScal = np.sqrt((x1 * v2x)**2 + (y1 * v2y)**2 + (z1 * v2z)**2)
         parX, parY, parZ = x1 * v2x, y1 * v2y, z1 * v2z
         if par == 'par':
-            return np.abs(parScal)
+            return np.abs(parScal, out=out)
         elif par == 'per':
             perX = x1 - parX
             perY = y1 - parY
             perZ = z1 - parZ
-            v1Mag = np.sqrt(perX**2 + perY**2 + perZ**2)
+            v1Mag = np.sqrt(perX**2 + perY**2 + perZ**2, out=out)
             return v1Mag
 
     if obj.numThreads > 1:
         if obj.verbose:
             print('Threading', whsp*8, end="\r", flush=True)
 
-        return threadQuantity(proj_task, obj.numThreads,
-                              x_a, y_a, z_a, x_b, y_b, z_b)
+        return tools.map_slabs(obj, proj_task, x_a, y_a, z_a, x_b, y_b, z_b)
     else:
         return proj_task(x_a, y_a, z_a, x_b, y_b, z_b)
 
@@ -1133,23 +1301,98 @@ def get_stat_quant(obj, quant):
     document_vars.setattr_quant_selected(obj, command, _STAT_QUANT[0], delay=True)
 
     # do calculations and return result
-    val = obj.get_var(var)
-    if command == 'mean_':
-        return np.mean(val)
-    elif command == 'variance_':
-        return np.var(val)
-    elif command == 'std_':
-        return np.std(val)
+    # (reductions are done in a single streaming pass over z-slabs; see _iter_zslabs.)
+    if command in ('mean_', 'variance_', 'std_'):
+        n, mean, M2 = _stream_moments(obj, var)
+        if command == 'mean_':
+            return mean
+        elif command == 'variance_':
+            return M2 / n
+        else:
+            return np.sqrt(M2 / n)
     elif command == 'max_':
-        return np.max(val)
+        return _stream_reduce(obj, var, np.maximum)
     elif command == 'min_':
-        return np.min(val)
+        return _stream_reduce(obj, var, np.minimum)
     elif command == 'abs_':
-        return np.abs(val)
+        return np.abs(obj.get_var(var))   # (pointwise, so it doesn't need the full domain.)
     else:
         raise NotImplementedError(f'command={repr(command)} in get_stat_quant')
 
 
+# default
+_HPROFILE_QUANT = ('HPROFILE_QUANT', ['hmean_', 'hrms_', 'hstd_', 'hmax_', 'hmin_', 'hpercentile'])
+# get value
+
+
+def get_horizontal_profile(obj, quant):
+    '''profiles of horizontal statistics, e.g. the horizontal mean at each height.
+
+    The result will be a 1D array with one value per z-level of the (full) domain.
+    (It broadcasts against 3D arrays, e.g. get_var('tg') / get_var('hmean_tg').)
+    Computed in a single streaming pass over z-slabs, so only one slab of the
+    base variable is in memory at a time.
+    '''
+    if quant == '':
+        docvar = document_vars.vars_documenter(obj, *_HPROFILE_QUANT, get_horizontal_profile.__doc__)
+        docvar('hmean_', 'hmean_v --> np.mean(v, axis=(0,1)). horizontal mean at each height.', uni=UNI.qc(0))
+        docvar('hrms_', 'hrms_v --> np.sqrt(np.mean(v**2, axis=(0,1))). horizontal rms at each height.',
+               uni=UNI.qc(0))
+        docvar('hstd_', 'hstd_v --> np.std(v, axis=(0,1)). horizontal std at each height.', uni=UNI.qc(0))
+        docvar('hmax_', 'hmax_v --> np.max(v, axis=(0,1)). horizontal max at each height.', uni=UNI.qc(0))
+        docvar('hmin_', 'hmin_v --> np.min(v, axis=(0,1)). horizontal min at each height.', uni=UNI.qc(0))
+        docvar('hpercentile', 'hpercentileN_v --> np.percentile(v, N, axis=(0,1)). E.g. hpercentile90_tg.',
+               uni=UNI.qc(0))
+        return None
+
+    # interpret quant string
+    command, _, var = quant.partition('_')
+    command = command + '_'
+
+    q = None
+    if command.startswith('hpercentile') and (command != 'hpercentile_'):
+        try:
+            q = float(command[len('hpercentile'):-1])
+        except ValueError:
+            return None
+        command = 'hpercentile'
+    elif command not in _HPROFILE_QUANT[1]:
+        return None
+
+    # tell obj the quant we are getting by this function.
+    document_vars.setattr_quant_selected(obj, command, _HPROFILE_QUANT[0], delay=True)
+
+    # do calculations and return result
+    profiles = []
+    for _, val in _iter_zslabs(obj, var):
+        val = np.asarray(val)
+        if val.ndim != 3:
+            raise ValueError(f'{repr(quant)} requires {repr(var)} to be 3D, but got shape {val.shape}.')
+        profiles.append(_horizontal_profile(command, val, q=q))
+    return np.concatenate(profiles)
+
+
+def _horizontal_profile(command, val, q=None):
+    '''helper for get_horizontal_profile. returns profile (for command) of val, a 3D array.
+    Sums are taken with (at least) float64 precision.
+    '''
+    dtype = np.result_type(val.dtype, np.float64)
+    if command == 'hmean_':
+        return np.mean(val, axis=(0, 1), dtype=dtype)
+    elif command == 'hrms_':
+        return np.sqrt(np.mean(np.abs(val)**2, axis=(0, 1), dtype=np.float64))
+    elif command == 'hstd_':
+        return np.std(val, axis=(0, 1), dtype=dtype)
+    elif command == 'hmax_':
+        return np.max(val, axis=(0, 1))
+    elif command == 'hmin_':
+        return np.min(val, axis=(0, 1))
+    elif command == 'hpercentile':
+        return np.percentile(val, q, axis=(0, 1))
+    else:
+        raise NotImplementedError(f'command={repr(command)} in get_horizontal_profile')
+
+
 # default
 _FFT_QUANT = ('FFT_QUANT', ['fft2_', 'fftxy_', 'fftyz_', 'fftxz_'])
 # get value
@@ -1195,6 +1438,12 @@ def get_fft_quant(obj, quant):
     document_vars.setattr_quant_selected(obj, command, _FFT_QUANT[0], delay=True)
 
     # do calculations and return result
+    with _full_domain(obj):
+        return _get_fft_quant(obj, command, var)
+
+
+def _get_fft_quant(obj, command, var):
+    '''helper for get_fft_quant. Calculates the fft (for command) of var.'''
     val = obj(var)
     if command == 'fft2_':
         if np.shape(val) != obj.shape:
@@ -1215,7 +1464,8 @@ def get_fft_quant(obj, quant):
         AX_STR_TO_I = {'x': 0, 'y': 1, 'z': 2}
         xi = AX_STR_TO_I[x]
         yi = AX_STR_TO_I[y]
-        fft_unshifted = np.fft.fft2(val, axes=(xi, yi))
+        workers = tools.get_num_threads(tools.obj_num_threads(obj))   # (None --> scipy.fft default.)
+        fft_unshifted = scipy_fft.fft2(val, axes=(xi, yi), workers=workers)
         return np.fft.fftshift(fft_unshifted)
     else:
         raise NotImplementedError(f'command={repr(command)} in get_fft_quant')
@@ -1280,45 +1530,36 @@ def get_multi_quant(obj, quant):
 ''' ------------- End get_quant() functions; Begin helper functions -------------  '''
 
 
-def threadQuantity(task, numThreads, *args):
-    # split arg arrays
-    args = list(args)
+class _ThreadQuantityOwner():
+    '''owns a thread pool with numThreads workers (see tools.thread_pool). Used by threadQuantity.
+    The pool is shut down when the owner is deleted, i.e. at the end of each threadQuantity call.
+    '''
 
-    for index in range(np.shape(args)[0]):
-        args[index] = np.array_split(args[index], numThreads)
+    def __init__(self, numThreads):
+        self.numThreads = numThreads
 
-    # make threadpool, task = task, with zipped args
-    pool = ThreadPool(processes=numThreads)
-    result = np.concatenate(pool.starmap(task, zip(*args)))
-    return result
 
+def _thread_quantity(task, numThreads, args, axis):
+    '''returns task(*args), computed in numThreads slabs along axis, in parallel. (see tools.map_slabs)
+    task doesn't need to accept out; its result for each slab is copied into the full array.
+    '''
+    def slab_task(*slab_args, out=None):
+        return task(*slab_args)
+    return tools.map_slabs(_ThreadQuantityOwner(numThreads), slab_task, *args, axis=axis)
 
-def threadQuantity_y(task, numThreads, *args):
-    # split arg arrays
-    args = list(args)
 
-    for index in range(np.shape(args)[0]):
-        if len(np.shape(args[index])) == 3:
-            args[index] = np.array_split(args[index], numThreads, axis=1)
-        else:
-            args[index] = np.array_split(args[index], numThreads)
-    # make threadpool, task = task, with zipped args
-    pool = ThreadPool(processes=numThreads)
-    result = np.concatenate(pool.starmap(task, zip(*args)), axis=1)
-    return result
+def threadQuantity(task, numThreads, *args):
+    '''returns task(*args), computed in numThreads slabs along x, in parallel. (see tools.map_slabs)
+    For backwards compatibility; prefer tools.map_slabs(obj, task, *args), which uses obj's thread pool.
+    '''
+    return _thread_quantity(task, numThreads, args, axis=0)
 
 
-def threadQuantity_z(task, numThreads, *args):
-    # split arg arrays
-    args = list(args)
+def threadQuantity_y(task, numThreads, *args):
+    '''like threadQuantity, but with slabs along y.'''
+    return _thread_quantity(task, numThreads, args, axis=1)
 
-    for index in range(np.shape(args)[0]):
-        if len(np.shape(args[index])) == 3:
-            args[index] = np.array_split(args[index], numThreads, axis=2)
-        else:
-            args[index] = np.array_split(args[index], numThreads)
 
-    # make threadpool, task = task, with zipped args
-    pool = ThreadPool(processes=numThreads)
-    result = np.concatenate(pool.starmap(task, zip(*args)), axis=2)
-    return result
+def threadQuantity_z(task, numThreads, *args):
+    '''like threadQuantity, but with slabs along z.'''
+    return _thread_quantity(task, numThreads, args, axis=2)
@@ -9,7 +9,8 @@ from . import document_vars
 from .units import DIMENSIONLESS, UNI, UNI_speed, Usym
 
 
-def load_fromfile_quantities(obj, quant, order='F', mode='r', panic=False, save_if_composite=False, cgsunits=None, **kwargs):
+def load_fromfile_quantities(obj, quant, order='F', mode='r', panic=False, save_if_composite=False,
+                              cgsunits=None, window=None, **kwargs):
     '''loads quantities which are stored directly inside files.
 
     save_if_composite: False (default) or True.
@@ -19,6 +20,9 @@ def load_fromfile_quantities(obj, quant, order='F', mode='r', panic=False, save_
     cgsunits: None or value
       None --> ignore
       value --> multiply val by this value if val was a simple var.
+
+    window: None or (iix, iiy, iiz)
+      if provided, simple vars may be read only on this part of the domain. (see EbysusData._get_simple_var)
     '''
     __tracebackhide__ = True  # hide this func from error traceback stack.
 
@@ -30,7 +34,9 @@ def load_fromfile_quantities(obj, quant, order='F', mode='r', panic=False, save_
                                   '(Except for composite_var, which is included here only because it used to be in bifrost.py.)')
                                  )
 
-    val = obj._get_simple_var(quant, order=order, mode=mode, panic=panic, **kwargs)  # method of obj.
+    kw__window = dict() if window is None else dict(window=window)
+    # method of obj.
+    val = obj._get_simple_var(quant, order=order, mode=mode, panic=panic, **kw__window, **kwargs)
     if ((cgsunits is not None) and (val is not None)):
         val = val*cgsunits
     if val is None:
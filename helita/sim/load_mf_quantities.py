@@ -5,11 +5,11 @@ import warnings
 import numpy as np
 
 # import internal modules
-from . import document_vars
+from . import collisions, document_vars
 from .file_memory import Caching  # never alters results, but caches them for better efficiency.
 # use sparingly on "short" calculations; apply liberally to "long" calculations.
 # see also cache_with_nfluid and cache kwargs of get_var.
-from .load_arithmetic_quantities import do_stagger
+from .load_arithmetic_quantities import _can_interp, do_stagger
 # import the relevant things from the internal module "units"
 from .units import (
     DIMENSIONLESS,
@@ -40,6 +40,13 @@ YZ_FROM_X = dict(x=('y', 'z'), y=('z', 'x'), z=('x', 'y'))  # right-handed coord
 units_e = dict(uni_f=UNI.e, usi_name=Usym('J') / Usym('m')**3)  # ucgs_name= ???
 
 
+def _interp(obj, val, interp):
+    '''returns val interpolated the same way as get_var(var + interp) would do it. E.g. interp='xdn'.'''
+    if _can_interp(obj, interp[0]):
+        val = do_stagger(val, interp, obj=obj)
+    return val
+
+
 def load_mf_quantities(obj, quant, *args__None, GLOBAL_QUANT=None, EFIELD_QUANT=None,
                        ONEFLUID_QUANT=None, ELECTRON_QUANT=None,
                        CONTINUITY_QUANT=None, MOMENTUM_QUANT=None, HEATING_QUANT=None,
@@ -148,33 +155,22 @@ def get_global_var(obj, var, GLOBAL_QUANT=None):
 
     output = obj.zero_at_mesh_center()
     if var == 'totr':  # total density
-        for ispecies in obj.att:
-            nlevels = obj.att[ispecies].params.nlevel
-            for ilevel in range(1, nlevels+1):
-                output += obj.get_var('r', mf_ispecies=ispecies, mf_ilevel=ilevel)
-
-        return output
+        fluids = [(ispecies, ilevel) for ispecies in obj.att
+                  for ilevel in range(1, obj.att[ispecies].params.nlevel+1)]
+        return _fluids_sum(obj, 'r', fluids, output)
     elif var in ['rc', 'rions']:  # total ionized density
-        for fluid in obj.fluids.ions():
-            output += obj.get_var('r', ifluid=fluid)
-        return output
+        return _fluids_sum(obj, 'r', [fluid.SL for fluid in obj.fluids.ions()], output)
     elif var == 'rneu':  # total neutral density
-        for ispecies in obj.att:
-            nlevels = obj.att[ispecies].params.nlevel
-            for ilevel in range(1, nlevels+1):
-                if (obj.att[ispecies].params.levels['stage'][ilevel-1] == 1):
-                    output += obj.get_var('r', mf_ispecies=ispecies, mf_ilevel=ilevel)
-        return output
+        fluids = [(ispecies, ilevel) for ispecies in obj.att
+                  for ilevel in range(1, obj.att[ispecies].params.nlevel+1)
+                  if obj.att[ispecies].params.levels['stage'][ilevel-1] == 1]
+        return _fluids_sum(obj, 'r', fluids, output)
     elif var == 'tot_e':
-        output += obj.get_var('e', mf_ispecies=-1)  # internal energy density of electrons
-        for fluid in obj.fluids:
-            output += obj.get_var('e', ifluid=fluid.SL)  # internal energy density of fluid
-        return output
+        # internal energy density of electrons and of each fluid
+        return _fluids_sum(obj, 'e', obj.fluid_SLs(with_electrons=True), output)
     elif var == 'tot_ke':
         output = obj.get_var('eke')   # kinetic energy density of electrons
-        for fluid in obj.fluids:
-            output += obj.get_var('ke', ifluid=fluid.SL)  # kinetic energy density of fluid
-        return output
+        return _fluids_sum(obj, 'ke', 'all', output)   # (plus kinetic energy density of each fluid)
     elif var == 'e_ef':
         ef2 = obj.get_var('ef2')   # |E|^2  [simu E-field units, squared]
         eps0 = obj.uni.permsi       # epsilon_0 [SI units]
@@ -185,9 +181,7 @@ def get_global_var(obj, var, GLOBAL_QUANT=None):
         ne = obj.get_var('nr', mf_ispecies=-1)   # [simu. number density units]
         neqe = ne * obj.uni.simu_qsi_e
         rhoe = obj.get_var('re')
-        nu_sum = 0.0
-        for fluid in obj.fluids:
-            nu_sum += obj.get_var('nu_ij', mf_ispecies=-1, jfluid=fluid)
+        nu_sum = collisions.nu_sum(obj, [collisions.ELECTRONS], [fluid.SL for fluid in obj.fluids])[0]
         output = nu_sum * rhoe / (neqe)**2
         return output
 
@@ -208,10 +202,7 @@ def get_global_var(obj, var, GLOBAL_QUANT=None):
 
     elif var.startswith('tot_p'):  # note: must be tot_px, tot_py, or tot_pz.
         axis = var[-1]
-        for fluid in obj.fluids:
-            output += obj.get_var('p'+axis, ifluid=fluid.SL)   # momentum density of fluid
-
-        return output
+        return _fluids_sum(obj, 'p'+axis, 'all', output)   # sum of momentum density of each fluid
     elif var == 'grph':
         for ispecies in obj.att:
             nlevels = obj.att[ispecies].params.nlevel
@@ -273,6 +264,17 @@ def get_global_var(obj, var, GLOBAL_QUANT=None):
         raise NotImplementedError(f'{repr(var)} in get_global_var')
 
 
+def _fluids_sum(obj, var, fluids, output):
+    '''returns output + sum of obj.get_var(var, ifluid=fluid) for fluid in fluids. (adds to output in-place.)
+    Adds one fluid at a time (see obj.iter_var_fluids), so only one fluid's value is in memory at once.
+    '''
+    if len(fluids) == 0:
+        return output
+    for val in obj.iter_var_fluids(var, fluids):
+        output += val
+    return output
+
+
 # default
 _EFIELD_QUANT = ('EFIELD_QUANT',
                  ['efx', 'efy', 'efz',
@@ -794,8 +796,20 @@ def get_momentum_quant(obj, var, MOMENTUM_QUANT=None):
             return ri * nu_ij * (ujx - uix)
 
     elif ubase == 'rijsum':
-        u = 'u' if umom else ''
-        return sum(obj(f'{u}rij{x}', jfluid=jSL) for jSL in obj.fluid_SLs(with_electrons=True))
+        # sum_j rij, with all the nu_ij from one pass (see collisions.py). rij = ri nu_ij * (u_j - u_i)
+        ifluid = obj.ifluid
+        jfluids = [jSL for jSL in obj.fluid_SLs(with_electrons=True) if not obj.fluids_equal(ifluid, jSL)]
+        nu_ij = collisions.nu_row(obj, ifluid, jfluids)
+        with obj.MaintainFluids():
+            uix = obj.get_var('ui'+x, ifluid=ifluid)
+            result = obj.zero_at_mesh_face(x)
+            for nu, jSL in zip(nu_ij, jfluids):
+                ujx = obj.get_var('ui'+x, ifluid=jSL)
+                result += _interp(obj, nu, x+'dn') * (ujx - uix)
+        if umom:
+            return result
+        else:
+            return obj.get_var('ri' + x+'dn') * result
 
     ## LORENTZ FORCE ##
     elif ubase in ('momfef', 'momfb', 'momflorentz'):
@@ -893,12 +907,12 @@ def get_momentum_quant(obj, var, MOMENTUM_QUANT=None):
         # Ex is at (0, -0.5, -0.5), so we shift by xdn, yup, zup
         # Meanwhile, scalars are at (0,0,0), so we shift those by xdn to align with u.
         Ex = obj.get_var('ef'+x + x+'dn' + y+'up' + z+'up', cache_with_nfluid=0)
+        jfluids = [jSL for jSL in obj.iter_fluid_SLs() if jSL != ifluid_orig]
+        nu_sj = collisions.nu_row(obj, ifluid_orig, jfluids)   # all nu_sj in one pass (see collisions.py)
         sum_nu_u = 0
-        for jSL in obj.iter_fluid_SLs():
-            if jSL != ifluid_orig:
-                nu_sj = obj.get_var('nu_ij' + x+'dn', ifluid=ifluid_orig, jfluid=jSL)
-                uj = obj.get_var('ui'+x, ifluid=jSL)
-                sum_nu_u += nu_sj * uj
+        for nu, jSL in zip(nu_sj, jfluids):
+            uj = obj.get_var('ui'+x, ifluid=jSL)
+            sum_nu_u += _interp(obj, nu, x+'dn') * uj
         return (qi / mi) * Ex + sum_nu_u
 
     elif base == 'ueq':
@@ -913,10 +927,7 @@ def get_momentum_quant(obj, var, MOMENTUM_QUANT=None):
         # begin calculations
         ueq_scr_x_B__x = obj.get_var('_ueq_scr_facecrosstoface_b'+x)
         ueq_scr__x = obj.get_var('_ueq_scr'+x)
-        sumnu = 0
-        for jSL in obj.iter_fluid_SLs():
-            if jSL != obj.ifluid:
-                sumnu += obj.get_var('nu_ij' + x+'dn', jfluid=jSL)
+        sumnu = obj.get_var('nu_ssum' + x+'dn')
         numer = qi * ueq_scr_x_B__x + mi * sumnu * ueq_scr__x
         denom = (qi**2/mi) * B2 + mi * sumnu**2
         return numer / denom
@@ -1078,24 +1089,16 @@ def get_heating_quant(obj, var, HEATING_QUANT=None):
         if heating_is_off() or obj.i_j_same_fluid():
             return obj.zero_at_mesh_center()
         ni = obj.get_var('nr')             # [simu. units]
-        mi = obj.get_mass(obj.mf_ispecies)  # [amu]
-        mj = obj.get_mass(obj.mf_jspecies)  # [amu]
         nu_ij = obj.get_var('nu_ij')       # [simu. units]
-        coeff = (mi / (mi + mj)) * ni * nu_ij   # [simu units: length^-3 time^-1]
+        coeff = _qcol_mass_frac(obj, obj.ifluid, obj.jfluid) * ni * nu_ij   # [simu units: length^-3 time^-1]
         return coeff
 
     elif var in ['qcol_uj', 'qcol_tgj']:
         if heating_is_off() or obj.i_j_same_fluid():
             return obj.zero_at_mesh_center()
         coeff = obj.get_var('qcol_coeffj')
-        if var == 'qcol_uj':
-            mj_simu = obj.get_mass(obj.mf_jspecies, units='simu')  # [simu mass]
-            energy = mj_simu * obj.get_var('uid2')        # [simu energy]
-        elif var == 'qcol_tgj':
-            simu_kB = obj.uni.ksi_b * (obj.uni.usi_nr / obj.uni.usi_e)   # kB [simu energy / K]
-            tgi = obj.get_var('tg')                       # [K]
-            tgj = obj.get_var('tg', ifluid=obj.jfluid)    # [K]
-            energy = 3. * simu_kB * (tgj - tgi)
+        with obj.MaintainFluids():
+            energy = _qcol_energy(obj, var, obj.ifluid, obj.jfluid)   # [simu energy]
         return coeff * energy  # [simu energy density / time]
 
     elif var in ['qcolj', 'qcol_j']:
@@ -1106,6 +1109,10 @@ def get_heating_quant(obj, var, HEATING_QUANT=None):
     elif var in ['qcol_u', 'qcol_tg']:
         if heating_is_off():
             return obj.zero_at_mesh_center()
+        if obj.match_physics():   # (when matching aux, heating_is_off can depend on jfluid.)
+            jfluids = [jSL for jSL in obj.fluid_SLs(with_electrons=True)
+                       if not obj.fluids_equal(obj.ifluid, jSL)]
+            return _qcol_sum(obj, var, jfluids)
         varj = var + 'j'   # qcol_uj or qcol_tgj
         output = obj.get_var(varj, jS=-1)   # get varj for j = electrons
         for fluid in obj.fluids:
@@ -1117,6 +1124,9 @@ def get_heating_quant(obj, var, HEATING_QUANT=None):
         output = obj.zero_at_mesh_center()
         if heating_is_off():
             return obj.zero_at_mesh_center()
+        if obj.match_physics():   # (when matching aux, heating_is_off can depend on jfluid.)
+            jfluids = [fluid.SL for fluid in obj.fluids if fluid.SL != obj.ifluid]
+            return _qcol_sum(obj, var[:-4], jfluids)
         varj = var[:-4] + 'j'   # qcol_uj or qcol_tgj
         for fluid in obj.fluids:
             if fluid.SL != obj.ifluid:        # exclude varj for j = i  # not necessary but doesn't hurt.
@@ -1177,9 +1187,16 @@ def get_heating_quant(obj, var, HEATING_QUANT=None):
             # suffix == 'uj' or 'tgj'
             with obj.MaintainFluids():
                 # denom = sum_{s!=i}(Cis).     [(simu length)^-3 (simu time)^-1]
-                denom = obj.get_var('qcol_coeffj', jS=-1, cache_with_nfluid=2)  # coeff for j = electrons
-                for fluid in obj.fluids:
-                    denom += obj.get_var('qcol_coeffj', jfluid=fluid, cache_with_nfluid=2)
+                if obj.match_physics():   # Cis = (mi / (mi + ms)) * ni * nu_is. get all nu_is in one pass.
+                    jfluids = [collisions.ELECTRONS] + [fluid.SL for fluid in obj.fluids]
+                    mfrac = [_qcol_mass_frac(obj, obj.ifluid, jSL) for jSL in jfluids]
+                    pairs = [(obj.ifluid, jSL) for jSL in jfluids]
+                    denom = obj.get_var('nr', ifluid=obj.ifluid) * \
+                        collisions.colfreq_sums(obj, pairs, dest=[0] * len(pairs), nout=1, weights=mfrac)[0]
+                else:
+                    denom = obj.get_var('qcol_coeffj', jS=-1, cache_with_nfluid=2)  # coeff for j = electrons
+                    for fluid in obj.fluids:
+                        denom += obj.get_var('qcol_coeffj', jfluid=fluid, cache_with_nfluid=2)
             # Based on suffix, return appropriate term.
             if suffix == 'uj':
                 simu_kB = obj.uni.ksi_b * (obj.uni.usi_nr / obj.uni.usi_e)   # kB [simu energy / K]
@@ -1214,6 +1231,43 @@ def get_heating_quant(obj, var, HEATING_QUANT=None):
         raise NotImplementedError(f'{repr(var)} in get_heating_quant')
 
 
+def _qcol_mass_frac(obj, ifluid, jfluid):
+    '''returns mi / (mi + mj), the mass factor in qcol_coeffj = (mi / (mi + mj)) * ni * nu_ij.'''
+    mi = obj.get_mass(ifluid)   # [amu]
+    mj = obj.get_mass(jfluid)   # [amu]
+    return mi / (mi + mj)
+
+
+def _qcol_energy(obj, var, ifluid, jfluid):
+    '''returns the energy [simu energy] which multiplies qcol_coeffj in var ('qcol_uj' or 'qcol_tgj').
+    (may change obj.ifluid; use inside obj.MaintainFluids().)
+    '''
+    if var == 'qcol_uj':
+        mj_simu = obj.get_mass(jfluid, units='simu')   # [simu mass]
+        return mj_simu * obj.get_var('uid2', ifluid=ifluid, jfluid=jfluid)
+    else:  # var == 'qcol_tgj'
+        simu_kB = obj.uni.ksi_b * (obj.uni.usi_nr / obj.uni.usi_e)   # kB [simu energy / K]
+        tgi = obj.get_var('tg', ifluid=ifluid)    # [K]
+        tgj = obj.get_var('tg', ifluid=jfluid)    # [K]
+        return 3. * simu_kB * (tgj - tgi)
+
+
+def _qcol_sum(obj, var, jfluids):
+    '''returns sum over jfluids of qcol_uj (if var == 'qcol_u') or qcol_tgj (if var == 'qcol_tg').
+    Gets all the nu_ij from one pass (see collisions.py), instead of one get_var('qcol_coeffj') per jfluid.
+    '''
+    nu_ij = collisions.nu_row(obj, obj.ifluid, jfluids)
+    with obj.MaintainFluids():
+        ifluid = obj.ifluid
+        ni = obj.get_var('nr', ifluid=ifluid)   # [simu. units]
+        result = obj.zero_at_mesh_center()
+        for nu, jSL in zip(nu_ij, jfluids):
+            # qcol_coeffj. [simu units: length^-3 time^-1]
+            coeff = _qcol_mass_frac(obj, ifluid, jSL) * ni * nu
+            result += coeff * _qcol_energy(obj, var + 'j', ifluid, jSL)   # [simu energy density / time]
+    return result
+
+
 # default
 _SPITZTERM_QUANT = ('SPITZTERM_QUANT', ['kappaq', 'dxTe', 'dyTe', 'dzTe', 'rhs'])
 # get value
@@ -1440,21 +1494,11 @@ def get_mf_colf(obj, var, COLFRE_QUANT=None):
 
     # sum of collision frequencies: sum_{i in ions} (nu_{ifluid, i})
     elif var == 'nu_si':
-        ifluid = obj.ifluid
-        result = obj.zero_at_mesh_center()
-        for fluid in obj.fluids.ions():
-            if fluid.SL != ifluid:
-                result += obj.get_var('nu_ij', jfluid=fluid.SL)
-        return result
+        return collisions.nu_sum(obj, [obj.ifluid], [fluid.SL for fluid in obj.fluids.ions()])[0]
 
     # sum of collision frequencies: sum_{n in neutrals} (nu_{ifluid, n})
     elif var == 'nu_sn':
-        ifluid = obj.ifluid
-        result = obj.zero_at_mesh_center()
-        for fluid in obj.fluids.neutrals():
-            if fluid.SL != ifluid:
-                result += obj.get_var('nu_ij', jfluid=fluid.SL)
-        return result
+        return collisions.nu_sum(obj, [obj.ifluid], [fluid.SL for fluid in obj.fluids.neutrals()])[0]
 
     elif var == 'nu_ei':
         return obj.get_var('nu_si', mf_ispecies=-1)
@@ -1464,9 +1508,7 @@ def get_mf_colf(obj, var, COLFRE_QUANT=None):
 
     # sum of collision frequencies: sum_{s != ifluid} (nu_{ifluid, s})
     elif var == 'nu_ssum':
-        return sum(obj('nu_ij', jSL=SL)
-                   for SL in obj.fluid_SLs(with_electrons=True)
-                   if not obj.fluids_equal(obj.ifluid, SL))
+        return collisions.nu_sum(obj, [obj.ifluid], obj.fluid_SLs(with_electrons=True))[0]
 
     # collision frequency - resonant charge exchange for H, H+
     elif var == 'nu_ij_res':
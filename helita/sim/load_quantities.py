@@ -5,17 +5,15 @@ import warnings
 import numpy as np
 
 # import internal modules
-from . import document_vars, tools
+from . import document_vars, stagger, tools
 from .load_arithmetic_quantities import do_stagger
 
 # from glob import glob   # this is only used for find_first_match which is never called...
 
 
-try:
-    from numba import jit, njit, prange
-except ImportError:
-    numba = prange = tools.ImportFailed('numba', "This module is required to use stagger_kind='numba'.")
-    jit = njit = tools.boring_decorator
+# numba is slow to import, so only import it when a numba function is first called. (see tools.LazyNjit)
+njit = tools.lazy_njit
+prange = range   # replaced by numba.prange when the numba functions in this file are compiled.
 
 # import the potentially-relevant things from the internal module "units"
 from .units import UNI_nr
@@ -1775,7 +1773,7 @@ def get_spitzerparam(obj, quant, SPITZER_QUANT=None, **kwargs):
 ''' ------------- End get_quant() functions; Begin helper functions -------------  '''
 
 
-@njit(parallel=True)
+@njit(parallel=True, cache=stagger.NUMBA_CACHE)
 def calc_field_lines(x, y, z, bxc, byc, bzc, niter=501):
 
     modb = np.sqrt(bxc**2+byc**2+bzc**2)
@@ -1818,7 +1816,7 @@ def calc_field_lines(x, y, z, bxc, byc, bzc, niter=501):
     return xl, yl, zl
 
 
-@njit(parallel=True)
+@njit(parallel=True, cache=stagger.NUMBA_CACHE)
 def calc_lenghth_lines(xl, yl, zl):
 
     nx, ny, nz, nl = np.shape(xl)
@@ -3,7 +3,7 @@ import os
 import numpy as np
 
 from . import document_vars
-from .bifrost import Rhoeetab
+from .bifrost import get_rhoeetab
 from .load_arithmetic_quantities import *
 from .load_quantities import *
 from .tools import *
@@ -61,7 +61,7 @@ class MuramAtmos:
         tabfile = os.path.join(self.fdir, 'tabparam.in')
 
         if os.access(tabfile, os.R_OK):
-            self.rhoee = Rhoeetab(tabfile=tabfile, fdir=fdir, radtab=False)
+            self.rhoee = get_rhoeetab(tabfile=tabfile, fdir=fdir, radtab=False)
 
         self.genvar(order=self.order)
 
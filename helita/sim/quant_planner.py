@@ -0,0 +1,296 @@
+"""
+purpose:
+
+    - get many quantities at once, calculating each shared intermediate quantity only once.
+      (see QuantPlan)
+
+Composite quantities are calculated recursively via get_var, and different quantities
+often need the same intermediate quantities (e.g. 'b2' and 'rotbx' both need 'bx').
+QuantPlan first discovers the dependency graph of the requested quantities, using the
+QuantTree which document_vars already builds during get_var, on a tiny sub-domain.
+Then, during evaluation, each node of the graph is calculated exactly once;
+its value is remembered only until its last consumer has used it.
+
+Example:
+    dd = BifrostData(...)
+    plan = dd.plan_vars(['b2', 'rotbx', 'ux', 'dpxdxup'])
+    print(plan)                      # shows the graph, and how many times each node is used.
+    result = plan.evaluate(snap=10)  # dict of {var: value}
+    result = plan.evaluate(snap=11)  # the same plan can be re-used for other snapshots.
+
+TODO:
+    the graph nodes are identified by (var, ifluid, jfluid, depth inside _full_domain).
+    Other attributes which affect the result (e.g. match_type) should not be changed
+    by any quantities while evaluating a plan.
+"""
+
+# import builtins
+import functools
+import collections
+
+# import external public modules
+import numpy as np
+
+# import internal modules
+from . import document_vars, tools
+
+# set defaults
+PLAN_ATTR = '_quant_plan'                 # attr of obj which stores the plan being recorded or evaluated.
+FULL_DOMAIN_DEPTH = '_full_domain_depth'  # attr of obj: how many _full_domain contexts we are inside.
+HIDE_DECORATOR_TRACEBACKS = True  # whether to hide decorators from this file when showing error traceback.
+
+# tuple of info about one node of the plan while evaluating it.
+PlanEntry = collections.namedtuple('PlanEntry', ('value', 'slices', 'quant_selected'))
+
+
+''' --------------------- plan tracking --------------------- '''
+
+
+def plan_key(obj, var):
+    '''returns the key which identifies var (at the current state of obj) in a QuantPlan.'''
+    return (var, getattr(obj, 'ifluid', None), getattr(obj, 'jfluid', None),
+            getattr(obj, FULL_DOMAIN_DEPTH, 0))
+
+
+def plan_tracking(f):
+    '''decorator which lets f(obj, var, ...) participate in obj's QuantPlan, if one is active.
+    decorate _load_quantity using this, *inside* of document_vars.quant_tracking_top_level.
+
+    while recording a plan, mark the node of the QuantTree for var with plan_key(obj, var).
+    while evaluating a plan, use the remembered value of var (if it exists), else calculate it.
+    '''
+    @functools.wraps(f)
+    def f_but_plan_tracking(obj, var, *args, **kwargs):
+        __tracebackhide__ = HIDE_DECORATOR_TRACEBACKS
+        plan = getattr(obj, PLAN_ATTR, None)
+        if plan is None:
+            return f(obj, var, *args, **kwargs)
+        else:
+            return plan._load(f, obj, var, *args, **kwargs)
+    return f_but_plan_tracking
+
+
+def _get_slices(obj):
+    return tuple(getattr(obj, 'ii'+x, slice(None)) for x in ('x', 'y', 'z'))
+
+
+def _slices_equal(A, B):
+    return all(np.array_equal(a, b) for a, b in zip(A, B))
+
+
+def _set_key_fluids(obj, key):
+    '''sets ifluid and jfluid of obj to match key. (does nothing if they are None.)'''
+    _, ifluid, jfluid = key[:3]
+    if ifluid is not None:
+        obj.set_mfi(*ifluid)
+    if jfluid is not None:
+        obj.set_mfj(*jfluid)
+
+
+def _copy_if_writeable(val):
+    '''returns a copy of val if it could be altered in-place by the caller, else val.
+    (read-only values, e.g. memmaps of simulation files, don't need to be copied.)
+    '''
+    if getattr(getattr(val, 'flags', None), 'writeable', False):
+        return np.array(val, copy=True, subok=True)
+    return val
+
+
+''' --------------------- QuantPlan --------------------- '''
+
+
+class QuantPlan():
+    '''dependency graph for a list of quantities; evaluates each node only once.
+
+    obj: BifrostData object (or subclass, e.g. EbysusData)
+    vars: list of strings
+        the quantities to get.
+    discovery_slices: None, or tuple of (iix, iiy, iiz)
+        domain for discovering the dependency graph. The graph is discovered by getting
+        all the vars on this domain. None --> the 1 cell in the middle of the domain.
+        If that fails for any var (with ValueError or IndexError, e.g. because the domain is too small),
+        discover the graph for that var on the domain from kw__get_var (or the domain of obj), instead.
+    **kw__get_var are passed to obj.get_var for every quantity in vars (e.g. ifluid).
+
+    The graph is stored in self.children: {key: [keys of quants that get_var got while getting key]}
+    The number of times each node will be gotten is stored in self.nuses: {key: N}
+    '''
+
+    def __init__(self, obj, vars, discovery_slices=None, **kw__get_var):
+        self.obj = obj
+        self.vars = list(vars)
+        self.kw__get_var = kw__get_var
+        self.recording = False
+        self.children = dict()
+        self.nuses = collections.Counter()
+        self.roots = []
+        self._discover(discovery_slices)
+        self.evaluations = 0  # number of evaluations so far.
+
+    ## DISCOVERY ##
+    def _discover(self, discovery_slices=None):
+        '''discover the dependency graph of self.vars, by getting them on a small domain.'''
+        obj = self.obj
+        if discovery_slices is None:
+            discovery_slices = tuple(getattr(obj, 'n'+x+'b') // 2 for x in ('x', 'y', 'z'))
+        iix, iiy, iiz = discovery_slices
+        # the graph doesn't depend on the domain,
+        # so discover it on discovery_slices, not the slices in kw__get_var.
+        kw__get_var = {key: val for key, val in self.kw__get_var.items() if key not in ('iix', 'iiy', 'iiz')}
+        orig_slices = _get_slices(obj)
+        self.recording = True
+        setattr(obj, PLAN_ATTR, self)
+        try:
+            # cached values would hide part of the QuantTree, so disable caching while discovering.
+            with tools.MaintainingAttrs(obj, 'do_caching'):
+                obj.do_caching = False
+                for var in self.vars:
+                    try:
+                        obj.get_var(var, iix=iix, iiy=iiy, iiz=iiz, **kw__get_var)
+                    except (ValueError, IndexError):   # e.g. var needs more cells than discovery_slices.
+                        obj.set_domain_iiaxes(*orig_slices, internal=False)
+                        obj.get_var(var, **self.kw__get_var)
+                    self._add_tree(document_vars.got_vars_tree(obj, as_data=True))
+        finally:
+            self.recording = False
+            setattr(obj, PLAN_ATTR, None)
+            obj.set_domain_iiaxes(*orig_slices, internal=False)
+
+    def _add_tree(self, tree):
+        '''add QuantTree (from get_var for one of self.vars) to self.'''
+        root = tree.plan_key
+        self.roots.append(root)
+        self.nuses[root] += 1
+        stack = [tree]
+        while len(stack) > 0:
+            node = stack.pop()
+            if (node.plan_key is None) or (node.plan_key in self.children):
+                continue  # unknown node, or we already know the children for this node.
+            children = [child for child in node.children if child.plan_key is not None]
+            self.children[node.plan_key] = [child.plan_key for child in children]
+            for child in children:
+                self.nuses[child.plan_key] += 1
+            stack.extend(children)
+
+    ## EVALUATION ##
+    def evaluate(self, snap=None, preread=False):
+        '''gets all the vars in self, at snap. returns dict of {var: value}.
+        Each node of the plan is calculated only once; intermediate results are
+        forgotten as soon as their last consumer has used them.
+
+        preread: bool, default False
+            whether to first read all the simple vars of the plan into memory, in on-disk order.
+            (Otherwise, simple vars are memmaps, which are read only when they are used.)
+        '''
+        obj = self.obj
+        if (snap is not None) and not np.array_equal(snap, obj.snap):
+            obj.set_snap(snap)
+        self._memory = dict()
+        self._nremaining = self.nuses.copy()
+        result = dict()
+        setattr(obj, PLAN_ATTR, self)
+        try:
+            if preread:
+                self._preread()
+            for var in self.vars:
+                result[var] = obj.get_var(var, **self.kw__get_var)
+        finally:
+            setattr(obj, PLAN_ATTR, None)
+            del self._memory, self._nremaining
+        self.evaluations += 1
+        return result
+
+    __call__ = evaluate
+
+    def _preread(self):
+        '''reads the simple vars of self into memory, in on-disk order; remembers them in self._memory.
+        They are read on the domain which get_var uses internally for the vars of self.
+        '''
+        obj = self.obj
+        if getattr(obj, 'sel_units', None) == 'cgs':
+            return   # simple vars are converted to cgs inside _load_quantity; don't skip that step.
+        simple_vars = getattr(obj, 'simple_vars', [])
+        keys = [key for key in self.nuses if (key[0] in simple_vars) and (key[3] == 0)]
+        if len(keys) == 0:
+            return
+        orig_slices = _get_slices(obj)
+        orig_fluids = (getattr(obj, 'ifluid', None), getattr(obj, 'jfluid', None))
+        try:
+            # set the domain to the one which get_var will use internally.
+            kw_slices = {ii: self.kw__get_var[ii] for ii in ('iix', 'iiy', 'iiz') if ii in self.kw__get_var}
+            obj.set_domain_iiaxes(**kw_slices, internal=True)
+            slices = _get_slices(obj)
+            # find location of each simple var in the files
+            locations = dict()
+            for key in keys:
+                _set_key_fluids(obj, key)
+                locations[key] = obj._simple_var_location(key[0])
+            # read the simple vars, in order.
+            for key in sorted(keys, key=lambda key: locations[key]):
+                _set_key_fluids(obj, key)
+                val = obj._get_simple_var(key[0])
+                for i, ii in enumerate(slices):
+                    val = val[(slice(None),)*i + (ii,)]
+                val = np.array(val, copy=True, subok=True)
+                val.flags.writeable = False   # read-only, like the memmap it replaces; so it is never copied.
+                quant_selected = document_vars.QuantInfo(varname=key[0], quant=key[0],
+                                                         typequant='SIMPLE_VARS', metaquant='fromfile',
+                                                         level=None)
+                self._memory[key] = PlanEntry(val, slices, quant_selected)
+        finally:
+            _set_key_fluids(obj, (None,) + orig_fluids)
+            obj.set_domain_iiaxes(*orig_slices, internal=False)
+
+    def _load(self, f, obj, var, *args, **kwargs):
+        '''returns f(obj, var, *args, **kwargs), or the remembered value, if we have it.
+        called by functions wrapped with plan_tracking, when self is obj's active plan.
+        '''
+        key = plan_key(obj, var)
+        if self.recording:
+            getattr(obj, document_vars.QUANTS_TREE).plan_key = key
+            return f(obj, var, *args, **kwargs)
+        # else, evaluating.
+        slices = _get_slices(obj)
+        entry = self._memory.get(key, None)
+        if (entry is not None) and _slices_equal(entry.slices, slices):
+            setattr(obj, document_vars.QUANT_SELECTED, entry.quant_selected)
+            val = entry.value
+            remembered = True
+        else:
+            val = f(obj, var, *args, **kwargs)
+            remembered = False
+        self._nremaining[key] -= 1
+        if self._nremaining[key] > 0:
+            if not remembered:
+                quant_selected = getattr(obj, document_vars.QUANT_SELECTED, None)
+                self._memory[key] = PlanEntry(val, slices, quant_selected)
+            return _copy_if_writeable(val)
+        else:
+            self._memory.pop(key, None)   # this was the last consumer; forget val.
+            return val
+
+    ## CONVENIENCE ##
+    def shared(self):
+        '''returns dict of {key: N} for all nodes which will be used N > 1 times.'''
+        return {key: n for key, n in self.nuses.items() if n > 1}
+
+    def __len__(self):
+        '''number of nodes in self.'''
+        return len(self.children)
+
+    def __repr__(self):
+        return '<{} of {} vars with {} nodes ({} shared) at {}>'.format(
+            type(self).__name__, len(self.vars), len(self), len(self.shared()), hex(id(self)))
+
+    def __str__(self):
+        lines = [repr(self)]
+        for key, children in self.children.items():
+            var, ifluid, jfluid, depth = key
+            if (ifluid is None) and (jfluid is None):
+                fluids = ''
+            else:
+                fluids = ' (ifluid={}, jfluid={})'.format(ifluid, jfluid)
+            domain = ' [full domain]' if depth > 0 else ''
+            lines.append('  {} x{}{}{} <- {}'.format(var, self.nuses[key], fluids, domain,
+                                                    [child[0] for child in children]))
+        return '\n'.join(lines)
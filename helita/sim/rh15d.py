@@ -5,12 +5,16 @@ import os
 import warnings
 import datetime
 import numpy as np
-import xarray as xr
-import h5py
-import netCDF4
 from io import StringIO
-from astropy import units
-from astropy import constants as const
+
+from . import tools
+
+# these modules are slow to import, so they are imported only when first used.
+xr = tools.lazy_import('xarray')
+h5py = tools.lazy_import('h5py')
+netCDF4 = tools.lazy_import('netCDF4')
+units = tools.lazy_import('astropy.units')
+const = tools.lazy_import('astropy.constants')
 
 
 class Rh15dout:
@@ -1224,10 +1228,13 @@ def clean_var(data, only_positive=True):
 
 
 def calc_wave_RH(wave0, nlambda, qcore, qwing, 
-                 vmicro_char=units.Quantity(2.5, unit='km/s'), asymm=True):
+                 vmicro_char=None, asymm=True):
     """
     Calculate line wavelengths using recipe from RH.
+    vmicro_char defaults to 2.5 km/s.
     """
+    if vmicro_char is None:
+        vmicro_char = units.Quantity(2.5, unit='km/s')
     q_to_λ = (wave0 * vmicro_char / const.c).to("nm")
     if not asymm:
         if nlambda % 2:
@@ -1263,10 +1270,13 @@ def calc_wave_RH(wave0, nlambda, qcore, qwing,
 
 
 def calc_wave_MULTI(wave0, nlambda, q0, qmax, 
-                    vmicro_char=units.Quantity(8, unit='km/s'), asymm=True):
+                    vmicro_char=None, asymm=True):
     """
     Calculate line wavelengths using recipe from MULTI.
+    vmicro_char defaults to 8 km/s.
     """
+    if vmicro_char is None:
+        vmicro_char = units.Quantity(8, unit='km/s')
     ν0 = (const.c / wave0).to("Hz")
     q = np.empty(nlambda)
     ten = 10.
@@ -0,0 +1,316 @@
+"""
+purpose:
+
+    - remember the metadata of all snapshots of a run in one index file. (see SnapIndex)
+
+Visiting many snapshots (e.g. set_snap, get_snaps, set_snap_time) normally requires listing
+the run directory, parsing the .idl file of each snapshot, and reading the mesh file.
+For runs with thousands of snapshots on slow (e.g. network) filesystems, that can take minutes.
+SnapIndex stores the parsed params, time, and file sizes of every snapshot in one JSON file
+(and the mesh arrays in a .npz file next to it), so those become dictionary lookups.
+(JSON and .npz, not pickle, so that loading an index from a shared directory never runs arbitrary code.)
+The index is updated incrementally; it only lists the run directory again
+when the directory has changed (e.g. when new snapshots appear),
+and only parses the .idl files of snapshots which it doesn't know yet.
+
+Example:
+    dd = BifrostData('cb24bih', fdir='/data/cb24bih', snap_index=True)   # index in SNAP_INDEX_DIR
+    dd = BifrostData('cb24bih', fdir='/data/cb24bih', snap_index='/data/cb24bih/.cb24bih.snap_index')
+    dd.get_snaps()                  # snap numbers, from the index.
+    dd.set_snap(dd.get_snaps())     # reads no .idl or mesh files (after the index is built).
+    dd.snap_index.times()           # {snap: t}
+
+TODO:
+    files which are modified in-place (without changing the directory's modification time)
+    are only noticed by update(full=True). Scratch snapshots (.idl.scr) are never indexed.
+"""
+
+# import builtins
+import os
+import re
+import json
+import hashlib
+import warnings
+
+# import external public modules
+import numpy as np
+
+# set defaults
+SNAP_INDEX_DIR = os.environ.get('HELITA_SNAP_INDEX_DIR',
+                                os.path.join(os.path.expanduser('~'), '.cache', 'helita', 'snap_index'))
+INDEX_EXT = '.snap_index'
+MESHES_EXT = '.meshes.npz'   # the mesh arrays of the index at path are stored at path + MESHES_EXT.
+INDEX_VERSION = 2   # increase this if the contents of the index change; older indexes will be rebuilt.
+
+
+''' --------------------- SnapIndex --------------------- '''
+
+
+def default_index_path(fdir, snapname):
+    '''returns path of the index file for the run with this fdir and snapname, in SNAP_INDEX_DIR.'''
+    run = os.path.join(os.path.abspath(fdir), snapname)
+    key = hashlib.sha1(run.encode()).hexdigest()[:16]
+    return os.path.join(SNAP_INDEX_DIR, f'{snapname}_{key}{INDEX_EXT}')
+
+
+class SnapIndex():
+    '''index of the metadata of all snapshots of one run.
+
+    fdir: string
+        directory of the run.
+    snapname: string
+        snapname of the run, e.g. 'cb24bih'.
+        Snapshot files are named snapname_NNN.ext (or snapname.ext for snap 0).
+    path: None or string
+        where to store the index. None --> default_index_path(fdir, snapname).
+        if it can't be written there, keep the index only in memory.
+        The mesh arrays are stored at path + MESHES_EXT.
+        If the index can't be loaded from path (e.g. it is corrupt), it is rebuilt.
+
+    The index is a dict with keys:
+        'snaps': {snap: entry}, where entry is a dict with keys:
+            'params': dict of params from the .idl file, 't': time (simulation units),
+            'idl': (mtime, size) of the .idl file, 'mesh': sha1 hash of the mesh file (or None),
+            'files': {filename: size} for all files of this snapshot (e.g. .idl, .snap, .aux).
+        'meshes': {sha1 hash: dict of mesh arrays (see bifrost.read_mesh_ascii)}
+        'meshfiles': {meshfile: (mtime, size, sha1 hash)}
+        'dir_mtime': modification time of fdir when it was last listed.
+    '''
+
+    def __init__(self, fdir, snapname, path=None):
+        self.fdir = os.path.abspath(fdir)
+        self.snapname = snapname
+        self.path = default_index_path(fdir, snapname) if path is None else path
+        self._pattern = re.compile(r'^{}(?:_(\d+))?\.(.+)$'.format(re.escape(snapname)))
+        self.index = self._load()
+
+    def _empty_index(self):
+        return dict(version=INDEX_VERSION, fdir=self.fdir, snapname=self.snapname,
+                    snaps=dict(), meshes=dict(), meshfiles=dict(), dir_mtime=None)
+
+    def _load(self):
+        '''returns index from self.path, or an empty index if that is not possible.'''
+        try:
+            index = self._read()
+        except Exception:   # missing, corrupt, or truncated index (or from an older version) --> rebuild it.
+            return self._empty_index()
+        if (index.get('version', None) != INDEX_VERSION) or (index.get('fdir', None) != self.fdir):
+            return self._empty_index()
+        return index
+
+    def _read(self):
+        '''reads index from self.path (and its meshes from self.path + MESHES_EXT). Crashes if that fails.'''
+        with open(self.path, 'r') as f:
+            index = json.load(f)
+        # (JSON keys are always strings, and JSON has no tuples.)
+        index['snaps'] = {int(snap): entry for snap, entry in index['snaps'].items()}
+        for entry in index['snaps'].values():
+            entry['idl'] = tuple(entry['idl'])
+        index['meshfiles'] = {name: tuple(known) for name, known in index['meshfiles'].items()}
+        meshes = dict()
+        with np.load(self.path + MESHES_EXT, allow_pickle=False) as arrays:
+            for key in arrays.files:
+                meshhash, _, attr = key.partition('/')
+                arr = arrays[key]
+                meshes.setdefault(meshhash, dict())[attr] = arr.item() if arr.ndim == 0 else arr
+        missing = set(known[2] for known in index['meshfiles'].values()) - set(meshes)
+        if len(missing) > 0:
+            raise ValueError(f'meshes missing from {repr(self.path + MESHES_EXT)}: {missing}')
+        index['meshes'] = meshes
+        return index
+
+    def save(self):
+        '''saves index to self.path. if that fails, warn and keep the index only in memory.'''
+        if self.path is None:
+            return
+        index = {key: val for key, val in self.index.items() if key != 'meshes'}
+        arrays = {f'{meshhash}/{attr}': val for meshhash, mesh in self.index['meshes'].items()
+                  for attr, val in mesh.items()}
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmppath = '{}.tmp{}'.format(self.path, os.getpid())
+            with open(tmppath + MESHES_EXT, 'wb') as f:
+                np.savez(f, **arrays)
+            with open(tmppath, 'w') as f:
+                json.dump(index, f)
+            # (replace, so other processes never see a partial file. meshes first; the index refers to them.)
+            os.replace(tmppath + MESHES_EXT, self.path + MESHES_EXT)
+            os.replace(tmppath, self.path)
+        except (OSError, TypeError, ValueError) as err:   # (TypeError if params can't be stored as JSON.)
+            warnings.warn(f'failed to save snapshot index at {repr(self.path)}; '
+                          f'keeping it in memory only. ({err!r})')
+            self.path = None
+
+    ## UPDATING ##
+    def update(self, full=False):
+        '''updates self to include all snapshots in self.fdir. returns whether anything changed.
+        Does nothing if self.fdir hasn't been modified since it was last listed, unless full.
+
+        full: bool, default False
+            if True, also re-check the sizes and modification times of all files,
+            and re-read any .idl or mesh files which were modified.
+        '''
+        dir_mtime = os.stat(self.fdir).st_mtime_ns
+        if (not full) and (dir_mtime == self.index['dir_mtime']):
+            return False
+        snaps = self.index['snaps']
+        changed = False
+        # group files by snapshot
+        files = dict()
+        with os.scandir(self.fdir) as entries:
+            for entry in entries:
+                match = self._pattern.match(entry.name)
+                if match is None:
+                    continue
+                N, ext = match.groups()
+                if (N is None) and (ext not in ('idl', 'snap', 'aux', 'panic', 'aux.panic')):
+                    continue   # e.g. snapname.mesh. (snap 0 is snapname.idl, snapname.snap, ...)
+                files.setdefault(0 if N is None else int(N), dict())[entry.name] = entry
+        # forget removed snapshots
+        for snap in list(snaps.keys()):
+            if (snap not in files) or (self._idl_name(snap) not in files[snap]):
+                del snaps[snap]
+                changed = True
+        # add new (or, if full, modified) snapshots
+        for snap, snapfiles in files.items():
+            idlname = self._idl_name(snap)
+            if idlname not in snapfiles:
+                continue
+            known = snaps.get(snap, None)
+            if (known is not None) and not full:
+                new_names = set(snapfiles) - set(known['files'])
+                if len(new_names) > 0:   # e.g. the .snap file appeared after the .idl file.
+                    known['files'].update({name: snapfiles[name].stat().st_size for name in new_names})
+                    changed = True
+                continue
+            stats = {name: entry.stat() for name, entry in snapfiles.items()}
+            idl = (stats[idlname].st_mtime_ns, stats[idlname].st_size)
+            sizes = {name: stat.st_size for name, stat in stats.items()}
+            if (known is not None) and (known['idl'] == idl):
+                meshname = known['params'].get('meshfile', None)
+                meshhash = None if meshname is None else self._index_mesh(meshname.strip(), check=True)
+                if (known['files'] != sizes) or (known['mesh'] != meshhash):
+                    known.update(files=sizes, mesh=meshhash)
+                    changed = True
+                continue
+            snaps[snap] = self._read_entry(snap, idl, sizes, check_mesh=full)
+            changed = True
+        self.index['dir_mtime'] = dir_mtime
+        if changed:
+            self.save()
+        return changed
+
+    def _idl_name(self, snap):
+        return '{}.idl'.format(self.snapname) if snap == 0 else '{}_{:03d}.idl'.format(self.snapname, snap)
+
+    def _read_entry(self, snap, idl, sizes, check_mesh=False):
+        '''returns the index entry for snap, by reading its .idl file (and mesh file, if new).'''
+        from .bifrost import read_idl_ascii
+        params = read_idl_ascii(os.path.join(self.fdir, self._idl_name(snap)))
+        meshname = params.get('meshfile', None)
+        meshhash = None if meshname is None else self._index_mesh(meshname.strip(), check=check_mesh)
+        return dict(params=params, t=params.get('t', None), idl=idl, files=sizes, mesh=meshhash)
+
+    def _index_mesh(self, meshname, check=False):
+        '''reads mesh file (if it isn't in self yet, or if check and it was modified).
+        returns its sha1 hash.
+        '''
+        from .bifrost import read_mesh_ascii
+        meshfiles = self.index['meshfiles']
+        if (meshname in meshfiles) and not check:
+            return meshfiles[meshname][2]
+        meshfile = os.path.join(self.fdir, meshname)
+        try:
+            stat = os.stat(meshfile)
+        except OSError:
+            return None   # no mesh file; BifrostData will make a uniform grid.
+        known = meshfiles.get(meshname, None)
+        if (known is not None) and (known[:2] == (stat.st_mtime_ns, stat.st_size)):
+            return known[2]
+        with open(meshfile, 'rb') as f:
+            meshhash = hashlib.sha1(f.read()).hexdigest()
+        if meshhash not in self.index['meshes']:
+            self.index['meshes'][meshhash] = read_mesh_ascii(meshfile)
+        meshfiles[meshname] = (stat.st_mtime_ns, stat.st_size, meshhash)
+        return meshhash
+
+    ## LOOKUPS ##
+    def snaps(self):
+        '''returns sorted list of the snapshots in self.fdir.'''
+        self.update()
+        return sorted(self.index['snaps'].keys())
+
+    def entry(self, snap):
+        '''returns index entry for snap (updating self if snap is unknown).
+        returns None if there is no such snapshot.
+        '''
+        entry = self.index['snaps'].get(snap, None)
+        if entry is None:
+            self.update()
+            entry = self.index['snaps'].get(snap, None)
+        return entry
+
+    def params(self, snap):
+        '''returns (a copy of) the dict of params for snap, or None if snap is not indexed (e.g. snap < 0).'''
+        if snap < 0:
+            return None
+        entry = self.entry(snap)
+        return None if entry is None else dict(entry['params'])
+
+    def time(self, snap):
+        '''returns time at snap [simulation units].'''
+        return self.entry(snap)['t']
+
+    def times(self, snaps=None):
+        '''returns dict of {snap: time [simulation units]} for snaps (None --> all snaps).'''
+        snaps = self.snaps() if snaps is None else snaps
+        return {snap: self.time(snap) for snap in snaps}
+
+    def files(self, snap):
+        '''returns dict of {filename: size in bytes} for the files of snap.'''
+        return self.entry(snap)['files']
+
+    def mesh(self, meshfile):
+        '''returns dict of mesh arrays for meshfile, or None if it is not in self.
+        The arrays are shared with self; copy them before altering them.
+        '''
+        meshname = os.path.relpath(os.path.abspath(meshfile), self.fdir)
+        known = self.index['meshfiles'].get(meshname, None)
+        if known is None:
+            if not os.path.isfile(meshfile) or meshname.startswith(os.pardir):
+                return None
+            meshhash = self._index_mesh(meshname)
+            self.save()
+        else:
+            meshhash = known[2]
+        return self.index['meshes'].get(meshhash, None)
+
+    def snap_at_time(self, t, snaps=None):
+        '''returns (snap, time at snap) for the snap closest to time t [simulation units].
+        snaps: None or list of snaps to choose from. None --> all snaps.
+        '''
+        snaps = self.snaps() if snaps is None else list(snaps)
+        times = np.array([self.time(snap) for snap in snaps])
+        i = np.argmin(np.abs(times - t))
+        return snaps[i], times[i]
+
+    def __len__(self):
+        return len(self.index['snaps'])
+
+    def __repr__(self):
+        return '<{} of {} snaps of {} at {}>'.format(
+            type(self).__name__, len(self), repr(os.path.join(self.fdir, self.snapname)), repr(self.path))
+
+
+def get_snap_index(obj):
+    '''returns obj.snap_index as a SnapIndex, or None if obj doesn't use a snapshot index.
+    Also converts obj.snap_index to a SnapIndex if it is True (--> default path) or a string (--> path).
+    '''
+    snap_index = getattr(obj, 'snap_index', None)
+    if (snap_index is None) or (snap_index is False):
+        return None
+    if not isinstance(snap_index, SnapIndex):
+        path = None if (snap_index is True) else snap_index
+        snap_index = SnapIndex(obj.fdir, obj.root_name, path=path)
+        obj.snap_index = snap_index
+    return snap_index
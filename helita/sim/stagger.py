@@ -15,12 +15,29 @@ STAGGER KINDS DEFINED HERE:
                         good enough, for most uses.
                         ~20% faster than numpy and numpy_improved methods
 
+STAGGER BACKENDS (which code does the work; the results are the same for all backends):
+    numba          - the numba functions _xshift, _yshift, _zshift, _fused_shift, _deriv_sum.
+    numpy          - vectorized numpy versions of those functions (see _NUMPY_KERNELS). No numba required.
+    auto           - on first use for each array shape, dtype, and number of numba threads,
+                        time the numba and numpy backends, then use the fastest one from then on.
+                        uses numpy if numba is not installed or fails to compile.
+                        opt-in only, since the timing runs each kernel 3 times, on the full array.
+    set stagger.DEFAULT_STAGGER_BACKEND, or pass backend=... to any stagger operation, to choose.
+
 
 METHODS DEFINED HERE (which an end-user might want to access):
     do:
         perform the indicated stagger operation.
         interface for the low-level _xshift, _yshift, _zshift functions.
 
+    do_chain:
+        perform a sequence of stagger operations, in one pass if possible.
+        interface for the low-level _fused_shift function.
+
+    deriv_sum:
+        sum of derivatives (e.g. divergence, or a component of the curl), in one pass.
+        interface for the low-level _deriv_sum function.
+
     _xup, _xdn, _yup, _ydn, _zup, _zdn, _ddxup, _ddxdn, _ddyup, _ddydn, _ddzup, _ddzdn:
         peform the corresponding stagger operation on the input array.
         These behave like functions; e.g. stagger._xup(arr) does the 'xup' operation.
@@ -53,6 +70,7 @@ TODO:
 import time
 import weakref
 import warnings
+import functools
 import collections
 
 # import public external modules
@@ -61,21 +79,31 @@ import numpy as np
 # import internal modules
 from . import tools
 
-try:
-    from numba import jit, njit, prange
-except ImportError:
-    numba = prange = tools.ImportFailed('numba', "This module is required to use stagger_kind='numba'.")
-    jit = njit = tools.boring_decorator
+# numba is slow to import, so only import it when a numba function is first called. (see tools.LazyNjit)
+numba = tools.lazy_import('numba', "This module is required to use stagger backend='numba'.")
+njit = tools.lazy_njit
+prange = range   # replaced by numba.prange when the numba functions in this file are compiled.
 
 
 """ ------------------------ defaults ------------------------ """
 
 PAD_PERIODIC = 'wrap'     # how to pad periodic dimensions, by default
 PAD_NONPERIODIC = 'reflect'  # how to pad nonperiodic dimensions, by default
+AXES = ('x', 'y', 'z')
 PAD_DEFAULTS = {'x': PAD_PERIODIC, 'y': PAD_PERIODIC, 'z': PAD_NONPERIODIC}   # default padding for each dimension.
 DEFAULT_STAGGER_KIND = 'fifth'  # which stagger kind to use by default.
 VALID_STAGGER_KINDS = tuple(('fifth', 'fifth_improved', 'first'))  # list of valid stagger kinds.
+DEFAULT_STAGGER_BACKEND = 'numba'   # which backend does the stagger operations, by default.
+VALID_STAGGER_BACKENDS = ('numba', 'numpy', 'auto')   # list of valid stagger backends.
+NUMPY_SLAB_SIZE = 2**18   # number of points per slab, for the numpy backend. (limits temporary array sizes)
+# max cells reached by one operation, per stagger kind.
+STENCIL_REACH = {'fifth': 3, 'fifth_improved': 3, 'first': 1}
 DEFAULT_MESH_LOCATION_TRACKING = False   # whether mesh location tracking should be enabled, by default.
+# whether numba saves compiled functions to disk, for later python sessions. (cache=True in njit)
+NUMBA_CACHE = True
+WARMUP_DTYPES = ('float32', 'float64')  # default dtypes for warmup()
+WARMUP_LAYOUTS = ('F', 'A')   # default memory layouts for warmup()
+AUTO_BACKENDS_MAX = 128   # max number of choices remembered by backend='auto'. (oldest are forgotten first)
 
 
 def STAGGER_KIND_PROPERTY(internal_name='_stagger_kind', default=DEFAULT_STAGGER_KIND):
@@ -147,7 +175,8 @@ del c, b, a
 """ ------------------------ 'do' - stagger interface ------------------------ """
 
 
-def do(var, operation='xup', diff=None, pad_mode=None, stagger_kind=DEFAULT_STAGGER_KIND):
+def do(var, operation='xup', diff=None, pad_mode=None, stagger_kind=DEFAULT_STAGGER_KIND, out=None,
+       backend=None):
     """
     Do a stagger operation on `var` by doing a 6th order polynomial interpolation of
     the variable from cell centres to cell faces (down operations), or cell faces
@@ -170,29 +199,34 @@ def do(var, operation='xup', diff=None, pad_mode=None, stagger_kind=DEFAULT_STAG
         operation must be same length as array along that direction.
         For non-derivative operations, `diff` must be None.
     pad_mode : None or str
-        Mode for padding array `var` to have enough points for a 6th order
-        polynomial interpolation. Same as supported by np.pad.
-        if None, use default: `wrap` (periodic) for x and y; `reflect` for z.
+        How to treat the boundaries of `var` along the axis of the operation.
+        Same as supported by np.pad. if None, use default: `wrap` (periodic) for x and y; `reflect` for z.
+        'wrap', 'reflect', 'symmetric', and 'edge' are handled by the numba functions directly;
+        other modes (e.g. 'constant') first pad a copy of `var` with np.pad.
     stagger_kind: 'fifth', 'fifth_improved', or 'first'
-        Mode for stagger operations.
-        fifth --> numba methods ('_xshift', '_yshift', '_zshift')
-        fifth_improved --> numba methods ('_xshift_improved', '_yshift_improved', '_zshift_improved')
-        first --> numba methods ('_xshift_o1', '_yshift_o1', '_zshift_o1')
+        Mode for stagger operations. All kinds use the methods '_xshift', '_yshift', '_zshift'.
+        fifth --> 5th order interpolation, 6th order derivatives.
+        fifth_improved --> like fifth, but with improved precision for interpolation.
+        first --> 1st order interpolation and derivatives.
+    out: None or 3D array
+        if provided, put the result in this array (which must have the same shape as var), and return it.
+        otherwise, make a new array with the same memory layout as var.
+    backend: None, 'numba', 'numpy', or 'auto'
+        which code does the work (see _call_kernel). None --> use DEFAULT_STAGGER_BACKEND.
 
     Returns
     -------
     3D array
         Array of same type and dimensions to var, after performing the
-        stagger operation.
+        stagger operation. float32 input gives float32 output (and similar for other float types).
     """
     # initial bookkeeping
     AXES = ('x', 'y', 'z')
     operation = operation_orig = operation.lower()
     # order
-    if stagger_kind == 'first':
-        order = 1
-    else:
-        order = 5
+    if stagger_kind not in VALID_STAGGER_KINDS:
+        raise ValueError(f"invalid stagger_kind: '{stagger_kind}'. Options are: {VALID_STAGGER_KINDS}")
+    order = 1 if stagger_kind == 'first' else 5
     # derivative, diff
     if operation[:2] == 'dd':  # For derivative operations
         derivative = True
@@ -208,10 +242,10 @@ def do(var, operation='xup', diff=None, pad_mode=None, stagger_kind=DEFAULT_STAG
         warnmsg = f'can only stagger 3D array but got {np.ndim(var)}D.'
         if derivative:
             warnings.warn(warnmsg + f' returning 0 for operation {operation_orig}')
-            return np.zeros_like(var)
+            return _into(out, np.zeros_like(var))
         else:
             warnings.warn(warnmsg + f' returning original array for operation {operation_orig}')
-            return var
+            return _into(out, var)
     # up/dn
     up_str = operation[-2:]  # 'up' or 'dn'
     if up_str == 'up':
@@ -227,29 +261,40 @@ def do(var, operation='xup', diff=None, pad_mode=None, stagger_kind=DEFAULT_STAG
     if pad_mode is None:
         pad_mode = PAD_DEFAULTS[x]
     dim_index = AXES.index(x)
-    # padding
-    extra_dims = (2, 3) if up else (3, 2)
-    if not derivative:
-        diff = np.ones(var.shape[dim_index], dtype=var.dtype)
-    padding = [(0, 0)] * 3
-    padding[dim_index] = extra_dims
+    n = var.shape[dim_index]
+    if (out is not None) and (np.shape(out) != np.shape(var)):
+        raise ValueError(f"out must have the same shape as var, but got {np.shape(out)} and {np.shape(var)}")
     # interpolating
-    if var.shape[dim_index] <= 5:   # don't interpolate along axis with size 5 or less...
+    if n <= 5:   # don't interpolate along axis with size 5 or less...
         if derivative:
-            result = np.zeros_like(var)   # E.g. ( dvardzup, where var has shape (Nx, Ny, 1) ) --> 0
+            # E.g. ( dvardzup, where var has shape (Nx, Ny, 1) ) --> 0
+            result = _into(out, np.zeros_like(var))
         else:
-            result = var
+            result = _into(out, var)
     else:
-        out = np.pad(var, padding, mode=pad_mode)
-        out_diff = np.pad(diff, extra_dims, mode=pad_mode)
-        if stagger_kind in ['fifth', 'first']:
-            func = {'x': _xshift, 'y': _yshift, 'z': _zshift}[x]
-            result = func(out, out_diff, up=up, order=order, derivative=derivative)
-        elif stagger_kind == 'fifth_improved':
-            func = {'x': _xshift_improved, 'y': _yshift_improved, 'z': _zshift_improved}[x]
-            result = func(out, out_diff, up=up, derivative=derivative)
+        arr = np.asarray(var)   # numba functions don't accept subclasses, e.g. ArrayOnMesh or np.memmap.
+        if derivative:
+            diff = np.ascontiguousarray(diff, dtype=np.float64)
+            if diff.shape != (n,):
+                raise ValueError(f"diff must have shape ({n},) for operation {operation_orig}, "
+                                 f"but got {diff.shape}")
         else:
-            raise ValueError(f"invalid stagger_kind: '{stagger_kind}'. Options are: {VALID_STAGGER_KINDS}")
+            diff = _ones(n)
+        if out is None:
+            out = np.empty_like(arr, dtype=_result_dtype(arr.dtype))
+        idx = _shift_indices(n, up, pad_mode)
+        if idx is None:   # pad_mode is not handled by _shift_indices; pad a copy of var instead.
+            padding = [(0, 0)] * 3
+            padding[dim_index] = (3, 3)
+            arr = np.pad(arr, padding, mode=pad_mode)
+            idx = _shift_indices(n, up, None)
+        a, b, c = (GET_CONSTANTS_DERIV if derivative else GET_CONSTANTS_SHIFT)(order)
+        pm = -1 if derivative else 1
+        improved = (stagger_kind == 'fifth_improved') and not derivative
+        func, arr_k, out_k = _shift_kernel(x, arr, np.asarray(out))
+        _call_kernel(func, arr_k, diff, idx, out_k, float(a), float(b), float(c), pm, order, improved,
+                     backend=backend)
+        result = out
     # tracking mesh location.
     meshloc = getattr(var, 'meshloc', None)
     if meshloc is not None:  # (input array had a meshloc attribute)
@@ -259,193 +304,755 @@ def do(var, operation='xup', diff=None, pad_mode=None, stagger_kind=DEFAULT_STAG
     return result
 
 
-""" ------------------------ numba stagger ------------------------ """
+def do_chain(var, operations, diffs=None, pad_modes=None, stagger_kind=DEFAULT_STAGGER_KIND, out=None,
+             backend=None):
+    """
+    Do a sequence of stagger operations on `var`, in the order they appear in `operations`.
+    do_chain(var, ['zup', 'ddxdn'], diffs=dict(x=dx)) is like do(do(var, 'zup'), 'ddxdn', diff=dx).
 
-## STAGGER_KIND = NUMBA ##
+    If each axis appears at most once in operations (e.g. ['xdn', 'yup', 'ddzdn']), and the pad_modes are
+    handled by the numba functions directly (see do), all the operations are done in one pass through var
+    (see _fused_shift), without making any intermediate 3D arrays. Otherwise, do the operations one at a time.
+    The result equals the result of doing the operations one at a time, up to rounding errors.
 
+    Parameters
+    ----------
+    var : 3D array
+        Variable to work on.
+    operations: list of str
+        the operations to do, e.g. ['xdn', 'yup', 'ddzdn']. (see do for the options.)
+    diffs: None or dict
+        {axis: 1D array} with axis 'x', 'y', or 'z'. diff for derivative operations along that axis.
+    pad_modes: None or dict
+        {axis: None or str} with axis 'x', 'y', or 'z'. pad_mode for operations along that axis.
+        None, or missing axes, --> use default (see do).
+    stagger_kind: 'fifth', 'fifth_improved', or 'first'
+        Mode for stagger operations.
+    out: None or 3D array
+        if provided, put the result in this array (which must have the same shape as var), and return it.
+    backend: None, 'numba', 'numpy', or 'auto'
+        which code does the work (see do).
 
-@njit(parallel=True)
-def _xshift(var, diff, up=True, order=5, derivative=False):
-    grdshf = 1 if up else 0
-    start = int(3. - grdshf)
-    end = - int(2. + grdshf)
-    nx, ny, nz = var.shape
-    out = np.zeros((nx, ny, nz))
-    if order == 5:
-        if derivative:
-            pm, (a, b, c) = -1, CONSTANTS_DERIV
-        else:
-            pm, (a, b, c) = 1, CONSTANTS_SHIFT
-        for k in prange(nz):
-            for j in prange(ny):
-                for i in prange(start, nx + end):
-                    out[i, j, k] = diff[i] * (a * (var[i + grdshf, j, k] + pm * var[i - 1 + grdshf, j, k]) +
-                                              b * (var[i + 1 + grdshf, j, k] + pm * var[i - 2 + grdshf, j, k]) +
-                                              c * (var[i + 2 + grdshf, j, k] + pm * var[i - 3 + grdshf, j, k]))
-    elif order == 1:
-        if derivative:
-            pm, (a, b, c) = -1, CONSTANTS_DERIV_o1
-        else:
-            pm, (a, b, c) = 1, CONSTANTS_SHIFT_o1
-        for k in prange(nz):
-            for j in prange(ny):
-                for i in prange(start, nx + end):
-                    out[i, j, k] = diff[i] * (a * (var[i + grdshf, j, k] + pm * var[i - 1 + grdshf, j, k]))
-    return out[start:end, :, :]
-
-
-@njit(parallel=True)
-def _yshift(var, diff, up=True, order=5, derivative=False):
-    grdshf = 1 if up else 0
-    start = int(3. - grdshf)
-    end = - int(2. + grdshf)
-    nx, ny, nz = var.shape
-    out = np.zeros((nx, ny, nz))
-    if order == 5:
-        if derivative:
-            pm, (a, b, c) = -1, CONSTANTS_DERIV
-        else:
-            pm, (a, b, c) = 1, CONSTANTS_SHIFT
-        for k in prange(nz):
-            for j in prange(start, ny + end):
-                for i in prange(nx):
-                    out[i, j, k] = diff[j] * (a * (var[i, j + grdshf, k] + pm * var[i, j - 1 + grdshf, k]) +
-                                              b * (var[i, j + 1 + grdshf, k] + pm * var[i, j - 2 + grdshf, k]) +
-                                              c * (var[i, j + 2 + grdshf, k] + pm * var[i, j - 3 + grdshf, k]))
-    elif order == 1:
-        if derivative:
-            pm, (a, b, c) = -1, CONSTANTS_DERIV_o1
-        else:
-            pm, (a, b, c) = 1, CONSTANTS_SHIFT_o1
-        for k in prange(nz):
-            for j in prange(start, ny + end):
-                for i in prange(nx):
-                    out[i, j, k] = diff[j] * (a * (var[i, j + grdshf, k] + pm * var[i, j - 1 + grdshf, k]))
-    return out[:, start:end, :]
-
-
-@njit(parallel=True)
-def _zshift(var, diff, up=True, order=5, derivative=False):
-    grdshf = 1 if up else 0
-    start = int(3. - grdshf)
-    end = - int(2. + grdshf)
-    nx, ny, nz = var.shape
-    out = np.zeros((nx, ny, nz))
-    if order == 5:
-        if derivative:
-            pm, (a, b, c) = -1, CONSTANTS_DERIV
-        else:
-            pm, (a, b, c) = 1, CONSTANTS_SHIFT
-        for k in prange(start, nz + end):
-            for j in prange(ny):
-                for i in prange(nx):
-                    out[i, j, k] = diff[k] * (a * (var[i, j, k + grdshf] + pm * var[i, j, k - 1 + grdshf]) +
-                                              b * (var[i, j, k + 1 + grdshf] + pm * var[i, j, k - 2 + grdshf]) +
-                                              c * (var[i, j, k + 2 + grdshf] + pm * var[i, j, k - 3 + grdshf]))
-    elif order == 1:
-        if derivative:
-            pm, (a, b, c) = -1, CONSTANTS_DERIV_o1
+    Returns
+    -------
+    3D array, the result of all the operations. (see do for details.)
+    """
+    pad_modes = _pad_modes_dict(pad_modes)
+    diffs = dict() if diffs is None else diffs
+    operations = [operation.lower() for operation in operations]
+    axes = [_parse_operation(operation)[1] for operation in operations]
+    fusable = (len(operations) > 1) and (np.ndim(var) == 3) and (len(set(axes)) == len(axes)) and \
+        all(pad_modes[x] in _INDEXED_PAD_MODES for x in axes)
+    if not fusable:   # do the operations one at a time.
+        buffers = _ChainBuffers()
+        for i, (operation, x) in enumerate(zip(operations, axes)):
+            out_i = buffers.get(i, var, last=(i == len(operations) - 1), out=out)
+            diff = diffs.get(x, None) if operation.startswith('dd') else None
+            var = do(var, operation, diff=diff, pad_mode=pad_modes[x], stagger_kind=stagger_kind, out=out_i,
+                     backend=backend)
+        return var
+    _check_out(out, var)
+    arr = np.asarray(var)   # numba functions don't accept subclasses, e.g. ArrayOnMesh or np.memmap.
+    # parameters for each axis: (idx, diff, coef); see _fused_shift.
+    # default is "no operation along this axis".
+    params = dict(x=_NO_OPERATION, y=_NO_OPERATION, z=_NO_OPERATION)
+    zero = False   # whether the result is 0 (derivative along an axis with size 5 or less)
+    for operation, x in zip(operations, axes):
+        n = arr.shape[AXES.index(x)]
+        if n <= 5:   # don't interpolate along axis with size 5 or less. (see do)
+            zero = zero or operation.startswith('dd')
         else:
-            pm, (a, b, c) = 1, CONSTANTS_SHIFT_o1
-        for k in prange(start, nz + end):
-            for j in prange(ny):
-                for i in prange(nx):
-                    out[i, j, k] = diff[k] * (a * (var[i, j, k + grdshf] + pm * var[i, j, k - 1 + grdshf]))
-    return out[:, :, start:end]
-
-
-@njit(parallel=True)
-def _xshift_improved(var, diff, up=True, derivative=False):
-    grdshf = 1 if up else 0
-    start = int(3. - grdshf)
-    end = - int(2. + grdshf)
-    if derivative:
-        pm, (a, b, c) = -1, CONSTANTS_DERIV
+            params[x] = _operation_params(operation, n, diffs, pad_modes[x], stagger_kind)
+    # staggering
+    if zero:
+        result = _into(out, np.zeros_like(var))
+    elif all(params[x] is _NO_OPERATION for x in AXES):
+        result = _into(out, var)
     else:
-        pm, (a, b, c) = 1, CONSTANTS_SHIFT
-    nx, ny, nz = var.shape
-    out = np.zeros((nx, ny, nz))
-    if derivative:
-        for k in prange(nz):
-            for j in prange(ny):
-                for i in prange(start, nx + end):
-                    out[i, j, k] = diff[i] * (a * (var[i + grdshf, j, k] + pm * var[i - 1 + grdshf, j, k]) +
-                                              b * (var[i + 1 + grdshf, j, k] + pm * var[i - 2 + grdshf, j, k]) +
-                                              c * (var[i + 2 + grdshf, j, k] + pm * var[i - 3 + grdshf, j, k]))
+        if out is None:
+            out = np.empty_like(arr, dtype=_result_dtype(arr.dtype))
+        out_k = np.asarray(out)
+        if arr.flags.c_contiguous and not arr.flags.f_contiguous:   # (see _shift_kernel)
+            arr, out_k, params = arr.T, out_k.T, dict(x=params['z'], y=params['y'], z=params['x'])
+        _call_kernel(_fused_shift, arr, out_k, *params['x'], *params['y'], *params['z'], backend=backend)
+        result = out
+    # tracking mesh location.
+    meshloc = getattr(var, 'meshloc', None)
+    if meshloc is not None:  # (input array had a meshloc attribute)
+        result = ArrayOnMesh(result, meshloc=meshloc)
+        for operation in operations:
+            result._shift_location(operation[-3:])
+    # output.
+    return result
+
+
+def deriv_sum(terms, diffs=None, pad_modes=None, stagger_kind=DEFAULT_STAGGER_KIND, out=None, backend=None):
+    """
+    Sum of derivatives of 3D arrays along different axes, in one pass through the arrays (see _deriv_sum).
+    E.g. the x component of the curl of v is:
+        deriv_sum([(vz, 'ddyup', 1), (vy, 'ddzup', -1)], diffs=dict(y=dy, z=dz)),
+    which equals do(vz, 'ddyup', diff=dy) - do(vy, 'ddzup', diff=dz), up to rounding errors,
+    but without making the derivatives as separate 3D arrays.
+
+    Parameters
+    ----------
+    terms: list of (var, operation, sign) tuples
+        var: 3D array. All vars must have the same shape.
+        operation: str. a derivative operation, e.g. 'ddxup'. Each axis can only appear once.
+        sign: number. multiply the derivative by this number, before adding it to the result.
+    diffs: None or dict
+        {axis: 1D array} with axis 'x', 'y', or 'z'. diff for the derivative along that axis.
+    pad_modes: None or dict
+        {axis: None or str} with axis 'x', 'y', or 'z'. pad_mode for the derivative along that axis.
+        None, or missing axes, --> use default (see do).
+        if any pad_mode is not handled by the numba functions directly, use do for each term instead.
+    stagger_kind: 'fifth', 'fifth_improved', or 'first'
+        Mode for stagger operations.
+    out: None or 3D array
+        if provided, put the result in this array (which must have the same shape as the vars), and return it.
+    backend: None, 'numba', 'numpy', or 'auto'
+        which code does the work (see do).
+
+    Returns
+    -------
+    3D array, the sum of the derivatives. dtype is the result_type of the vars (and float32).
+    """
+    pad_modes = _pad_modes_dict(pad_modes)
+    diffs = dict() if diffs is None else diffs
+    terms = [(var, operation.lower(), sign) for var, operation, sign in terms]
+    if len(terms) == 0:
+        raise ValueError('deriv_sum requires at least one term.')
+    axes = []
+    for var, operation, sign in terms:
+        derivative, x, up = _parse_operation(operation)
+        if not derivative:
+            raise ValueError(f"deriv_sum only handles derivative operations, but got: {operation}")
+        axes.append(x)
+    if len(set(axes)) < len(axes):
+        raise ValueError("each axis can only appear once in deriv_sum, "
+                         f"but got operations: {[t[1] for t in terms]}")
+    shape = np.shape(terms[0][0])
+    if any(np.shape(var) != shape for var, _, _ in terms):
+        raise ValueError(f"all vars must have the same shape, but got {[np.shape(t[0]) for t in terms]}")
+    # tracking mesh location.
+    meshlocs = [getattr(var, 'meshloc', None) for var, _, _ in terms]
+    meshloc = None
+    if any(loc is not None for loc in meshlocs):
+        shifted = [MeshLocation(loc).shifted(operation[-3:])
+                   for loc, (_, operation, _) in zip(meshlocs, terms) if loc is not None]
+        assert all(loc == shifted[0] for loc in shifted), f"Derivatives' mesh locations differ: {shifted}"
+        meshloc = shifted[0]
+    # summing
+    if len(shape) != 3 or not all(pad_modes[x] in _INDEXED_PAD_MODES for x in axes):
+        result = sum(sign * do(var, operation, diff=diffs.get(x, None), pad_mode=pad_modes[x],
+                               stagger_kind=stagger_kind, backend=backend)
+                     for (var, operation, sign), x in zip(terms, axes))
+        result = _into(out, np.asarray(result))
     else:
-        for k in prange(nz):
-            for j in prange(ny):
-                for i in prange(start, nx + end):
-                    out[i, j, k] = diff[i] * (a * (var[i + grdshf, j, k] - var[i - 1 + grdshf, j, k]) +
-                                              b * (var[i + 1 + grdshf, j, k] - var[i - 1 + grdshf, j, k] +
-                                                   var[i - 2 + grdshf, j, k] - var[i - 1 + grdshf, j, k]) +
-                                              c * (var[i + 2 + grdshf, j, k] - var[i - 1 + grdshf, j, k] +
-                                                   var[i - 3 + grdshf, j, k] - var[i - 1 + grdshf, j, k]) +
-                                              var[i - 1 + grdshf, j, k])
-
-    return out[start:end, :, :]
-
-
-@njit(parallel=True)
-def _yshift_improved(var, diff, up=True, derivative=False):
-    grdshf = 1 if up else 0
-    start = int(3. - grdshf)
-    end = - int(2. + grdshf)
+        _check_out(out, terms[0][0])
+        # parameters for each axis: (var, idx, diff, coef); see _deriv_sum. coef[0] is the sign.
+        arrs = {x: np.asarray(var) for (var, _, _), x in zip(terms, axes)}
+        params = dict(x=_NO_OPERATION, y=_NO_OPERATION, z=_NO_OPERATION)
+        for (var, operation, sign), x in zip(terms, axes):
+            n = shape[AXES.index(x)]
+            if n > 5:   # (derivative along axis with size 5 or less is 0. see do)
+                idx, diff, coef = _operation_params(operation, n, diffs, pad_modes[x], stagger_kind)
+                params[x] = (idx, diff, np.concatenate([[sign], coef[1:]]))
+        if out is None:
+            dtype = _result_dtype(np.result_type(*arrs.values()))
+            out = np.empty_like(arrs[axes[0]], dtype=dtype)
+        out_k = np.asarray(out)
+        filler = arrs[axes[0]]   # (input for axes without a term. Never read; it just needs to be an array.)
+        arrs = {x: arrs.get(x, filler) for x in AXES}
+        # (see _shift_kernel)
+        if all(arr.flags.c_contiguous and not arr.flags.f_contiguous for arr in arrs.values()):
+            arrs = dict(x=arrs['z'].T, y=arrs['y'].T, z=arrs['x'].T)
+            params = dict(x=params['z'], y=params['y'], z=params['x'])
+            out_k = out_k.T
+        _call_kernel(_deriv_sum, out_k, *[item for x in AXES for item in (arrs[x], *params[x])],
+                     backend=backend)
+        result = out
+    if meshloc is not None:
+        result = ArrayOnMesh(result, meshloc=meshloc)
+    return result
+
+
+def _parse_operation(operation):
+    '''returns (derivative, axis, up) for operation. E.g. 'ddxup' --> (True, 'x', True).'''
+    derivative = operation[:2] == 'dd'
+    x, up_str = (operation[2:] if derivative else operation)[:-2], operation[-2:]
+    if up_str not in ('up', 'dn'):
+        raise ValueError(f"Invalid operation; must end in 'up' or 'dn': {operation}")
+    if x not in AXES:
+        raise ValueError(f"Invalid operation; axis must be 'x', 'y', or 'z': {operation}")
+    return derivative, x, up_str == 'up'
+
+
+def _pad_modes_dict(pad_modes=None):
+    '''returns dict of pad_mode for each axis.
+    uses PAD_DEFAULTS for axes where pad_modes is None or missing.
+    '''
+    pad_modes = dict() if pad_modes is None else pad_modes
+    return {x: PAD_DEFAULTS[x] if pad_modes.get(x, None) is None else pad_modes[x] for x in AXES}
+
+
+def _check_out(out, var):
+    '''raise ValueError if out is not None and has a different shape than var.'''
+    if (out is not None) and (np.shape(out) != np.shape(var)):
+        raise ValueError(f"out must have the same shape as var, but got {np.shape(out)} and {np.shape(var)}")
+
+
+def _operation_params(operation, n, diffs, pad_mode, stagger_kind):
+    '''returns (idx, diff, coef) for operation along an axis with length n. (see _fused_shift)
+    diffs: dict of {axis: diff}. must contain the axis of operation if operation is a derivative.
+    '''
+    if stagger_kind not in VALID_STAGGER_KINDS:
+        raise ValueError(f"invalid stagger_kind: '{stagger_kind}'. Options are: {VALID_STAGGER_KINDS}")
+    order = 1 if stagger_kind == 'first' else 5
+    derivative, x, up = _parse_operation(operation)
     if derivative:
-        pm, (a, b, c) = -1, CONSTANTS_DERIV
+        if diffs.get(x, None) is None:
+            raise ValueError(f"diff not provided for derivative operation: {operation}")
+        diff = np.ascontiguousarray(diffs[x], dtype=np.float64)
+        if diff.shape != (n,):
+            raise ValueError(f"diff must have shape ({n},) for operation {operation}, but got {diff.shape}")
     else:
-        pm, (a, b, c) = 1, CONSTANTS_SHIFT
-    nx, ny, nz = var.shape
-    out = np.zeros((nx, ny, nz))
-    if derivative:
-        for k in prange(nz):
-            for j in prange(start, ny + end):
-                for i in prange(nx):
-                    out[i, j, k] = diff[j] * (a * (var[i, j + grdshf, k] + pm * var[i, j - 1 + grdshf, k]) +
-                                              b * (var[i, j + 1 + grdshf, k] + pm * var[i, j - 2 + grdshf, k]) +
-                                              c * (var[i, j + 2 + grdshf, k] + pm * var[i, j - 3 + grdshf, k]))
+        diff = _ones(n)
+    a, b, c = (GET_CONSTANTS_DERIV if derivative else GET_CONSTANTS_SHIFT)(order)
+    improved = (stagger_kind == 'fifth_improved') and not derivative
+    coef = np.array([1, a, b, c, -1 if derivative else 1, order, improved], dtype=np.float64)
+    return (_shift_indices(n, up, pad_mode), diff, coef)
+
+
+def _into(out, result):
+    '''returns result if out is None, else copies result into out then returns out.'''
+    if out is None:
+        return result
+    out[...] = result
+    return out
+
+
+def _result_dtype(dtype):
+    '''returns dtype of the result of staggering an array of this dtype.
+    (float32 --> float32; int --> float64)
+    '''
+    return np.result_type(dtype, np.float32)
+
+
+def _shift_kernel(x, arr, out):
+    '''returns (numba function for the operation along axis x, arr, out) to use for arr and out.
+    The numba functions are fastest for Fortran-ordered arrays (e.g. arrays read from Bifrost snapshots).
+    For C-ordered arrays, use the transposes instead (e.g. the x operation is done by _zshift on arr.T).
+    '''
+    if arr.flags.c_contiguous and not arr.flags.f_contiguous:
+        x = {'x': 'z', 'y': 'y', 'z': 'x'}[x]
+        arr, out = arr.T, out.T
+    return {'x': _xshift, 'y': _yshift, 'z': _zshift}[x], arr, out
+
+
+@functools.lru_cache(maxsize=None)
+def _ones(n):
+    '''returns (read-only) array of n ones. Used as diff for non-derivative operations.'''
+    result = np.ones(n, dtype=np.float64)
+    result.flags.writeable = False
+    return result
+
+
+_INDEXED_PAD_MODES = ('wrap', 'reflect', 'symmetric', 'edge')   # pad_modes handled by _shift_indices.
+
+
+@functools.lru_cache(maxsize=None)
+def _shift_indices(n, up, pad_mode):
+    '''returns (read-only) array of the indices read by a stagger operation along an axis of length n.
+    result[m, i] is the index of the point at offset (m - 3) from point i (if up, from point i + 1),
+    with indices beyond the boundaries mapped to indices inside the array like np.pad(..., mode=pad_mode).
+    Thus the result of the operation at point i depends on the points result[:, i].
+
+    pad_mode None --> indices into an array which was padded by 3 points at each end (no boundary handling).
+    returns None if pad_mode is not one of 'wrap', 'reflect', 'symmetric', 'edge', or None.
+    '''
+    idx = np.arange(n)[np.newaxis, :] + np.arange(-3, 3)[:, np.newaxis] + (1 if up else 0)
+    if pad_mode is None:
+        idx = idx + 3
+    elif pad_mode == 'wrap':
+        idx = idx % n
+    elif pad_mode == 'reflect':
+        idx = np.abs(idx)
+        idx = np.where(idx > n - 1, 2 * (n - 1) - idx, idx)
+    elif pad_mode == 'symmetric':
+        idx = np.where(idx < 0, -1 - idx, idx)
+        idx = np.where(idx > n - 1, 2 * n - 1 - idx, idx)
+    elif pad_mode == 'edge':
+        idx = np.clip(idx, 0, n - 1)
     else:
-        for k in prange(nz):
-            for j in prange(start, ny + end):
-                for i in prange(nx):
-                    out[i, j, k] = diff[j] * (a * (var[i, j + grdshf, k] - var[i, j - 1 + grdshf, k]) +
-                                              b * (var[i, j + 1 + grdshf, k] - var[i, j - 1 + grdshf, k] +
-                                                   var[i, j - 2 + grdshf, k] - var[i, j - 1 + grdshf, k]) +
-                                              c * (var[i, j + 2 + grdshf, k] - var[i, j - 1 + grdshf, k] +
-                                                   var[i, j - 3 + grdshf, k] - var[i, j - 1 + grdshf, k]) +
-                                              var[i, j - 1 + grdshf, k])
-    return out[:, start:end, :]
-
-
-@njit(parallel=True)
-def _zshift_improved(var, diff, up=True, derivative=False):
-    grdshf = 1 if up else 0
-    start = int(3. - grdshf)
-    end = - int(2. + grdshf)
-    if derivative:
-        pm, (a, b, c) = -1, CONSTANTS_DERIV
+        return None
+    idx = np.ascontiguousarray(idx, dtype=np.int64)
+    idx.flags.writeable = False
+    return idx
+
+
+# parameters (idx, diff, coef) for "no operation along this axis". (see _operation_params, _fused_shift)
+_NO_OPERATION = (_shift_indices(1, True, 'wrap'), _ones(1), np.zeros(7))
+
+
+""" ------------------------ numba stagger ------------------------ """
+# The functions here put the result of the stagger operation along one axis into out, and return out.
+# They don't pad var; instead, idx tells which indices of var to use at each point (see _shift_indices).
+# Arithmetic is done in float64; the result is converted to the dtype of out only when it is stored.
+#   var: 3D array. input (same shape as out, except if padded along the axis of the operation).
+#   diff: 1D float64 array. distances between cells along the axis (all ones for non-derivatives).
+#   idx: 2D int64 array with shape (6, length of axis). see _shift_indices.
+#   out: 3D array. output.
+#   a, b, c: float. constants of the stagger scheme, e.g. CONSTANTS_SHIFT.
+#   pm: +1 for interpolation; -1 for derivatives.
+#   order: 5 or 1. order of the scheme. For order 1, b and c are ignored.
+#   improved: bool. whether to use the scheme with improved precision for interpolation.
+#       (for 'fifth_improved')
+# The work is done one line (along the first axis, which is contiguous for Fortran-ordered arrays) at a time,
+#   by _combine_lines (for operations across lines) or _shift_line (for operations along a line).
+
+## STAGGER_KIND = NUMBA ##
+
+
+@njit(cache=NUMBA_CACHE)
+def _combine_lines(dst, vm3, vm2, vm1, vp0, vp1, vp2, d, a, b, c, pm, order, improved):
+    '''dst = result of stagger operation across 1D lines,
+    where vm3, ..., vp2 are the lines at offsets -3, ..., 2. (the lines at idx[0, i], ..., idx[5, i]
+    for the point i along the axis of the operation, with d = diff[i].)
+    '''
+    if order == 1:
+        for i in range(dst.shape[0]):
+            dst[i] = d * (a * (vp0[i] + pm * vm1[i]))
+    elif improved:
+        for i in range(dst.shape[0]):
+            v = vm1[i]
+            dst[i] = d * (a * (vp0[i] - v) + b * (vp1[i] - v + vm2[i] - v) +
+                          c * (vp2[i] - v + vm3[i] - v) + v)
     else:
-        pm, (a, b, c) = 1, CONSTANTS_SHIFT
-    nx, ny, nz = var.shape
-    out = np.zeros((nx, ny, nz))
-    if derivative:
-        for k in prange(start, nz + end):
-            for j in prange(ny):
-                for i in prange(nx):
-                    out[i, j, k] = diff[k] * (a * (var[i, j, k + grdshf] + pm * var[i, j, k - 1 + grdshf]) +
-                                              b * (var[i, j, k + 1 + grdshf] + pm * var[i, j, k - 2 + grdshf]) +
-                                              c * (var[i, j, k + 2 + grdshf] + pm * var[i, j, k - 3 + grdshf]))
+        for i in range(dst.shape[0]):
+            dst[i] = d * (a * (vp0[i] + pm * vm1[i]) + b * (vp1[i] + pm * vm2[i]) +
+                          c * (vp2[i] + pm * vm3[i]))
+    return dst
+
+
+@njit(cache=NUMBA_CACHE)
+def _shift_point(src, idx, i, a, b, c, pm, order, improved):
+    '''returns result of stagger operation along the 1D line src, at point i (before multiplying by diff).'''
+    vm1, vp0 = src[idx[2, i]], src[idx[3, i]]
+    if order == 1:
+        return a * (vp0 + pm * vm1)
+    vm3, vm2, vp1, vp2 = src[idx[0, i]], src[idx[1, i]], src[idx[4, i]], src[idx[5, i]]
+    if improved:
+        return a * (vp0 - vm1) + b * (vp1 - vm1 + vm2 - vm1) + c * (vp2 - vm1 + vm3 - vm1) + vm1
+    return a * (vp0 + pm * vm1) + b * (vp1 + pm * vm2) + c * (vp2 + pm * vm3)
+
+
+@njit(cache=NUMBA_CACHE)
+def _shift_line(dst, src, idx, diff, a, b, c, pm, order, improved):
+    '''dst = result of stagger operation along the 1D line src.
+    Uses idx only near the boundaries; in the interior, point i reads src[i + g - 3], ..., src[i + g + 2].
+    '''
+    n = dst.shape[0]
+    g = idx[3, 0]   # idx[3, i] == i + g in the interior. (g is 1 if up else 0, +3 if src was padded.)
+    lo = max(0, 3 - g)
+    hi = max(lo, min(n, src.shape[0] - 2 - g))
+    for i in range(lo):
+        dst[i] = diff[i] * _shift_point(src, idx, i, a, b, c, pm, order, improved)
+    # interior: the neighbors of the points in dst[lo:hi] are in slices of src.
+    _combine_lines(dst[lo:hi],
+                   src[lo + g - 3: hi + g - 3], src[lo + g - 2: hi + g - 2], src[lo + g - 1: hi + g - 1],
+                   src[lo + g: hi + g], src[lo + g + 1: hi + g + 1], src[lo + g + 2: hi + g + 2],
+                   1.0, a, b, c, pm, order, improved)
+    for i in range(lo, hi):
+        dst[i] *= diff[i]
+    for i in range(hi, n):
+        dst[i] = diff[i] * _shift_point(src, idx, i, a, b, c, pm, order, improved)
+    return dst
+
+
+@njit(parallel=True, cache=NUMBA_CACHE)
+def _xshift(var, diff, idx, out, a, b, c, pm, order, improved):
+    nx, ny, nz = out.shape
+    for k in prange(nz):
+        for j in range(ny):
+            _shift_line(out[:, j, k], var[:, j, k], idx, diff, a, b, c, pm, order, improved)
+    return out
+
+
+@njit(parallel=True, cache=NUMBA_CACHE)
+def _yshift(var, diff, idx, out, a, b, c, pm, order, improved):
+    nx, ny, nz = out.shape
+    for k in prange(nz):
+        for j in range(ny):
+            _combine_lines(out[:, j, k], var[:, idx[0, j], k], var[:, idx[1, j], k], var[:, idx[2, j], k],
+                           var[:, idx[3, j], k], var[:, idx[4, j], k], var[:, idx[5, j], k],
+                           diff[j], a, b, c, pm, order, improved)
+    return out
+
+
+@njit(parallel=True, cache=NUMBA_CACHE)
+def _zshift(var, diff, idx, out, a, b, c, pm, order, improved):
+    nx, ny, nz = out.shape
+    for k in prange(nz):
+        for j in range(ny):
+            _combine_lines(out[:, j, k], var[:, j, idx[0, k]], var[:, j, idx[1, k]], var[:, j, idx[2, k]],
+                           var[:, j, idx[3, k]], var[:, j, idx[4, k]], var[:, j, idx[5, k]],
+                           diff[k], a, b, c, pm, order, improved)
+    return out
+
+
+@njit(parallel=True, cache=NUMBA_CACHE)
+def _fused_shift(var, out, idx_x, diff_x, coef_x, idx_y, diff_y, coef_y, idx_z, diff_z, coef_z):
+    '''does (up to) one stagger operation along each axis, in one pass through var. (see do_chain)
+    idx_x, diff_x: like idx and diff for _xshift. Similar for y, z.
+    coef_x: array of (active, a, b, c, pm, order, improved) for the operation along x.
+        active == 0 --> no operation along x. Otherwise, the other values are like the args of _xshift.
+    The z operation is done first, then y, then x; intermediate results are kept in (nx, ny) planes,
+    stored as plane[j, i] so that lines along x are contiguous.
+    '''
+    nx, ny, nz = out.shape
+    zactive, za, zb, zc, zpm, zorder, zimproved = coef_z[0], coef_z[1], coef_z[2], coef_z[3], \
+        coef_z[4], int(coef_z[5]), coef_z[6] != 0
+    yactive, ya, yb, yc, ypm, yorder, yimproved = coef_y[0], coef_y[1], coef_y[2], coef_y[3], \
+        coef_y[4], int(coef_y[5]), coef_y[6] != 0
+    xactive, xa, xb, xc, xpm, xorder, ximproved = coef_x[0], coef_x[1], coef_x[2], coef_x[3], \
+        coef_x[4], int(coef_x[5]), coef_x[6] != 0
+    for k in prange(nz):
+        # z: var --> plane
+        plane = np.empty((ny, nx))
+        for j in range(ny):
+            if zactive:
+                _combine_lines(plane[j],
+                               var[:, j, idx_z[0, k]], var[:, j, idx_z[1, k]], var[:, j, idx_z[2, k]],
+                               var[:, j, idx_z[3, k]], var[:, j, idx_z[4, k]], var[:, j, idx_z[5, k]],
+                               diff_z[k], za, zb, zc, zpm, zorder, zimproved)
+            else:
+                plane[j] = var[:, j, k]
+        # y: plane --> plane
+        if yactive:
+            yplane = np.empty((ny, nx))
+            for j in range(ny):
+                _combine_lines(yplane[j], plane[idx_y[0, j]], plane[idx_y[1, j]], plane[idx_y[2, j]],
+                               plane[idx_y[3, j]], plane[idx_y[4, j]], plane[idx_y[5, j]],
+                               diff_y[j], ya, yb, yc, ypm, yorder, yimproved)
+            plane = yplane
+        # x: plane --> out
+        for j in range(ny):
+            if xactive:
+                _shift_line(out[:, j, k], plane[j], idx_x, diff_x, xa, xb, xc, xpm, xorder, ximproved)
+            else:
+                out[:, j, k] = plane[j]
+    return out
+
+
+@njit(parallel=True, cache=NUMBA_CACHE)
+def _deriv_sum(out, var_x, idx_x, diff_x, coef_x, var_y, idx_y, diff_y, coef_y, var_z, idx_z, diff_z, coef_z):
+    '''puts sum of (up to) one derivative along each axis into out, in one pass. (see deriv_sum)
+    var_x: 3D array to take the derivative along x of. idx_x, diff_x: like idx and diff for _xshift.
+    coef_x: like for _fused_shift, except coef_x[0] is the sign (0 --> no derivative along x).
+    Similar for y, z.
+    '''
+    nx, ny, nz = out.shape
+    xsign, xa, xb, xc, xpm, xorder = coef_x[0], coef_x[1], coef_x[2], coef_x[3], coef_x[4], int(coef_x[5])
+    ysign, ya, yb, yc, ypm, yorder = coef_y[0], coef_y[1], coef_y[2], coef_y[3], coef_y[4], int(coef_y[5])
+    zsign, za, zb, zc, zpm, zorder = coef_z[0], coef_z[1], coef_z[2], coef_z[3], coef_z[4], int(coef_z[5])
+    for k in prange(nz):
+        acc = np.empty(nx)
+        tmp = np.empty(nx)
+        for j in range(ny):
+            acc[:] = 0
+            if xsign != 0:
+                _shift_line(tmp, var_x[:, j, k], idx_x, diff_x, xa, xb, xc, xpm, xorder, False)
+                acc += xsign * tmp
+            if ysign != 0:
+                _combine_lines(tmp,
+                               var_y[:, idx_y[0, j], k], var_y[:, idx_y[1, j], k], var_y[:, idx_y[2, j], k],
+                               var_y[:, idx_y[3, j], k], var_y[:, idx_y[4, j], k], var_y[:, idx_y[5, j], k],
+                               diff_y[j], ya, yb, yc, ypm, yorder, False)
+                acc += ysign * tmp
+            if zsign != 0:
+                _combine_lines(tmp,
+                               var_z[:, j, idx_z[0, k]], var_z[:, j, idx_z[1, k]], var_z[:, j, idx_z[2, k]],
+                               var_z[:, j, idx_z[3, k]], var_z[:, j, idx_z[4, k]], var_z[:, j, idx_z[5, k]],
+                               diff_z[k], za, zb, zc, zpm, zorder, False)
+                acc += zsign * tmp
+            out[:, j, k] = acc
+    return out
+
+
+""" ------------------------ numpy stagger ------------------------ """
+# numpy versions of the numba functions above, with the same args, for when numba is unavailable (or slower).
+# They use slices of var in the interior, and idx only near the boundaries (like _shift_line),
+# and do the arithmetic in the same order and precision as the numba functions, so the results are the same.
+# Arrays are handled in slabs of about NUMPY_SLAB_SIZE points, to limit the size of temporary arrays.
+
+
+def _np_slabs(shape, axis):
+    '''yields indices which split an array with this shape into slabs of about NUMPY_SLAB_SIZE points.
+    The slabs are cut along an axis other than axis, so each slab has the full length of axis.
+    '''
+    cut = 1 if axis == 2 else 2
+    step = max(1, NUMPY_SLAB_SIZE * shape[cut] // max(1, int(np.prod(shape))))
+    for start in range(0, shape[cut], step):
+        index = [slice(None)] * 3
+        index[cut] = slice(start, start + step)
+        yield tuple(index)
+
+
+def _np_combine(vm3, vm2, vm1, vp0, vp1, vp2, a, b, c, pm, order, improved):
+    '''numpy version of _combine_lines (with d = 1), for arrays of any shape. returns float64 array.'''
+    def f64(arr): return np.asarray(arr, dtype=np.float64)
+    if order == 1:
+        return a * (f64(vp0) + pm * f64(vm1))
+    elif improved:
+        v = vm1
+        return a * f64(vp0 - v) + b * f64(vp1 - v + vm2 - v) + c * f64(vp2 - v + vm3 - v) + f64(v)
     else:
-        for k in prange(start, nz + end):
-            for j in prange(ny):
-                for i in prange(nx):
-                    out[i, j, k] = diff[k] * (a * (var[i, j, k + grdshf] - var[i, j, k - 1 + grdshf]) +
-                                              b * (var[i, j, k + 1 + grdshf] - var[i, j, k - 1 + grdshf] +
-                                                   var[i, j, k - 2 + grdshf] - var[i, j, k - 1 + grdshf]) +
-                                              c * (var[i, j, k + 2 + grdshf] - var[i, j, k - 1 + grdshf] +
-                                                   var[i, j, k - 3 + grdshf] - var[i, j, k - 1 + grdshf]) +
-                                              var[i, j, k - 1 + grdshf])
-    return out[:, :, start:end]
+        return (a * (f64(vp0) + pm * f64(vm1)) + b * (f64(vp1) + pm * f64(vm2)) +
+                c * (f64(vp2) + pm * f64(vm3)))
+
+
+def _np_shift(dst, var, diff, idx, axis, a, b, c, pm, order, improved):
+    '''numpy version of the stagger operation along axis of var (e.g. _xshift for axis 0). puts result in dst.
+    Along axis 0, the interior is stored in dst before multiplying by diff, like in _shift_line.
+    '''
+    n = idx.shape[1]
+    g = int(idx[3, 0])   # idx[3, i] == i + g in the interior. (see _shift_line)
+    lo = max(0, 3 - g)
+    hi = max(lo, min(n, var.shape[axis] - 2 - g))
+
+    def along(i):
+        '''index for i along axis.'''
+        index = [slice(None)] * 3
+        index[axis] = i
+        return tuple(index)
+    diff = diff.reshape([n if ax == axis else 1 for ax in range(3)])
+    # interior: the neighbors of the points in lo:hi are in slices of var.
+    inner = along(slice(lo, hi))
+    result = _np_combine(*[var[along(slice(lo + g + m, hi + g + m))] for m in range(-3, 3)],
+                         a, b, c, pm, order, improved)
+    if axis == 0:
+        dst[inner] = result
+        dst[inner] *= diff[inner]
+    else:
+        dst[inner] = diff[inner] * result
+    # near the boundaries: the neighbors are at the indices in idx.
+    edge = np.r_[0:lo, hi:n]
+    if len(edge) > 0:
+        result = _np_combine(*[np.take(var, idx[m, edge], axis=axis) for m in range(6)],
+                             a, b, c, pm, order, improved)
+        dst[along(edge)] = diff[along(edge)] * result
+    return dst
+
+
+def _np_xshift(var, diff, idx, out, a, b, c, pm, order, improved):
+    for index in _np_slabs(out.shape, 0):
+        _np_shift(out[index], var[index], diff, idx, 0, a, b, c, pm, order, improved)
+    return out
+
+
+def _np_yshift(var, diff, idx, out, a, b, c, pm, order, improved):
+    for index in _np_slabs(out.shape, 1):
+        _np_shift(out[index], var[index], diff, idx, 1, a, b, c, pm, order, improved)
+    return out
+
+
+def _np_zshift(var, diff, idx, out, a, b, c, pm, order, improved):
+    for index in _np_slabs(out.shape, 2):
+        _np_shift(out[index], var[index], diff, idx, 2, a, b, c, pm, order, improved)
+    return out
+
+
+def _np_coef_args(coef):
+    '''returns (a, b, c, pm, order, improved) from coef. (see _fused_shift)'''
+    return coef[1], coef[2], coef[3], coef[4], int(coef[5]), coef[6] != 0
+
+
+def _np_fused_shift(var, out, idx_x, diff_x, coef_x, idx_y, diff_y, coef_y, idx_z, diff_z, coef_z):
+    '''numpy version of _fused_shift. The z operation is done first, then y, then x.
+    Intermediate results are float64 3D arrays, instead of planes.
+    Like _fused_shift, the y and x operations read float64 values, even if the z operation is not done.
+    '''
+    for axis, idx, diff, coef in ((2, idx_z, diff_z, coef_z), (1, idx_y, diff_y, coef_y),
+                                  (0, idx_x, diff_x, coef_x)):
+        if coef[0] != 0:
+            dst = out if axis == 0 else np.empty(out.shape)
+            for index in _np_slabs(out.shape, axis):
+                src = var[index] if axis == 2 else np.asarray(var[index], dtype=np.float64)
+                _np_shift(dst[index], src, diff, idx, axis, *_np_coef_args(coef))
+            var = dst
+    if var is not out:
+        out[...] = var
+    return out
+
+
+def _np_deriv_sum(out, var_x, idx_x, diff_x, coef_x, var_y, idx_y, diff_y, coef_y,
+                  var_z, idx_z, diff_z, coef_z):
+    '''numpy version of _deriv_sum.'''
+    acc = np.zeros(out.shape)
+    terms = ((0, var_x, idx_x, diff_x, coef_x), (1, var_y, idx_y, diff_y, coef_y),
+             (2, var_z, idx_z, diff_z, coef_z))
+    for axis, var, idx, diff, coef in terms:
+        if coef[0] != 0:
+            a, b, c, pm, order, _ = _np_coef_args(coef)
+            for index in _np_slabs(out.shape, axis):
+                tmp = _np_shift(np.empty(acc[index].shape), var[index], diff, idx, axis,
+                                a, b, c, pm, order, False)
+                acc[index] += coef[0] * tmp
+    out[...] = acc
+    return out
+
+
+# {name of numba function: numpy version of that function}
+_NUMPY_KERNELS = {'_xshift': _np_xshift, '_yshift': _np_yshift, '_zshift': _np_zshift,
+                  '_fused_shift': _np_fused_shift, '_deriv_sum': _np_deriv_sum}
+
+
+""" ------------------------ backend selection ------------------------ """
+
+_AUTO_BACKENDS = dict()   # {key (see _auto_key): backend chosen by backend='auto'}
+# errors from calling numba functions with backend='auto'. if any, 'auto' always uses numpy.
+_NUMBA_ERRORS = []
+
+
+def _call_kernel(func, *args, backend=None):
+    '''calls func(*args) using the indicated backend, and returns the result.
+    func: one of the numba functions _xshift, _yshift, _zshift, _fused_shift, _deriv_sum.
+    backend: None, 'numba', 'numpy', or 'auto'.
+        None --> use DEFAULT_STAGGER_BACKEND.
+        'numpy' --> use the numpy version of func instead (see _NUMPY_KERNELS).
+        'auto' --> use the fastest backend for args like these (see _auto_key).
+            The first time, time both backends (see _time_backends), and remember which was faster.
+    '''
+    if backend is None:
+        backend = DEFAULT_STAGGER_BACKEND
+    if backend not in VALID_STAGGER_BACKENDS:
+        raise ValueError(f"invalid stagger backend: '{backend}'. Options are: {VALID_STAGGER_BACKENDS}")
+    if backend == 'auto':
+        key = _auto_key(func, args)
+        backend = _AUTO_BACKENDS.get(key, None)
+        if backend is None:
+            result, _AUTO_BACKENDS[key] = _time_backends(func, args)
+            while len(_AUTO_BACKENDS) > AUTO_BACKENDS_MAX:
+                del _AUTO_BACKENDS[next(iter(_AUTO_BACKENDS))]
+            return result
+    if backend == 'numpy':
+        return _NUMPY_KERNELS[func.__name__](*args)
+    return _numba_call(func, args)
+
+
+def _numba_call(func, args):
+    '''calls the numba function func(*args), with at most tools.get_num_threads() threads (if not None).'''
+    num_threads = tools.get_num_threads()
+    if num_threads is None:
+        return func(*args)
+    old = numba.get_num_threads()
+    numba.set_num_threads(max(1, min(num_threads, numba.config.NUMBA_NUM_THREADS)))
+    try:
+        return func(*args)
+    finally:
+        numba.set_num_threads(old)
+
+
+def _auto_key(func, args):
+    '''returns the key for _AUTO_BACKENDS:
+        (name of func, number of numba threads, info about 3D arrays in args).
+    The info is the size class (log2 of the number of elements, rounded down), dtype,
+    and memory layout of each array. (Not the exact shape, since sub-domains with halos, slabs,
+    and blocks of lazy vars give many different shapes, and the timing would be repeated for each one.)
+    '''
+    arrays = tuple((int(np.log2(max(arr.size, 1))), arr.dtype.str,
+                    arr.flags.f_contiguous, arr.flags.c_contiguous)
+                   for arr in args if np.ndim(arr) == 3)
+    return (func.__name__, _num_threads(), arrays)
+
+
+def _num_threads():
+    '''returns the number of threads numba functions would use (see _numba_call).
+    returns 1 if numba is unavailable.
+    '''
+    if len(_NUMBA_ERRORS) > 0:
+        return 1
+    try:
+        return tools.get_num_threads(numba.get_num_threads())
+    except ImportError:
+        return 1
+
+
+def _time_backends(func, args):
+    '''calls the numba and numpy versions of func(*args), and times them.
+    The first call to the numba version is not timed, since it might need to compile func.
+    if the numba version fails (e.g. numba is not installed), remember the error in _NUMBA_ERRORS,
+        and use numpy from then on. (makes a warning, unless numba is not installed.)
+
+    returns (result, fastest backend).
+    '''
+    times = dict()
+    if len(_NUMBA_ERRORS) == 0:
+        try:
+            _numba_call(func, args)
+        except Exception as err:
+            _NUMBA_ERRORS.append(err)
+            if not isinstance(err, ImportError):
+                warnings.warn(f"numba stagger functions failed ({type(err).__name__}: {err}). "
+                              "Using numpy instead.")
+        else:
+            now = time.perf_counter()
+            _numba_call(func, args)
+            times['numba'] = time.perf_counter() - now
+    now = time.perf_counter()
+    result = _NUMPY_KERNELS[func.__name__](*args)
+    times['numpy'] = time.perf_counter() - now
+    return result, min(times, key=times.get)
+
+
+def warmup(dtypes=WARMUP_DTYPES, layouts=WARMUP_LAYOUTS, verbose=True):
+    """
+    Compile the numba stagger functions for arrays with these dtypes and memory layouts, ahead of time.
+    Compiled functions are saved to disk (if NUMBA_CACHE), so later python sessions only need to load them.
+    Otherwise, each function is compiled the first time it is called (with new dtypes) in each python session.
+    The same compiled functions are used for all stagger_kinds, derivatives, and pad_modes.
+
+    dtypes: list of dtypes for the arrays which will be staggered.
+    layouts: list of memory layouts for the arrays which will be staggered.
+        'F' --> Fortran-contiguous (e.g. arrays read from Bifrost snapshots);
+        'C' --> C-contiguous (uses the same compiled functions as 'F'; see _shift_kernel);
+        'A' --> neither (e.g. slices of larger arrays).
+    verbose: whether to print a table of compile time (or time to load from cache) versus run time.
+
+    Returns list of dicts with keys 'func', 'dtype', 'layout', 'status', 'compile_time', 'run_time'.
+        (see tools.numba_warmup for details.)
+    """
+    result = []
+    shape = (8, 8, 8)   # small arrays; compiling doesn't depend on the shape.
+    idx = _shift_indices(shape[0], True, PAD_PERIODIC)
+    a, b, c = CONSTANTS_SHIFT
+    for dtype in dtypes:
+        for layout in layouts:
+            if layout == 'A':
+                var = np.ones((shape[0], shape[1], 2 * shape[2]), dtype=dtype)[:, :, ::2]
+            else:
+                var = np.ones(shape, dtype=dtype, order=layout)
+            out = np.empty_like(var, dtype=_result_dtype(var.dtype))
+            for x in ('x', 'y', 'z'):
+                func, var_k, out_k = _shift_kernel(x, var, out)
+                info = tools.numba_warmup(func, var_k, _ones(shape[0]), idx, out_k, a, b, c, 1, 5, False)
+                result.append(dict(func=func.__name__, dtype=str(np.dtype(dtype)), layout=layout, **info))
+            params = (idx, _ones(shape[0]), np.array([1, a, b, c, 1, 5, 0], dtype=np.float64))
+            info = tools.numba_warmup(_fused_shift, var_k, out_k, *params, *params, *params)
+            result.append(dict(func=_fused_shift.__name__, dtype=str(np.dtype(dtype)), layout=layout, **info))
+            var_k_params = (var_k, *params)
+            info = tools.numba_warmup(_deriv_sum, out_k, *var_k_params, *var_k_params, *var_k_params)
+            result.append(dict(func=_deriv_sum.__name__, dtype=str(np.dtype(dtype)), layout=layout, **info))
+    if verbose:
+        fmt = '{func:>12s} {dtype:>8s} {layout:>6s} {status:>9s} {compile_time:>12.3f} {run_time:>10.6f}'
+        print('{:>12s} {:>8s} {:>6s} {:>9s} {:>12s} {:>10s}'.format(
+            'func', 'dtype', 'layout', 'status', 'compile [s]', 'run [s]'))
+        for info in result:
+            if info['status'] != 'ready':
+                print(fmt.format(**info))
+        print('total compile time: {:.3f} s'.format(sum(info['compile_time'] for info in result)))
+    return result
 
 
 """ ------------------------ MeshLocation, ArrayOnMesh ------------------------ """
@@ -972,6 +1579,10 @@ class _stagger_spatial(_stagger_factory):
         pad_mode, but only applies for operation in the corresponding axis.
         (For convenience. E.g. if all pad_modes are known, can enter padx, pady, padz,
         without needing to worry about which type of operation is being performed.)
+    out: None or 3D array
+        if provided, put the result in this array, instead of making a new array.
+    backend: None, 'numba', 'numpy', or 'auto'
+        which code does the work (see stagger.do).
 
     **kw__None:
         additional kwargs are ignored.
@@ -983,9 +1594,11 @@ class _stagger_spatial(_stagger_factory):
         super().__init__(x, up, opstr_fmt='{x}{up}')
 
     def __call__(self, arr, pad_mode=None, verbose=False,
-                 padx=None, pady=None, padz=None, stagger_kind=DEFAULT_STAGGER_KIND, **kw__None):
+                 padx=None, pady=None, padz=None, stagger_kind=DEFAULT_STAGGER_KIND, out=None, backend=None,
+                 **kw__None):
         return super().__call__(arr, pad_mode=pad_mode, verbose=verbose,
-                                padx=padx, pady=pady, padz=padz, stagger_kind=stagger_kind)
+                                padx=padx, pady=pady, padz=padz, stagger_kind=stagger_kind,
+                                out=out, backend=backend)
 
 
 class _stagger_derivate(_stagger_factory):
@@ -1010,6 +1623,10 @@ class _stagger_derivate(_stagger_factory):
         diff, but only applies for operation in the corresponding axis.
         (For convenience. E.g. if all diffs are known, can enter diffx, diffy, and diffz,
         without needing to worry about which type of operation is being performed.)
+    out: None or 3D array
+        if provided, put the result in this array, instead of making a new array.
+    backend: None, 'numba', 'numpy', or 'auto'
+        which code does the work (see stagger.do).
 
     TODO: fix ugly printout during verbose==1.
     '''
@@ -1020,11 +1637,12 @@ class _stagger_derivate(_stagger_factory):
     def __call__(self, arr, diff=None, pad_mode=None, verbose=False,
                  padx=None, pady=None, padz=None,
                  diffx=None, diffy=None, diffz=None,
-                 stagger_kind=DEFAULT_STAGGER_KIND, **kw__None):
+                 stagger_kind=DEFAULT_STAGGER_KIND, out=None, backend=None, **kw__None):
         if diff is None:
             diff = {'x': diffx, 'y': diffy, 'z': diffz}[self.x]
         return super().__call__(arr, diff=diff, pad_mode=pad_mode, verbose=verbose,
-                                padx=padx, pady=pady, padz=padz, stagger_kind=stagger_kind)
+                                padx=padx, pady=pady, padz=padz, stagger_kind=stagger_kind, out=out,
+                                backend=backend)
 
 
 _STAGGER_ALIASES = {}
@@ -1069,6 +1687,10 @@ class BaseChain():  # base class. Inherit from this class before creating the ch
         to pass diff to derivatives, use kwargs diffx, diffy, diffz.
         to apply in reverse order, use kwarg reverse=True.
             default order is A.B.C(val) --> A(B(C(val))).
+        to put the result in an existing array, use kwarg out.
+            intermediate results reuse (at most) two arrays, no matter how long the chain is.
+        chains with at most one operation per axis (e.g. xdn.yup.ddzdn) are done in one pass (see do_chain),
+            unless pad_mode, diff, or verbose are provided (those apply to each operation separately).
     """
     ## ESSENTIAL BEHAVIORS ##
 
@@ -1078,11 +1700,16 @@ class BaseChain():  # base class. Inherit from this class before creating the ch
         self.__name__ = _trim_leading_underscore(f_self.__name__)
         self.__doc__ = self.__doc__.format(undetermined=self.__name__)
 
-    def __call__(self, x, reverse=False, **kw):
-        '''apply the operations. If reverse, go in reverse order.'''
+    def __call__(self, x, reverse=False, out=None, **kw):
+        '''apply the operations. If reverse, go in reverse order. if out is provided, put result there.'''
         itfuncs = self.funcs[::-1] if reverse else self.funcs
-        for func in itfuncs:
-            x = func(x, **kw)
+        flat = _FusedChain.flatten(itfuncs)
+        if _FusedChain.can_fuse(flat, kw):
+            return _FusedChain(flat)(x, out=out, **kw)
+        buffers = _ChainBuffers()
+        for i, func in enumerate(itfuncs):
+            out_i = buffers.get(i, x, last=(i == len(itfuncs) - 1), out=out)
+            x = func(x, out=out_i, **kw)
         return x
 
     ## CONVNIENT BEHAVIORS ##
@@ -1106,6 +1733,69 @@ class BaseChain():  # base class. Inherit from this class before creating the ch
         return f'{self.__class__.__name__} at <{hex(id(self))}> with operations: {funcnames}'
 
 
+class _ChainBuffers():
+    '''arrays to put the intermediate results of a chain of stagger operations into.
+    operation i writes into buffer i % 2, while reading the result of operation i - 1 (from the other buffer).
+    So, a chain of any length makes at most two new arrays. The last result is returned; it is not reused.
+    '''
+
+    def __init__(self):
+        self.buffers = [None, None]
+
+    def get(self, i, arr, last=False, out=None):
+        '''returns array to use as out for operation i with input arr,
+        or None to let the operation make a new array (e.g. when arr is a string, or not 3D).
+        if last and out is not None, return out.
+        '''
+        if last and (out is not None):
+            return out
+        if isinstance(arr, str) or (np.ndim(arr) != 3):
+            return None
+        buffer = self.buffers[i % 2]
+        if buffer is None:
+            arr = np.asarray(arr)
+            buffer = np.empty_like(arr, dtype=_result_dtype(arr.dtype))
+            self.buffers[i % 2] = buffer
+        return buffer
+
+
+class _FusedChain():
+    '''stagger operations (e.g. _xup, _ddzdn), done together by do_chain.
+    funcs are in the order they are applied.
+    Call with the same kwargs as a chain, e.g. padx, diffz, stagger_kind, out, backend.
+    '''
+
+    def __init__(self, funcs):
+        self.funcs = funcs
+        self.__name__ = '_' + '_'.join(_trim_leading_underscore(func.__name__) for func in funcs)
+
+    @staticmethod
+    def flatten(funcs):
+        '''returns list of funcs, but with chains (e.g. the links of a chain) replaced by their funcs.'''
+        result = []
+        for func in funcs:
+            result += _FusedChain.flatten(func.funcs) if isinstance(func, BaseChain) else [func]
+        return result
+
+    @staticmethod
+    def can_fuse(funcs, kw):
+        '''returns whether the chain of funcs, called with kwargs kw, can be done by _FusedChain.
+        funcs must already be flattened (see flatten).
+        '''
+        if len(funcs) < 2 or not all(isinstance(func, _stagger_factory) for func in funcs):
+            return False
+        if any(kw.get(key, None) is not None for key in ('pad_mode', 'diff')) or kw.get('verbose', False):
+            return False
+        axes = [func.x for func in funcs]
+        return len(set(axes)) == len(axes)
+
+    def __call__(self, arr, padx=None, pady=None, padz=None, diffx=None, diffy=None, diffz=None,
+                 stagger_kind=DEFAULT_STAGGER_KIND, out=None, backend=None, **kw__None):
+        return do_chain(arr, [func.opstr for func in self.funcs],
+                        diffs=dict(x=diffx, y=diffy, z=diffz), pad_modes=dict(x=padx, y=pady, z=padz),
+                        stagger_kind=stagger_kind, out=out, backend=backend)
+
+
 class ChainCreator():
     """for creating and manipulating a chain."""
 
@@ -1214,6 +1904,7 @@ class StaggerInterface():
 
     def __init__(self, obj):
         self._obj_ref = weakref.ref(obj)  # weakref to avoid circular reference.
+        self.nops = 0   # number of operations done via self so far. (tells whether a quantity uses stagger.)
         prop_func_pairs = [(_trim_leading_underscore(prop), func) for prop, func in _STAGGER_ALIASES.items()]
         self._make_bound_chain(*prop_func_pairs, name='BoundInterpolationChain')
 
@@ -1225,6 +1916,27 @@ class StaggerInterface():
         '''
         return getattr(self, opstr)(arr, *args, **kw)
 
+    def deriv_sum(self, terms, *args__get_var, out=None, **kw):
+        '''sum of derivatives, in one pass. (see stagger.deriv_sum)
+        terms: list of (var, operation, sign), e.g. [('bz', 'ddyup', 1), ('by', 'ddzup', -1)].
+            if var is a string, use self.obj(var, *args__get_var) instead.
+        pad_modes, diffs, and stagger_kind are implied by self.obj unless provided in kw.
+        (see __interpolation_call__)
+        '''
+        pads, diffs = self._pad_modes(), self._diffs()
+        kw_to_use = dict(pad_modes={x: pads[f'pad{x}'] for x in AXES},
+                         diffs={x: diffs[f'diff{x}'] for x in AXES}, **self._stagger_kind())
+        kw_to_use.update(kw)
+        values = dict()
+        for var, _, _ in terms:
+            if isinstance(var, str) and var not in values:
+                values[var] = self.obj(var, *args__get_var)
+        terms = [(values.get(var, var) if isinstance(var, str) else var, operation, sign)
+                 for var, operation, sign in terms]
+        self.nops += 1
+        with tools.parallelism(tools.obj_num_threads(self.obj)):
+            return deriv_sum(terms, out=out, **kw_to_use)
+
     def op(self, opstr):
         '''gets the operation which opstr would apply.
         For convenience. Equivalent to getattr(self, opstr).
@@ -1261,18 +1973,23 @@ class StaggerInterface():
     def _stagger_kind(self):
         return {'stagger_kind': self.obj.stagger_kind}
 
-    def __interpolation_call__(self, func, arr, *args__get_var, **kw):
+    def __interpolation_call__(self, func, arr, *args__get_var, out=None, **kw):
         '''call interpolation function func on array arr with the provided kw.
 
         use defaults implied by self (e.g. padx implied by periodic_x), for any kw not entered.
         if arr is a string, first call self(arr, *args__get_var, **kw).
+        if out is provided, put the result there.
+        numba functions use at most self.obj.numThreads threads.
+        (see tools.parallelism, tools.obj_num_threads)
         '''
         __tracebackhide__ = True
         kw_to_use = {**self._pad_modes(), **self._diffs(), **self._stagger_kind()}  # defaults based on obj.
         kw_to_use.update(kw)   # exisitng kwargs override defaults.
         if isinstance(arr, str):
             arr = self.obj(arr, *args__get_var, **kw)
-        return func(arr, **kw_to_use)
+        self.nops += 1
+        with tools.parallelism(tools.obj_num_threads(self.obj)):
+            return func(arr, out=out, **kw_to_use)
 
 
 StaggerInterface.__doc__ = StaggerInterface.__doc__.format(PAD_PERIODIC=PAD_PERIODIC, PAD_NONPERIODIC=PAD_NONPERIODIC)
@@ -1285,11 +2002,16 @@ class BoundBaseChain(BaseChain):
         self.obj = obj
         super().__init__(f_self, *funcs)
 
-    def __call__(self, x, reverse=False, **kw):
-        '''apply the operations. If reverse, go in reverse order'''
+    def __call__(self, x, reverse=False, out=None, **kw):
+        '''apply the operations. If reverse, go in reverse order. if out is provided, put result there.'''
         itfuncs = self.funcs[::-1] if reverse else self.funcs
-        for func in itfuncs:
-            x = self.obj.__interpolation_call__(func, x, **kw)
+        flat = _FusedChain.flatten(itfuncs)
+        if _FusedChain.can_fuse(flat, kw):
+            return self.obj.__interpolation_call__(_FusedChain(flat), x, out=out, **kw)
+        buffers = _ChainBuffers()
+        for i, func in enumerate(itfuncs):
+            out_i = buffers.get(i, x, last=(i == len(itfuncs) - 1), out=out)
+            x = self.obj.__interpolation_call__(func, x, out=out_i, **kw)
         return x
 
     def __repr__(self):
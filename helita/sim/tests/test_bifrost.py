@@ -0,0 +1,528 @@
+"""
+Test suite for bifrost.py
+"""
+import gc
+import os
+import json
+import weakref
+import collections
+
+import numpy as np
+import pytest
+
+from helita.sim import bifrost, disk_cache_cli, lazy_var, load_arithmetic_quantities, tools
+
+SNAPNAME = 'tst'
+SHAPE = (24, 20, 30)
+SNAPS = (1, 2, 3)
+IDL_TEMPLATE = """snapname = '{snapname}'
+meshfile = '{snapname}.mesh'
+mx = {nx}
+my = {ny}
+mz = {nz}
+mb = 5
+dx = 0.1
+dy = 0.1
+dz = 0.05
+do_mhd = 1
+aux = 'tg'
+isnap = {snap}
+t = {t}
+gamma = 1.667
+u_l = 1e8
+u_t = 1e2
+u_r = 1e-7
+u_b = 1.121e3
+u_ee = 1e12
+periodic_x = 1
+periodic_y = 1
+periodic_z = 0
+"""
+
+
+def write_fake_run(fdir, snaps=SNAPS, shape=SHAPE):
+    """Write a small, smooth Bifrost run (snap + aux files) to fdir."""
+    nx, ny, nz = shape
+    x = np.linspace(0, 2 * np.pi, nx, endpoint=False)[:, None, None]
+    y = np.linspace(0, 2 * np.pi, ny, endpoint=False)[None, :, None]
+    z = np.linspace(0, 1, nz)[None, None, :]
+    for snap in snaps:
+        with open(fdir / f'{SNAPNAME}_{snap:03d}.idl', 'w') as f:
+            f.write(IDL_TEMPLATE.format(snapname=SNAPNAME, nx=nx, ny=ny, nz=nz, snap=snap, t=10.0 * snap))
+        # (the plane means depend on z, so that averages over a sub-domain differ from the full-domain ones.)
+        arrs = [1 + 0.5 * z**(i % 3 + 1) + 0.3 * np.sin(x + i + snap) * np.cos(y - i) * np.exp(-(i + 1) * z)
+                for i in range(8)]
+        with open(fdir / f'{SNAPNAME}_{snap:03d}.snap', 'wb') as f:
+            for arr in arrs:
+                f.write(arr.astype('<f4').tobytes(order='F'))
+        with open(fdir / f'{SNAPNAME}_{snap:03d}.aux', 'wb') as f:
+            f.write((1e4 * arrs[0]).astype('<f4').tobytes(order='F'))
+
+
+@pytest.fixture
+def fake_run(tmp_path):
+    write_fake_run(tmp_path)
+    return tmp_path
+
+
+def _slice_like_get_var(val, iix=slice(None), iiy=slice(None), iiz=slice(None)):
+    for i, ii in enumerate((iix, iiy, iiz)):
+        ii = slice(ii, ii + 1) if isinstance(ii, int) else ii
+        val = val[(slice(None),) * i + (ii,)]
+    return val
+
+
+def _record_get_var(monkeypatch, dd):
+    """Records the kwargs of each call of dd.get_var. Returns dict of {var: [kwargs of each call]}."""
+    calls = collections.defaultdict(list)
+    get_var = dd.get_var
+
+    def recording_get_var(var, *args, **kwargs):
+        calls[var].append(kwargs)
+        return get_var(var, *args, **kwargs)
+    monkeypatch.setattr(dd, 'get_var', recording_get_var)
+    return calls
+
+
+@pytest.mark.parametrize('var', ['ux', 'b2', 'dpxdxup', 'dpzdzdn', 'rotbx', 'ddpzdzupdzdn',
+                                 'mean_r', 'horvarr', 'delta_ux', 'deltafrac_r', 'chhdivb', 'abs_ux'])
+@pytest.mark.parametrize('slices', [dict(iiz=5), dict(iix=slice(3, 6), iiz=0),
+                                    dict(iiy=19, iiz=slice(20, 30)), dict(iix=[1, 5])])
+def test_get_var_slice_pushdown(fake_run, var, slices):
+    """
+    Tests that get_var on a sub-domain matches slicing the full-domain result.
+    """
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False)
+    full = np.array(dd.get_var(var))
+    val = dd.get_var(var, **slices)
+    if np.ndim(full) == 3:
+        full = _slice_like_get_var(full, **slices)
+    assert np.shape(val) == np.shape(full)
+    assert np.allclose(val, full, rtol=1e-6, atol=0)
+
+
+def test_slices_with_halo(fake_run):
+    """
+    Tests the domain used internally by get_var when do_stagger.
+    """
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False, slice_halo=4)
+    # z is not periodic, so the halo is clipped at the boundary
+    assert dd._slices_with_halo(iiz=1)[2] == slice(0, 6)
+    # stagger skips axes of length 5 or less, so windows that small use the full axis
+    assert dd._slices_with_halo(iiz=0)[2] == slice(None)
+    assert dd._slices_with_halo(iiz=10)[2] == slice(6, 15)
+    # x is periodic, so use the full axis if the halo would wrap around
+    assert dd._slices_with_halo(iix=1)[0] == slice(None)
+    assert dd._slices_with_halo(iix=10)[0] == slice(6, 15)
+    # non-contiguous slices always use the full axis
+    assert dd._slices_with_halo(iix=[1, 5])[0] == slice(None)
+    dd.slice_halo = False
+    assert dd._slices_with_halo(iiz=10)[2] == slice(None)
+
+
+def test_plan_vars(fake_run, monkeypatch):
+    """
+    Tests that QuantPlan shares intermediate quantities and matches get_var.
+    """
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False)
+    varlist = ['b2', 'bxc', 'rotbx', 'ux', 'uy', 'dpxdxup', 'ddpxdxupdxdn', 'mean_ux']
+    plan = dd.plan_vars(varlist)
+    assert plan.nuses[('bxc', None, None, 0)] == 2
+    assert plan.nuses[('by', None, None, 0)] == 2
+    assert plan.nuses[('r', None, None, 0)] == 2
+    for snap in (2, 3):
+        result = plan.evaluate(snap=snap)
+        for var in varlist:
+            assert np.allclose(result[var], dd.get_var(var))
+    calls = _record_get_var(monkeypatch, dd)
+    plan = dd.plan_vars(['b2', 'ux'], iiz=5)
+    # discovery gets each var only once, on the 1 cell in the middle of the domain, even with slices.
+    for var in ('b2', 'ux'):
+        assert [kw['iiz'] for kw in calls[var]] == [SHAPE[2] // 2]
+    result = plan.evaluate()
+    assert np.shape(result['b2']) == SHAPE[:2] + (1,)
+
+
+def test_get_vars(fake_run):
+    """
+    Tests that get_vars matches get_var for each var.
+    """
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False)
+    varlist = ['r', 'e', 'px', 'bz', 'tg', 'ux', 'b2']
+    result = dd.get_vars(varlist, snap=2, iiz=slice(3, 7))
+    for var in varlist:
+        assert np.allclose(result[var], dd.get_var(var, iiz=slice(3, 7)))
+    stacked = dd.get_vars(varlist, snap=3, iiz=slice(3, 7), stack=True)
+    assert stacked.shape == (len(varlist), SHAPE[0], SHAPE[1], 4)
+    assert np.allclose(stacked[1], dd.get_var('e', iiz=slice(3, 7)))
+    with pytest.raises(TypeError):
+        dd.get_vars(varlist, 3, slice(3, 7))
+    # the plan is re-used for other snaps, but rebuilt if metadata which may affect the graph changes.
+    nplans = len(dd._get_vars_plans)
+    dd.get_vars(varlist, snap=1, iiz=slice(3, 7))
+    assert len(dd._get_vars_plans) == nplans
+    dd.stagger_kind = 'first'
+    result = dd.get_vars(varlist, iiz=slice(3, 7))
+    assert len(dd._get_vars_plans) == nplans + 1
+    assert np.allclose(result['ux'], dd.get_var('ux', iiz=slice(3, 7)))
+
+
+def test_get_varTime_workers(fake_run):
+    """
+    Tests that get_varTime with a pool of workers matches the serial result.
+    """
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False)
+    serial = dd.get_varTime('r', SNAPS, iiz=slice(2, 9), print_freq=-1)
+    parallel = dd.get_varTime('r', SNAPS, iiz=slice(2, 9), print_freq=-1, workers=2)
+    assert parallel.shape == SHAPE[:2] + (7, len(SNAPS))
+    assert np.array_equal(serial, parallel)
+    dd.numThreads = 8   # the threads are split between the workers.
+    assert bifrost._varTime_worker_num_threads(dd, 2) == 4
+    assert bifrost._varTime_worker_num_threads(dd, 16) == 1
+    # the workers (and iter_varTime's prefetcher) read with the current state of dd, not its initial state.
+    dd.numThreads = 1
+    dd.sel_units = 'cgs'
+    serial = dd.get_varTime('b2', SNAPS, print_freq=-1)
+    assert np.array_equal(serial, dd.get_varTime('b2', SNAPS, print_freq=-1, workers=2))
+    dd.ifluid, dd.jfluid = (2, 1), (1, 2)   # (as if after EbysusData.set_mfi and set_mfj.)
+    reader = bifrost._new_reader(*dd._new_reader_args())
+    assert (reader.sel_units, reader.ifluid, reader.jfluid) == ('cgs', (2, 1), (1, 2))
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_iter_varTime(fake_run, monkeypatch, prefetch):
+    """
+    Tests that iter_varTime yields the same values as get_varTime, one snap at a time.
+    """
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False)
+    ref = dd.get_varTime('b2', SNAPS, iiz=slice(3, 8), print_freq=-1)
+    calls = _record_get_var(monkeypatch, dd)
+    result = list(dd.iter_varTime('b2', SNAPS, prefetch=prefetch, iiz=slice(3, 8)))
+    # 1 per snap, plus 1 to discover which simple vars to prefetch.
+    assert len(calls['b2']) == len(SNAPS) + (1 if prefetch else 0)
+    if prefetch:   # discovery is on the 1 cell in the middle of the domain, not on iiz=slice(3, 8).
+        assert calls['b2'][0]['iiz'] == SHAPE[2] // 2
+    assert [snap for snap, _, _ in result] == list(SNAPS)
+    assert [t for _, t, _ in result] == [10.0 * snap for snap in SNAPS]
+    for it, (_, _, val) in enumerate(result):
+        assert np.allclose(val, ref[..., it])
+
+
+def test_lazy_var(fake_run, tmp_path):
+    """
+    Tests that get_var with chunks gives a LazyVar which matches get_var on the full domain.
+    """
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False)
+    for var in ('tg', 'rotbx', 'ddpzdzupdzdn'):
+        full = dd.get_var(var)
+        lazy = dd.get_var(var, chunks=(None, 8, 7))
+        assert lazy.nblocks == 3 * 5
+        assert np.allclose(np.asarray(lazy), full)
+        assert np.isclose(lazy.max(), full.max())
+        assert np.allclose(lazy.mean(axis=(0, 1)), full.mean(axis=(0, 1)))
+    for var in ('delta_ux', 'chhdivb'):  # (these depend on the whole domain.)
+        lazy = dd.get_var(var, chunks=(None, None, 4))
+        assert np.allclose(np.asarray(lazy), dd.get_var(var))
+    lazy = dd.get_var('b2', chunks=(None, None, 4), iiz=slice(3, 20))
+    out = lazy.to_memmap(tmp_path / 'b2.dat')
+    assert np.allclose(out, dd.get_var('b2', iiz=slice(3, 20)))
+    assert dd.iiz == slice(3, 20)
+    assert lazy_var.auto_chunks((100, 100, 100), 0, 4, 4 * 100 * 100 * 10) == (100, 100, 10)
+    assert lazy_var.auto_chunks((100, 100, 100), 5, 4, 4 * 100 * 100 * 20) == (100, 100, 10)
+
+
+@pytest.mark.parametrize('do_stagger, periodic_z', [(True, 0), (True, 1), (False, 0)])
+def test_streaming_stats(fake_run, monkeypatch, do_stagger, periodic_z):
+    """
+    Tests that stats and horizontal profiles computed over z-slabs match numpy on the full domain.
+    """
+    monkeypatch.setattr(load_arithmetic_quantities, 'STREAM_SLAB_NZ', 7)
+    monkeypatch.setattr(load_arithmetic_quantities, 'STREAM_SLAB_NHALO', 0)
+    for idl in fake_run.glob('*.idl'):
+        idl.write_text(idl.read_text().replace('periodic_z = 0', f'periodic_z = {periodic_z}'))
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False, do_stagger=do_stagger)
+    for var in ('tg', 'rotbx'):
+        full = dd.get_var(var).astype('float64')
+        assert np.isclose(dd.get_var('mean_' + var), full.mean())
+        assert np.isclose(dd.get_var('std_' + var), full.std())
+        assert dd.get_var('max_' + var) == full.max()
+        assert np.allclose(dd.get_var('hmean_' + var), full.mean(axis=(0, 1)))
+        assert np.allclose(dd.get_var('hrms_' + var), np.sqrt(np.mean(full**2, axis=(0, 1))))
+        assert np.allclose(dd.get_var('hpercentile90_' + var), np.percentile(full, 90, axis=(0, 1)))
+        assert np.allclose(dd.get_var('horvar' + var), full / full.mean(axis=(0, 1)), rtol=1e-5)
+        assert dd.iiz == slice(None)
+
+
+@pytest.mark.parametrize('periodic_z', [0, 1])
+def test_zslab_windows(tmp_path, monkeypatch, periodic_z):
+    """
+    Tests that streaming over z-slabs calculates each slab plus a halo only if the quantity needs one,
+    and wraps the halo around a periodic z axis instead of calculating on the full domain.
+    """
+    write_fake_run(tmp_path, snaps=(1,), shape=(8, 8, 128))
+    for idl in tmp_path.glob('*.idl'):
+        idl.write_text(idl.read_text().replace('periodic_z = 0', f'periodic_z = {periodic_z}'))
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=tmp_path, verbose=False)
+    halo = dd.slice_halo
+    windows = collections.defaultdict(list)
+    get_var = dd.get_var
+
+    def recording_get_var(var, *args, **kwargs):
+        windows[var].append(dd.zLength)
+        return get_var(var, *args, **kwargs)
+    monkeypatch.setattr(dd, 'get_var', recording_get_var)
+    for var, var_halo in (('r', 0), ('ux', halo)):
+        full = dd.get_var(var).astype('float64')
+        windows.clear()
+        assert np.allclose(dd.get_var('hmean_' + var), full.mean(axis=(0, 1)))
+        # 2 slabs of 64. The first slab always has a halo; it tells whether var uses stagger operations.
+        edge = 64 + halo * (1 + periodic_z)
+        assert windows[var] == [edge, 64 + var_halo * (1 + periodic_z)]
+
+
+@pytest.mark.parametrize('var', ['divb', 'divdnb', 'rotbx', 'sheby', 'curvecbz', 'grar'])
+def test_deriv_sum(fake_run, monkeypatch, var):
+    """
+    Tests that sums of derivatives done in one pass by stagger.deriv_sum
+    match taking each derivative separately.
+    """
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False)
+    result = dd.get_var(var)
+    monkeypatch.setattr(load_arithmetic_quantities, '_can_deriv_sum', lambda obj: False)
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False)
+    expect = dd.get_var(var)
+    assert np.allclose(result, expect, rtol=1e-5, atol=1e-5 * np.abs(expect).max())
+
+
+@pytest.mark.parametrize('var', ['dpxdxup', 'dpzdzdn', 'uparb', 'fftxy_r'])
+def test_numThreads(fake_run, var):
+    """
+    Tests that using a thread pool (numThreads > 1) matches the serial result, and that the pool is reused.
+    """
+    expect = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False).get_var(var)
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False, numThreads=3)
+    assert np.allclose(dd.get_var(var), expect, rtol=1e-6, atol=1e-6 * np.abs(expect).max())
+    pool = tools.thread_pool(dd)
+    dd.get_var(var)
+    assert tools.thread_pool(dd) is pool
+
+
+def test_map_slabs():
+    """
+    Tests that map_slabs passes slabs of out into the task, and that threadQuantity doesn't keep its pools.
+    """
+    owner = load_arithmetic_quantities._ThreadQuantityOwner(3)
+    arr = np.asfortranarray(np.random.default_rng(0).random(SHAPE, dtype=np.float32))
+    out_slabs = []
+
+    def task(x, out):
+        out_slabs.append(out)
+        return np.multiply(x, 2, out=out)
+    result = tools.map_slabs(owner, task, arr)
+    assert np.array_equal(result, 2 * arr) and (result.dtype == arr.dtype) and np.isfortran(result)
+    assert len(out_slabs) == 3 and all(np.shares_memory(out, result) for out in out_slabs)
+    n_pools = len(tools._THREAD_POOLS)
+    for threadQuantity in (load_arithmetic_quantities.threadQuantity,
+                           load_arithmetic_quantities.threadQuantity_y,
+                           load_arithmetic_quantities.threadQuantity_z):
+        assert np.array_equal(threadQuantity(np.add, 2, arr, arr), 2 * arr)
+        assert len(tools._THREAD_POOLS) == n_pools
+
+
+def write_fake_tables(fdir, nei=30, nrho=40, nradbins=3):
+    """Write a small tabparam.in with smooth EOS and rad tables to fdir."""
+    lnei, lnrho = np.meshgrid(np.linspace(0, 1, nei), np.linspace(0, 1, nrho), indexing='ij')
+    eos = np.stack([lnei + lnrho, 1e4 * (1 + lnei), lnei - lnrho, lnrho ** 2], axis=-1)
+    rad = np.stack([np.stack([lnei * (i + 1), lnrho - i, lnei * lnrho], axis=-1) for i in range(nradbins)],
+                   axis=2)
+    eos.astype('<f4').T.tofile(os.path.join(fdir, 'eostable.dat'))
+    rad.astype('<f4').T.tofile(os.path.join(fdir, 'radtable.dat'))
+    with open(os.path.join(fdir, 'tabparam.in'), 'w') as f:
+        f.write(f"rhomin = 1e-12\nrhomax = 1e-6\nnrhobin = {nrho}\n"
+                f"eimin = 1e11\neimax = 1e14\nneibin = {nei}\n"
+                f"nradbins = {nradbins}\neostablefile = 'eostable.dat'\nrhoeiradtablefile = 'radtable.dat'\n")
+
+
+def test_rhoeetab(fake_run):
+    """
+    Tests that the EOS table is cached per fdir, and that interpolating several quantities at once
+    matches ndimage.map_coordinates for each quantity.
+    """
+    from scipy import ndimage
+    write_fake_tables(fake_run)
+    tab = bifrost.get_rhoeetab(fdir=fake_run, radtab=True)
+    assert bifrost.get_rhoeetab(fdir=fake_run) is tab
+    # modifying tabparam.in replaces the cached table, instead of keeping the old one alive.
+    tabfile = os.path.join(fake_run, 'tabparam.in')
+    mtime = os.stat(tabfile).st_mtime_ns
+    os.utime(tabfile, ns=(mtime + 10**9, mtime + 10**9))
+    old = weakref.ref(tab)
+    tab = bifrost.get_rhoeetab(fdir=fake_run, radtab=True)
+    gc.collect()
+    assert old() is None
+    assert sum(key[1] == os.path.abspath(tabfile) for key in bifrost._RHOEETAB_CACHE) == 1
+    rng = np.random.default_rng(0)
+    rho = np.asfortranarray(10 ** rng.uniform(-12.5, -5.5, (6, 5, 4))).astype('float32')
+    ei = np.asfortranarray(10 ** rng.uniform(10.5, 14.5, (6, 5, 4))).astype('float32')
+    x = (np.log(ei) - tab.lnei[0]) / tab.dlnei
+    y = (np.log(rho) - tab.lnrho[0]) / tab.dlnrho
+    bins = dict(eps=2, opa=1)
+    for out, quant in dict(ne=tab.lnne, tg=tab.tgt, eps=tab.epstab[:, :, 2], opa=tab.opatab[:, :, 1]).items():
+        for order in (1, 3):
+            expect = ndimage.map_coordinates(quant, [x, y], order=order, mode='nearest')
+            expect = expect if out == 'tg' else np.exp(expect)
+            result = tab.tab_interp(rho, ei, out=out, bin=bins.get(out), order=order)
+            assert np.allclose(result, expect, rtol=1e-5)
+    result = tab.tab_interp_multi(rho, ei, outs=['ne', 'tg', 'eps', 'opa'])
+    assert result['tg'].shape == rho.shape and result['eps'].shape == rho.shape + (3,)
+    assert np.array_equal(result['tg'], tab.tab_interp(rho, ei, out='tg'))
+    assert np.array_equal(result['eps'][..., 2], tab.tab_interp(rho, ei, out='eps', bin=2))
+
+
+def test_ent_table(fake_run):
+    """
+    Tests that the entropy table is saved next to the EOS table,
+    and only reused while the EOS table is unchanged.
+    """
+    write_fake_tables(fake_run)
+    tab = bifrost.Rhoeetab(fdir=fake_run, verbose=False)
+    with np.errstate(invalid='ignore'):
+        tab.load_ent_table()
+        cachefile = os.path.join(fake_run, tab.params['eostablefile'] + '.ent.npy')
+        assert os.path.isfile(cachefile)
+        assert np.array_equal(np.load(cachefile), tab.enttab, equal_nan=True)
+        np.save(cachefile, np.zeros_like(tab.enttab))
+        tab2 = bifrost.Rhoeetab(fdir=fake_run, verbose=False)
+        tab2.load_ent_table()
+        assert np.all(tab2.enttab == 0)
+        os.utime(cachefile, ns=(0, 0))   # older than the EOS table --> recomputed.
+        tab2.load_ent_table()
+        assert np.array_equal(tab2.enttab, tab.enttab, equal_nan=True)
+
+
+def test_cross_sect(tmp_path):
+    """
+    Tests that Cross_sect.tab_interp_multi matches linear interpolation in log(tg) of the original tables
+    (with the values at the table edges used for tg outside of the tables),
+    for uniform and non-uniform tables.
+    """
+    rng = np.random.default_rng(0)
+    for name, tg in (('a.txt', np.arange(1000, 400000, 100.)), ('b.txt', np.geomspace(500, 1e5, 40))):
+        with open(tmp_path / name, 'w') as f:
+            f.write('; fake cross section table\n 1e-16\n')
+            for t in tg:
+                f.write('%.6e x %.6e %.6e\n' % (t / 11604, np.sin(np.log(t)), rng.random()))
+    cross = bifrost.Cross_sect(['a.txt', 'b.txt'], fdir=str(tmp_path))
+    tg = np.asfortranarray(10 ** rng.uniform(2.5, 6, (6, 5, 4))).astype('float32')
+    result = cross.tab_interp_multi(tg, outs=['el', 'vi'])
+    assert result['el'].shape == (2,) + tg.shape and result['el'].dtype == np.float32
+    for itab in (0, 1):
+        table = cross.cross_tab[itab]
+        for out in ('el', 'vi'):
+            expect = np.interp(np.log(tg.astype('float64')), np.log(table['tg']), table[out])
+            assert np.allclose(result[out][itab], expect, rtol=1e-6, atol=1e-6)
+            assert np.array_equal(cross.tab_interp(tg, itab=itab, out=out), result[out][itab])
+    with pytest.raises(KeyError):
+        cross.tab_interp(tg, out='se')
+    # the cached lookup tables for a modified file replace the old ones
+    fname = str(tmp_path / 'a.txt')
+    stat = os.stat(fname)
+    os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert bifrost.get_logtg_cross_tab(fname, cross.cross_tab[0]) is not \
+        bifrost.get_logtg_cross_tab(fname, cross.cross_tab[0], kelvin=False)
+    assert sum(key[0] == os.path.abspath(fname) for key in bifrost._CROSS_TAB_CACHE) == 2
+    os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+    bifrost.get_logtg_cross_tab(fname, cross.cross_tab[0])
+    assert sum(key[0] == os.path.abspath(fname) for key in bifrost._CROSS_TAB_CACHE) == 1
+
+
+def test_disk_cache(fake_run, tmp_path):
+    """
+    Tests that get_var results are remembered on disk, and forgotten when the snapshot changes.
+    """
+    cache_dir = str(tmp_path / 'cache')
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False, disk_cache=cache_dir)
+    ref = dd.get_var('b2')
+    assert len(dd.disk_cache.entries()) == 1
+    dd.get_var('r')   # simple vars are not cached on disk.
+    assert len(dd.disk_cache.entries()) == 1
+    dd2 = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False, disk_cache=cache_dir)
+    val, meta = dd2.disk_cache.get(dd2, 'b2')
+    assert meta['var'] == 'b2'
+    assert meta['qtracking_state']['quants_tree'].data.varname == 'b2'
+    metapath = dd2.disk_cache.entries()[0][0]
+    with open(metapath) as f:
+        assert json.load(f)['var'] == 'b2'   # meta is stored as JSON (never pickle).
+    assert np.array_equal(dd2.get_var('b2'), ref)
+    assert np.array_equal(dd2.get_var('b2', iiz=slice(3, 7)), dd.get_var('b2', iiz=slice(3, 7)))
+    assert len(dd2.disk_cache.entries()) == 2
+    # values depend on sel_units, so they aren't shared between different sel_units.
+    kw = dict(snap=1, fdir=fake_run, verbose=False, sel_units='cgs')
+    ref_cgs = bifrost.BifrostData(SNAPNAME, **kw).get_var('b2')
+    assert not np.allclose(ref_cgs, ref)
+    assert np.array_equal(bifrost.BifrostData(SNAPNAME, **kw, disk_cache=cache_dir).get_var('b2'), ref_cgs)
+    assert len(dd2.disk_cache.entries()) == 3
+    # changing the snapshot file invalidates its entries
+    os.utime(fake_run / f'{SNAPNAME}_001.snap', (0, 0))
+    assert dd2.disk_cache.get(dd2, 'b2') == (None, None)
+    assert disk_cache_cli.main(['--dir', cache_dir, 'prune', '--stale']) == 0
+    assert len(dd2.disk_cache.entries()) == 0
+    dd2.get_var('b2', snap=2)
+    assert disk_cache_cli.main(['--dir', cache_dir, 'clear']) == 0
+    assert len(dd2.disk_cache.entries()) == 0
+
+
+def test_disk_cache_internal(fake_run, tmp_path):
+    """
+    Tests that internal calls to get_var don't get (read-only) values from the disk cache.
+    """
+    cache_dir = str(tmp_path / 'cache')
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False, disk_cache=cache_dir)
+    dd.get_var('dbxdxup')   # chbdivb adds to this value in-place.
+    ref = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False).get_var('chbdivb')
+    dd2 = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False, disk_cache=cache_dir)
+    assert np.array_equal(dd2.get_var('chbdivb'), ref)
+    assert dd2.disk_cache.performance['N_recalled'] == 0
+    assert not dd2.get_var('dbxdxup').flags.writeable   # top-level calls still read from the disk cache.
+    assert dd2.disk_cache.performance['N_recalled'] == 1
+
+
+def test_snap_index(fake_run, tmp_path, monkeypatch):
+    """
+    Tests that BifrostData with a snap_index matches reading the .idl and mesh files.
+    """
+    with open(fake_run / f'{SNAPNAME}.mesh', 'w') as f:
+        for n, d in zip(SHAPE, (0.1, 0.1, 0.05)):
+            f.write(f'{n}\n')
+            for arr in (np.arange(n) * d, (np.arange(n) - 0.5) * d, np.full(n, 1 / d), np.full(n, 1 / d)):
+                f.write(' '.join(f'{v:.6e}' for v in arr) + '\n')
+    index_path = str(tmp_path / 'tst.snap_index')
+    ref = bifrost.BifrostData(SNAPNAME, snap=list(SNAPS), fdir=fake_run, verbose=False)
+    dd = bifrost.BifrostData(SNAPNAME, snap=list(SNAPS), fdir=fake_run, verbose=False, snap_index=index_path)
+    assert dd.get_snaps() == list(SNAPS)
+    assert np.array_equal(dd.time, ref.time)
+    assert np.array_equal(dd.z, ref.z) and np.array_equal(dd.dzidzdn, ref.dzidzdn)
+    assert dd.snap_index.times() == {snap: 10.0 * snap for snap in SNAPS}
+    # a new reader uses the saved index, without reading any .idl or mesh files
+    dd = bifrost.BifrostData(SNAPNAME, snap=1, fdir=fake_run, verbose=False, snap_index=index_path)
+    r2 = ref.get_var('r', snap=2)
+    monkeypatch.setattr(bifrost, 'read_idl_ascii', None)
+    monkeypatch.setattr(bifrost, 'read_mesh_ascii', None)
+    assert dd.set_snap_time(21.0, snaps=list(SNAPS)) == (2, 20.0)
+    assert np.array_equal(dd.z, ref.z)
+    assert np.array_equal(dd.get_var('r'), r2)
+    monkeypatch.undo()
+    # new snapshots are added to the index
+    write_fake_run(fake_run, snaps=(4,))
+    assert dd.get_snaps() == list(SNAPS) + [4]
+    assert dd.snap_index.time(4) == 40.0
+    # the index is stored as JSON (and the meshes as .npz), not pickle
+    with open(index_path) as f:
+        assert sorted(json.load(f)['snaps']) == ['1', '2', '3', '4']
+    # a corrupt or truncated index is rebuilt
+    with open(index_path, 'r+') as f:
+        f.truncate(100)
+    assert len(bifrost.snap_index.SnapIndex(fake_run, SNAPNAME, path=index_path)) == 0
+    dd = bifrost.BifrostData(SNAPNAME, snap=2, fdir=fake_run, verbose=False, snap_index=index_path)
+    assert dd.get_snaps() == list(SNAPS) + [4]
+    assert np.array_equal(dd.z, ref.z)
@@ -0,0 +1,156 @@
+"""
+Tests for the collisions module
+"""
+import types
+import contextlib
+
+import numpy as np
+
+from helita.sim import bifrost, collisions, load_mf_quantities
+
+SHAPE = (6, 5, 4)
+# fluid: (mass [amu], charge [e]). electrons, H, H+, He.
+FLUIDS = {(-1, 0): (5.5e-4, -1), (1, 1): (1.0, 0), (1, 2): (1.0, 1), (2, 1): (4.0, 0)}
+MASSES = {SL[0]: mass for SL, (mass, charge) in FLUIDS.items()}   # {species: mass [amu]}
+# getters from load_mf_quantities used by FakeMultifluid.get_var, in order.
+GETTERS = (load_mf_quantities.get_mf_colf, load_mf_quantities.get_mf_cross,
+           load_mf_quantities.get_heating_quant)
+
+
+class FakeMultifluid():
+    '''the parts of EbysusData needed by the collisions module, for 4 fluids with made-up values.'''
+
+    def __init__(self, fdir):
+        rng = np.random.default_rng(0)
+        self.uni = bifrost.Bifrost_units(verbose=False)
+        self.uni.u_nr, self.uni.usi_nr = 1e10, 1e16   # [cm^-3], [m^-3]. so nu_ij isn't subnormal in float32.
+        # kB = 1 [simu], so made-up qcol_tg doesn't underflow float32.
+        self.uni.usi_e = self.uni.ksi_b * self.uni.usi_nr
+        self.nr = {SL: rng.uniform(1, 2, SHAPE).astype('float32') for SL in FLUIDS}
+        self.tg = {SL: rng.uniform(3e3, 2e4, SHAPE).astype('float32') for SL in FLUIDS}
+        self.uid2 = {(iSL, jSL): rng.uniform(0, 1, SHAPE).astype('float32')
+                     for iSL in FLUIDS for jSL in FLUIDS}
+        self.logcul = rng.uniform(5, 20, SHAPE).astype('float32')
+        self.ifluid, self.jfluid = (1, 1), (1, 2)
+        self.fluids = [types.SimpleNamespace(SL=SL) for SL in FLUIDS if SL[0] > 0]
+        self.physics = True   # whether to match physics (else, match aux).
+        tg = np.geomspace(1e3, 1e5, 30)
+        with open(fdir / 'cross.txt', 'w') as f:
+            f.write(' 1e-16\n' + ''.join('%.6e x %.6e\n' % (t / 11604, 5 + np.sin(np.log(t))) for t in tg))
+        self.fdir = str(fdir)
+        self.match_type = 0
+
+    def MaintainFluids(self):
+        return contextlib.nullcontext()
+
+    def match_aux(self):
+        return not self.physics
+
+    def match_physics(self):
+        return self.physics
+
+    def get_param(self, param, default=None):
+        return default
+
+    def get_var(self, var, ifluid=None, jfluid=None, jS=None, cache_with_nfluid=None):
+        ifluid = self.ifluid if ifluid is None else getattr(ifluid, 'SL', ifluid)
+        jfluid = (-1, 0) if jS == -1 else (self.jfluid if jfluid is None else getattr(jfluid, 'SL', jfluid))
+        if var == 'logcul':
+            return self.logcul
+        elif var in ('nr', 'tg'):
+            return getattr(self, var)[ifluid]
+        elif var == 'uid2':
+            return self.uid2[(ifluid, jfluid)]
+        orig_fluids = (self.ifluid, self.jfluid)
+        self.ifluid, self.jfluid = ifluid, jfluid
+        try:
+            for getter in GETTERS:
+                result = getter(self, var)
+                if result is not None:
+                    return result
+            raise ValueError(f'FakeMultifluid cannot get var={var!r}')
+        finally:
+            self.ifluid, self.jfluid = orig_fluids
+
+    @property
+    def mf_ispecies(self):
+        return self.ifluid[0]
+
+    @property
+    def mf_jspecies(self):
+        return self.jfluid[0]
+
+    def fluid_SLs(self, with_electrons=True):
+        return [SL for SL in FLUIDS if with_electrons or SL[0] > 0]
+
+    def fluids_equal(self, iSL, jSL):
+        return iSL == jSL
+
+    def i_j_same_fluid(self):
+        return self.ifluid == self.jfluid
+
+    def zero_at_mesh_center(self):
+        return np.zeros(SHAPE, dtype='float32')
+
+    def get_mass(self, specie, units='amu'):
+        specie = specie[0] if isinstance(specie, tuple) else specie   # (species, level) --> species
+        return MASSES[specie]   # [amu]. (also [simu mass], so made-up qcol_u doesn't underflow float32.)
+
+    def get_charge(self, SL):
+        return FLUIDS[SL][1]
+
+    def get_coll_type(self, iSL=None, jSL=None):
+        iSL = self.ifluid if iSL is None else iSL
+        jSL = self.jfluid if jSL is None else jSL
+        charged = (self.get_charge(iSL) != 0) and (self.get_charge(jSL) != 0)
+        if iSL[0] < 0 or jSL[0] < 0:
+            return ('EE', 'CL' if charged else 'EL')
+        return 'CL' if charged else ('MX' if 2 in (iSL[0], jSL[0]) else 'EL')
+
+    def get_cross_tab(self, iSL=None, jSL=None):
+        return 'cross.txt'
+
+    def get_cross_sect(self, ifluid=None, jfluid=None):
+        return self.cross_sect([self.get_cross_tab(ifluid, jfluid)])
+
+    def cross_sect(self, cross_tab):
+        return bifrost.Cross_sect(cross_tab, fdir=self.fdir)
+
+
+def test_nu_tensor(tmp_path):
+    """
+    Tests that nu_tensor, nu_row, and nu_sum match get_var('nu_ij') one pair at a time.
+    (i.e. via load_mf_quantities.get_mf_colf, which gets nu_ij_el, nu_ij_cl, or nu_ij_mx.)
+    """
+    obj = FakeMultifluid(tmp_path)
+    fluids = list(FLUIDS)
+    tensor = collisions.nu_tensor(obj, fluids)
+    assert tensor.shape == (len(fluids), len(fluids)) + SHAPE and tensor.dtype == np.float32
+    for i, iSL in enumerate(fluids):
+        assert np.all(tensor[i, i] == 0)
+        for j, jSL in enumerate(fluids):
+            if i != j:
+                nu_ij = obj.get_var('nu_ij', ifluid=iSL, jfluid=jSL)
+                assert np.allclose(tensor[i, j], nu_ij, rtol=1e-5, atol=0)
+    assert np.array_equal(collisions.nu_row(obj, fluids[1], fluids), tensor[1])
+    sums = collisions.nu_sum(obj, fluids[1:], fluids)
+    assert np.allclose(sums, tensor[1:].sum(axis=1), rtol=1e-5, atol=0)
+    weighted = collisions.colfreq_sums(obj, [(fluids[1], fluids[2]), (fluids[1], fluids[3])],
+                                       dest=[0, 0], nout=1, weights=[2, 0.5])
+    assert np.allclose(weighted[0], 2 * tensor[1, 2] + 0.5 * tensor[1, 3], rtol=1e-5, atol=0)
+    # match aux --> colfreq_sums gets each nu_ij via get_var instead of the numba engine.
+    obj.physics = False
+    assert np.allclose(collisions.nu_sum(obj, fluids[1:], fluids), sums, rtol=1e-5, atol=0)
+
+
+def test_qcol_sums(tmp_path):
+    """
+    Tests that the qcol sums from collisions.py (match physics)
+    match the loops over qcol_uj or qcol_tgj (match aux).
+    """
+    obj = FakeMultifluid(tmp_path)
+    for var in ('qcol_u', 'qcol_tg', 'qcol_u_noe', 'tgqcol_equil_u', 'tgqcol_equil_tg'):
+        obj.physics = True
+        result = obj.get_var(var)
+        obj.physics = False
+        assert np.allclose(result, obj.get_var(var), rtol=1e-5, atol=0)
@@ -0,0 +1,243 @@
+"""
+Tests for the ebysus module
+"""
+import os
+import shutil
+import contextlib
+
+import numpy as np
+import pytest
+
+from helita.sim import ebysus, load_mf_quantities
+
+pytest.importorskip('zarr')
+
+SHAPE = (10, 9, 8)
+
+
+@pytest.mark.parametrize('chunks', ['array', 'zslab', 'pencil', (4, None, 3)])
+def test_zarr_window(tmp_path, chunks):
+    """
+    Tests that zarr files saved with any chunks can be read back in full or on a window (iix, iiy, iiz).
+    """
+    arr = np.random.default_rng(0).random((*SHAPE, 3)).astype('<f4')
+    src, dst = tmp_path / 'src.snap', tmp_path / 'dst.snap'
+    arr.T.tofile(src)   # fortran order, like the .snap files.
+    z = ebysus.save_filebinary_to_filezarr(src, dst, shape=SHAPE, chunks=(*ebysus.zc_chunks(chunks), 1))
+    assert z.chunks[-1] == 1 and all(c <= n for c, n in zip(z.chunks, arr.shape))
+    assert np.array_equal(ebysus.load_zarr(dst, 1), arr[..., 1])
+    windows = [(slice(None), slice(None), 2), (3, slice(1, 8, 2), [7, 0, 4]),
+               (slice(None, None, -1), np.arange(9) % 2 == 0, slice(5, 2))]
+    for window in windows:
+        index = np.ix_(*[np.atleast_1d(np.arange(n)[ii]) for ii, n in zip(window, SHAPE)])
+        assert np.array_equal(ebysus.load_zarr(dst, 1, window=window), arr[..., 1][index])
+    ebysus.save_filezarr_to_filebinary(dst, tmp_path / 'back.snap')
+    assert np.array_equal(np.fromfile(tmp_path / 'back.snap', dtype='<f4'), arr.T.ravel())
+    with pytest.raises(ValueError):
+        ebysus.zc_chunks('cube')
+
+
+class FakeRun():
+    '''the parts of EbysusData needed for compress and decompress.'''
+    nxb, nyb, nzb = SHAPE
+    numThreads = 3
+    mhdvars, snaprvars, snappvars, snapevars = ['e', 'bx', 'by', 'bz'], ['r'], ['px', 'py', 'pz'], []
+    simple_vars = mhdvars + snaprvars + snappvars
+    _zc_file_vars = ebysus.EbysusData._zc_file_vars
+
+    def get_param(self, param):
+        return {'snapname': 'tst'}[param]
+
+
+def test_zc_compress(tmp_path, monkeypatch):
+    """
+    Tests that _zc_compress then _zc_decompress (in parallel) gives back the original files,
+    and can be resumed.
+    """
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    files = {'tst.io/mf_common/tst_mf_common_001.snap': 4, 'tst.io/mf_01_01/mfr/tst_mfr_01_01_001.snap': 1,
+             'tst.io/mf_01_01/mfp/tst_mfp_01_01_001.snap': 3}
+    for name, narr in files.items():
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        rng.random(np.prod(SHAPE) * narr).astype('<f4').tofile(name)
+    run = FakeRun()
+    folder, nbytes, nbytes_stored = ebysus.EbysusData._zc_compress(run, verbose=0, chunks='zslab',
+                                                                   codec='blosc-lz4')
+    assert folder == 'tst.zc' and nbytes == 8 * np.prod(SHAPE) * 4 and nbytes_stored > 0
+    metadata = ebysus.read_zc_metadata('tst.zc')
+    assert metadata['chunks'] == [10, 9, 8] and metadata['codec'] == 'blosc-lz4'
+    # resume: missing files are compressed again; existing ones are skipped.
+    name = 'tst.zc/mf_01_01/mfp/tst_mfp_01_01_001.snap'
+    shutil.rmtree(name)
+    with pytest.raises(ValueError):   # different settings than the existing files.
+        ebysus.EbysusData._zc_compress(run, verbose=0, skip_existing=True, chunks='zslab')
+    assert ebysus.read_zc_metadata('tst.zc') == metadata
+    assert not os.path.exists(name)
+    kw = dict(chunks='zslab', codec='blosc-lz4')
+    nbytes = ebysus.EbysusData._zc_compress(run, verbose=0, skip_existing=True, **kw)[1]
+    assert nbytes == 3 * np.prod(SHAPE) * 4
+    originals = {name: np.fromfile(name, dtype='<f4') for name in files}
+    shutil.rmtree('tst.io')
+    assert ebysus.EbysusData._zc_decompress(run, verbose=0) == 'tst.io'
+    for name, original in originals.items():
+        assert np.array_equal(np.fromfile(name, dtype='<f4'), original)
+
+
+def test_zc_lossy(tmp_path, monkeypatch):
+    """
+    Tests that _zc_compress(lossy=...) keeps the relative error of those vars within rel_tol,
+    and others exact.
+    """
+    monkeypatch.chdir(tmp_path)
+    x, y, z = np.meshgrid(*[np.linspace(0, 1, n) for n in SHAPE], indexing='ij')
+    smooth = np.exp(np.sin(3 * x) * np.cos(2 * y) + z)
+    files = {'tst.io/mf_common/tst_mf_common_001.snap': [smooth * (i + 1) for i in range(4)],
+             'tst.io/mf_01_01/mfr/tst_mfr_01_01_001.snap': [-smooth]}
+    for name, arrs in files.items():
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        np.stack(arrs, axis=-1).astype('<f4').T.tofile(name)
+    lossy = {'bx': 1e-2, 'r': 1e-3}
+    run = FakeRun()
+    _, nbytes, nbytes_stored = ebysus.EbysusData._zc_compress(run, verbose=0, chunks='zslab', lossy=lossy)
+    assert nbytes_stored < nbytes
+    metadata = ebysus.read_zc_metadata('tst.zc')
+    assert metadata['lossy'] == {'bx': dict(rel_tol=1e-2, keepbits=6), 'r': dict(rel_tol=1e-3, keepbits=9)}
+    assert metadata['codec'] == ebysus.ZC_LOSSY_CODEC and metadata['filters'] == ['delta']
+    for name, arrs in files.items():
+        varnames = run._zc_file_vars(name, len(arrs))
+        for i, (var, arr) in enumerate(zip(varnames, arrs)):
+            original = arr.astype('<f4')
+            result = ebysus.load_zarr(name.replace('.io', '.zc'), i)
+            if var in lossy:
+                assert 0 < ebysus.zc_rel_error(original, result) <= lossy[var]
+            else:
+                assert np.array_equal(result, original)
+    with pytest.raises(ValueError):
+        ebysus.EbysusData._zc_compress(run, verbose=0, lossy={'tg': 1e-3})
+    with pytest.raises(ValueError):
+        ebysus.zc_keepbits(0)
+
+
+FLUIDS = [(1, 1), (1, 2), (2, 1)]
+
+
+def _as_slice(ii):
+    return slice(ii, ii + 1) if isinstance(ii, int) else ii
+
+
+class FakeFluidsRun():
+    '''the parts of EbysusData needed for get_var(..., fluids=...) and the sums over fluids in get_global_var.
+    Each simple var of each fluid (including electrons, (-1, 0)) is a made-up array.
+    Like EbysusData, get_var(..., fluids=...) on a sub-domain (iiz) calculates on the sub-domain plus a halo,
+    and postprocessing slices the result and restores the domain.
+    '''
+    get_var_stacked = ebysus.EbysusData.get_var_stacked
+    iter_var_fluids = ebysus.EbysusData.iter_var_fluids
+    _interpret_fluids = ebysus.EbysusData._interpret_fluids
+    halo = 2
+
+    def __init__(self):
+        rng = np.random.default_rng(0)
+        self.values = {(var, SL): rng.random(SHAPE).astype('float32')
+                       for var in ('e', 'px', 'ke', 'eke') for SL in [(-1, 0), *FLUIDS]}
+        self.ifluid = (1, 1)
+        self.iix = self.iiy = self.iiz = slice(None)
+        self.varn = dict()
+        self.loaded = []   # [(var, ifluid)] for each call to _load_quantity.
+        self.windows = []  # [iiz] for each call to _load_quantity.
+        self.npreprocess = 0
+
+    def fluid_SLs(self, with_electrons=True):
+        return [(-1, 0), *FLUIDS] if with_electrons else list(FLUIDS)
+
+    @contextlib.contextmanager
+    def MaintainFluids(self):
+        ifluid = self.ifluid
+        yield
+        self.ifluid = ifluid
+
+    def get_var(self, var, ifluid=None, fluids=None, **kw__domain):
+        '''like EbysusData.get_var; one get_var_stacked if fluids is provided; else one _load_quantity.
+        (for one fluid, the result is calculated on the full domain, then sliced by iiz.)
+        '''
+        if fluids is not None:
+            return self.get_var_stacked(var, fluids, **kw__domain)
+        with self.MaintainFluids():
+            self.ifluid = self.ifluid if ifluid is None else ifluid
+            domain, self.iiz = self.iiz, slice(None)
+            val = self._load_quantity(var)
+            self.iiz = domain
+        return val[:, :, _as_slice(kw__domain.get('iiz', slice(None)))]
+
+    def _getting_lazy_var(self, chunks=None):
+        return False
+
+    def _get_var_preprocess(self, var, ifluid=None, panic=False, internal=False, iiz=None):
+        self.npreprocess += 1
+        self.ifluid = ifluid
+        original_slice = (self.iix, self.iiy, self.iiz if iiz is None else _as_slice(iiz))
+        start, stop, _ = original_slice[2].indices(SHAPE[2])
+        self.set_domain_iiaxes(iiz=slice(max(start - self.halo, 0), min(stop + self.halo, SHAPE[2])))
+        return dict(), dict(original_slice=original_slice)
+
+    def set_domain_iiaxes(self, iix=None, iiy=None, iiz=None):
+        for x, ii in zip(('x', 'y', 'z'), (iix, iiy, iiz)):
+            if ii is not None:
+                setattr(self, 'ii'+x, ii)
+
+    def _load_quantity(self, var):
+        self.loaded.append((var, self.ifluid))
+        self.windows.append(self.iiz)
+        return self.values[(var, self.ifluid)][self.iix, self.iiy, self.iiz]
+
+    def _get_var_postprocess(self, val, var='', printing_stats=None, original_slice=None):
+        window = self.iiz
+        self.set_domain_iiaxes(*original_slice)
+        start, stop, _ = self.iiz.indices(SHAPE[2])
+        return val[:, :, start - window.start: stop - window.start]
+
+    def zero_at_mesh_center(self):
+        return np.zeros(SHAPE, dtype='float32')
+
+
+def test_get_var_fluids():
+    """
+    Tests that get_var(var, fluids=...) and the sums over fluids match get_var for one fluid at a time.
+    """
+    run = FakeFluidsRun()
+    each = {SL: run.get_var('px', ifluid=SL) for SL in [(-1, 0), *FLUIDS]}
+    run.ifluid, run.loaded = (1, 2), []
+    result = run.get_var('px', fluids='all')
+    assert result.shape == (len(FLUIDS), *SHAPE) and result.dtype == 'float32'
+    assert all(np.array_equal(result[i], each[SL]) for i, SL in enumerate(FLUIDS))
+    # one preprocessing, then one _load_quantity (which does caching and quant tracking) per fluid.
+    assert run.npreprocess == 1 and run.loaded == [('px', SL) for SL in FLUIDS]
+    assert run.ifluid == (1, 2)
+    assert np.array_equal(run.get_var('px', fluids=[-1, (2, 1)]), np.stack([each[(-1, 0)], each[(2, 1)]]))
+    # sums over fluids
+    for var, fluids, output in [('tot_px', FLUIDS, 0), ('tot_e', [(-1, 0), *FLUIDS], 0),
+                                ('tot_ke', FLUIDS, run.get_var('eke'))]:
+        expect = output + sum(run.get_var(var[4:], ifluid=SL) for SL in fluids)
+        assert np.allclose(load_mf_quantities.get_global_var(run, var), expect, rtol=1e-6)
+    with pytest.raises(ValueError):
+        run.get_var('px', fluids='ions')
+    with pytest.raises(ValueError):
+        run.get_var('px', fluids=[])
+    with pytest.raises(ValueError):
+        run.get_var_stacked('px', ifluid=(1, 1))
+
+
+@pytest.mark.parametrize('iiz, window', [(0, slice(0, 3)), (4, slice(2, 7)), (slice(2, 5), slice(0, 7)),
+                                         (slice(5, None), slice(3, 8))])
+def test_get_var_fluids_domain(iiz, window):
+    """
+    Tests that get_var(var, fluids=..., iiz=...) calculates each fluid on the sub-domain plus a halo,
+    and matches get_var for one fluid at a time on that sub-domain.
+    """
+    run = FakeFluidsRun()
+    result = run.get_var('px', fluids='all', iiz=iiz)
+    assert run.windows == [window] * len(FLUIDS)
+    assert run.iiz == _as_slice(iiz)   # (postprocessing restores the requested domain.)
+    for i, SL in enumerate(FLUIDS):
+        assert np.array_equal(result[i], run.get_var('px', ifluid=SL, iiz=iiz))
@@ -0,0 +1,38 @@
+"""
+Tests for the file_memory module
+"""
+
+import numpy as np
+import pytest
+
+from helita.sim import file_memory
+
+
+def _fill(cache, calctimes):
+    for i, calctime in enumerate(calctimes):
+        cache.cache('v{}'.format(i), np.zeros(10), metadata=dict(snap=0), calctime=calctime)
+
+
+@pytest.mark.parametrize('policy', file_memory.CACHE_POLICIES)
+def test_Cache(policy):
+    """
+    Tests which entries Cache evicts, and its bookkeeping.
+    """
+    cache = file_memory.Cache(max_Narr=3, policy=policy)
+    _fill(cache, [5.0, 0.1, 3.0])
+    assert cache.get('v0', metadata=dict(snap=0)).value is not None   # recall v0
+    assert cache.get('v1', metadata=dict(snap=1)).value is None       # wrong metadata
+    cache.cache('v3', np.zeros(10), metadata=dict(snap=0), calctime=1.0)
+    assert len(cache) == 3
+    assert set(cache._content) == {'v0', 'v2', 'v3'}   # v1 was least recently used, and cheapest.
+    if policy == 'greedydual':
+        cache.cache('v4', np.zeros(10), metadata=dict(snap=0), calctime=2.0)
+        assert set(cache._content) == {'v0', 'v2', 'v4'}   # v3 was cheaper than v0, v2
+    stats = cache.stats()
+    assert stats['hit_rate'] == 0.5
+    assert stats['nbytes_recalled'] == 80
+    assert cache._nbytes == 3 * 80
+    cache.remove_one_entry(id=cache.get('v0', metadata=dict(snap=0)).id)
+    assert len(cache) == 2 and 'v0' not in cache._content
+    assert cache.clear() == (2, 160)
+    assert len(cache) == 0 and cache._nbytes == 0
@@ -0,0 +1,41 @@
+"""
+Tests the import time of helita.sim modules, using python -X importtime.
+Heavy dependencies should only be imported when they are first used.
+"""
+import sys
+import subprocess
+
+import pytest
+
+# modules which are slow to import, and which should not be imported by just importing helita.sim modules.
+HEAVY_MODULES = ('numba', 'scipy.interpolate', 'scipy.ndimage', 'astropy', 'xarray', 'h5py', 'netCDF4',
+                 'zarr')
+# [seconds] generous upper limit for the import time of each module, to catch large regressions.
+IMPORT_TIME_BUDGET = 2.0
+
+
+def importtime(modulename):
+    """
+    Imports modulename in a new python process. Returns {module: cumulative import time [seconds]}.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {modulename}'],
+                            capture_output=True, text=True, check=True)
+    times = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) * 1e-6
+    return times
+
+
+@pytest.mark.parametrize('modulename', ['helita.sim.bifrost', 'helita.sim.ebysus', 'helita.sim.rh15d'])
+def test_importtime(modulename):
+    """
+    Tests that importing modulename doesn't import heavy modules, and is reasonably fast.
+    """
+    times = importtime(modulename)
+    assert modulename in times
+    heavy = [name for name in times if name in HEAVY_MODULES]
+    assert heavy == [], f'importing {modulename} also imported {heavy}'
+    assert times[modulename] < IMPORT_TIME_BUDGET
@@ -0,0 +1,146 @@
+"""
+Tests for the stagger module
+"""
+import numpy as np
+import pytest
+
+from helita.sim import stagger
+
+
+def _reference(var, operation, diff=None, pad_mode='wrap'):
+    """
+    'fifth' stagger operation along x, using np.pad, for comparison with stagger.do.
+    """
+    up = operation.endswith('up')
+    derivative = operation.startswith('dd')
+    pm, (a, b, c) = (-1, stagger.CONSTANTS_DERIV) if derivative else (1, stagger.CONSTANTS_SHIFT)
+    n = var.shape[0]
+    padded = np.pad(var.astype('float64'), [(3, 3), (0, 0), (0, 0)], mode=pad_mode)
+    def v(m): return padded[3 + m + int(up): 3 + m + int(up) + n]
+    result = a * (v(0) + pm * v(-1)) + b * (v(1) + pm * v(-2)) + c * (v(2) + pm * v(-3))
+    return result * (1 if diff is None else diff[:, np.newaxis, np.newaxis])
+
+
+@pytest.mark.parametrize('pad_mode', ['wrap', 'reflect', 'symmetric', 'edge', 'constant'])
+@pytest.mark.parametrize('operation', ['xup', 'xdn', 'ddxup', 'ddxdn'])
+def test_do(operation, pad_mode):
+    """
+    Tests that stagger.do handles the boundaries like np.pad, and keeps the dtype and memory layout of var.
+    """
+    rng = np.random.default_rng(0)
+    var = rng.random((10, 9, 8))
+    diff = rng.random(10) if operation.startswith('dd') else None
+    expect = _reference(var, operation, diff=diff, pad_mode=pad_mode)
+    assert np.allclose(stagger.do(var, operation, diff=diff, pad_mode=pad_mode), expect)
+    var32 = np.asfortranarray(var, dtype='float32')
+    result = stagger.do(var32, operation, diff=diff, pad_mode=pad_mode)
+    assert result.dtype == np.float32 and result.flags.f_contiguous
+    assert np.allclose(result, expect, rtol=1e-5, atol=1e-5)
+    out = np.zeros_like(var32)
+    assert stagger.do(var32, operation, diff=diff, pad_mode=pad_mode, out=out) is out
+    assert np.array_equal(out, result)
+
+
+@pytest.mark.parametrize('stagger_kind', stagger.VALID_STAGGER_KINDS)
+def test_chain(stagger_kind):
+    """
+    Tests that chained stagger operations (done in one pass, when possible) match doing them one at a time.
+    """
+    var = np.random.default_rng(0).random((10, 9, 8)).astype('float32')
+    dz = np.full(8, 2.0)
+    kw = dict(stagger_kind=stagger_kind)
+    expect = stagger._xup(stagger._ydn(stagger._ddzup(var, diff=dz, **kw), **kw), **kw)
+    result = stagger.xup.ydn.ddzup(var, diffz=dz, **kw)
+    assert result.dtype == np.float32
+    assert np.allclose(result, expect, rtol=1e-5, atol=1e-5)
+    out = np.empty_like(var)
+    assert stagger.xup.ydn.ddzup(var, diffz=dz, out=out, **kw) is out
+    assert np.array_equal(out, result)
+    # operations along the same axis can't be done in one pass.
+    expect = stagger._xup(stagger._ydn(stagger._xup(var, **kw), **kw), **kw)
+    assert np.array_equal(stagger.do_chain(var, ['xup', 'ydn', 'xup'], **kw), expect)
+    # mesh location tracking
+    result = stagger.do_chain(stagger.ArrayOnMesh(var), ['xup', 'ddzdn'], diffs=dict(z=dz), **kw)
+    assert result.meshloc == [0.5, 0, -0.5]
+
+
+@pytest.mark.parametrize('stagger_kind', stagger.VALID_STAGGER_KINDS)
+def test_deriv_sum(stagger_kind):
+    """
+    Tests that deriv_sum matches the sum of derivatives taken one at a time.
+    """
+    rng = np.random.default_rng(0)
+    vx, vy, vz = (rng.random((10, 9, 8)).astype('float32') for _ in range(3))
+    diffs = dict(x=rng.random(10), y=rng.random(9), z=rng.random(8))
+    kw = dict(stagger_kind=stagger_kind)
+    result = stagger.deriv_sum([(vz, 'ddydn', 1), (vy, 'ddzdn', -1)], diffs=diffs, **kw)
+    expect = stagger.do(vz, 'ddydn', diff=diffs['y'], **kw) - stagger.do(vy, 'ddzdn', diff=diffs['z'], **kw)
+    assert result.dtype == np.float32
+    assert np.allclose(result, expect, rtol=1e-5, atol=1e-5)
+    terms = [(vx, 'ddxup', 1), (vy, 'ddyup', 1), (vz, 'ddzup', 1)]
+    expect = sum(stagger.do(v, op, diff=diffs[op[2]], **kw) for v, op, _ in terms)
+    assert np.allclose(stagger.deriv_sum(terms, diffs=diffs, **kw), expect, rtol=1e-5, atol=1e-5)
+    with pytest.raises(ValueError):
+        stagger.deriv_sum([(vx, 'ddxup', 1), (vy, 'ddxdn', 1)], diffs=diffs)
+
+
+def test_warmup():
+    """
+    Tests that warmup compiles the stagger functions, which then match the result of stagger.do.
+    """
+    result = stagger.warmup(dtypes=('float32',), layouts=('F',), verbose=False)
+    assert len(result) == 5
+    assert all(info['status'] in ('compiled', 'cached', 'ready') for info in result)
+    result = stagger.warmup(dtypes=('float32',), layouts=('F', 'C'), verbose=False)
+    assert all(info['status'] == 'ready' for info in result)
+    var = np.random.default_rng(0).random((10, 9, 8)).astype('float32')
+    dz = np.full(8, 2.0)
+    assert np.allclose(stagger.do(var, 'ddzup', diff=dz), 2 * stagger.do(var, 'ddzup', diff=dz / 2))
+
+
+@pytest.mark.parametrize('stagger_kind', stagger.VALID_STAGGER_KINDS)
+@pytest.mark.parametrize('order', ['F', 'C'])
+def test_backends(stagger_kind, order):
+    """
+    Tests that the numpy backend gives the same results as the numba backend,
+    and that 'auto' picks one of them.
+    """
+    rng = np.random.default_rng(0)
+    var = np.array(rng.random((10, 9, 8)), dtype='float32', order=order)
+    diffs = dict(x=rng.random(10), y=rng.random(9), z=rng.random(8))
+    kw = dict(stagger_kind=stagger_kind)
+    for pad_mode in ('wrap', 'reflect', 'constant'):
+        for operation in ('xup', 'ydn', 'ddzup'):
+            diff = diffs[operation[-3]] if operation.startswith('dd') else None
+            expect = stagger.do(var, operation, diff=diff, pad_mode=pad_mode, backend='numba', **kw)
+            result = stagger.do(var, operation, diff=diff, pad_mode=pad_mode, backend='numpy', **kw)
+            assert np.array_equal(result, expect)
+    for operations in (['xup', 'ydn', 'ddzup'], ['zdn', 'yup']):
+        expect = stagger.do_chain(var, operations, diffs=diffs, backend='numba', **kw)
+        assert np.array_equal(stagger.do_chain(var, operations, diffs=diffs, backend='numpy', **kw), expect)
+    terms = [(var, 'ddxup', 1), (2 * var, 'ddydn', -1), (var + 1, 'ddzdn', 1)]
+    expect = stagger.deriv_sum(terms, diffs=diffs, backend='numba', **kw)
+    assert np.array_equal(stagger.deriv_sum(terms, diffs=diffs, backend='numpy', **kw), expect)
+    assert np.array_equal(stagger.deriv_sum(terms, diffs=diffs, backend='auto', **kw), expect)
+    assert set(stagger._AUTO_BACKENDS.values()) <= {'numba', 'numpy'}
+    with pytest.raises(ValueError):
+        stagger.do(var, 'xup', backend='cython')
+
+
+def test_auto_backend_key(monkeypatch):
+    """
+    Tests that backend='auto' times the backends once per size class,
+    and remembers a bounded number of choices.
+    """
+    monkeypatch.setattr(stagger, '_AUTO_BACKENDS', dict())
+    monkeypatch.setattr(stagger, 'AUTO_BACKENDS_MAX', 2)
+    timed = []
+    time_backends = stagger._time_backends
+    monkeypatch.setattr(stagger, '_time_backends',
+                        lambda func, args: timed.append(args) or time_backends(func, args))
+    for nz in range(8, 12):   # 720 to 990 elements; all in the same size class.
+        stagger.do(np.ones((10, 9, nz), dtype='float32', order='F'), 'xup', backend='auto')
+    assert len(timed) == 1
+    for n in (6, 16, 32):
+        stagger.do(np.ones((n, n, n), dtype='float32', order='F'), 'xup', backend='auto')
+    assert len(timed) == 4 and len(stagger._AUTO_BACKENDS) == 2
@@ -1,14 +1,19 @@
 # import built-in modules
 import os
+import sys
+import time
 import fnmatch
+import weakref
 import warnings
 import functools
+import importlib
+import threading
+import contextlib
 import collections
+import concurrent.futures
 
 # import external public modules
 import numpy as np
-from astropy.io import fits
-from scipy import interpolate, ndimage
 
 ''' --------------------------- defaults --------------------------- '''
 
@@ -615,6 +620,257 @@ class ImportFailed():
         raise ImportFailedError(self.modulename + str_add)
 
 
+class LazyModule():
+    '''module which is only imported when one of its attributes is first accessed.
+    Use this for heavy modules which are not needed by every (e.g. short-lived) python process.
+
+    Example:
+    interpolate = LazyModule('scipy.interpolate')   # doesn't import scipy.interpolate yet.
+    interpolate.interp1d(...)   # imports scipy.interpolate, then uses scipy.interpolate.interp1d.
+
+    if the import fails, raises ImportFailedError with additional_error_message.
+    '''
+
+    def __init__(self, modulename, additional_error_message=''):
+        self._lazy_modulename = modulename
+        self._lazy_additional_error_message = additional_error_message
+        self._lazy_module = None
+
+    def _lazy_load(self):
+        '''imports the module (if it hasn't been imported yet). returns the module.'''
+        if self._lazy_module is None:
+            try:
+                self._lazy_module = importlib.import_module(self._lazy_modulename)
+            except ImportError:
+                self._lazy_module = ImportFailed(self._lazy_modulename, self._lazy_additional_error_message)
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        if attr.startswith('_lazy_'):
+            raise AttributeError(attr)
+        return getattr(self._lazy_load(), attr)
+
+    def __repr__(self):
+        status = 'not imported yet' if self._lazy_module is None else repr(self._lazy_module)
+        return '<{} {} ({})>'.format(type(self).__name__, repr(self._lazy_modulename), status)
+
+
+def lazy_import(modulename, additional_error_message=''):
+    '''returns the module modulename if it was already imported, else LazyModule(modulename).'''
+    module = sys.modules.get(modulename, None)
+    if module is not None:
+        return module
+    return LazyModule(modulename, additional_error_message)
+
+
+class LazyNjit():
+    '''like numba.njit(**kw__njit)(f), but numba is not imported until the first call to any LazyNjit.
+
+    Numba is slow to import, and many python processes never use a numba function.
+    On the first call to any LazyNjit function from a module, all the LazyNjit functions in that module
+    are replaced (in the module's globals) by their numba versions, so that they can call each other.
+    Also, if the module's global 'prange' is the builtin range, it is replaced by numba.prange.
+    (Numba compiles each function the first time it is called with new argument types, as usual.)
+
+    if numba is not installed, calling the function raises ImportFailedError.
+    '''
+
+    def __init__(self, f, **kw__njit):
+        functools.update_wrapper(self, f)
+        self.py_func = f
+        self.kw__njit = kw__njit
+        self.dispatcher = None
+
+    def compile(self):
+        '''returns the numba dispatcher for self.
+        Replaces all LazyNjit in the module of self by dispatchers.
+        '''
+        if self.dispatcher is None:
+            numba = lazy_import('numba', "This module is required to use stagger backend='numba'.")
+            module_globals = self.py_func.__globals__
+            if module_globals.get('prange', None) is range:
+                module_globals['prange'] = numba.prange
+            for name, val in list(module_globals.items()):
+                if isinstance(val, LazyNjit):
+                    if val.dispatcher is None:
+                        val.dispatcher = numba.njit(**val.kw__njit)(val.py_func)
+                    module_globals[name] = val.dispatcher
+        return self.dispatcher
+
+    def __call__(self, *args, **kwargs):
+        return self.compile()(*args, **kwargs)
+
+
+def lazy_njit(*args, **kw__njit):
+    '''decorator; like numba.njit, but doesn't import numba until the first call. See LazyNjit for details.
+    Use as @lazy_njit or @lazy_njit(parallel=True).
+    '''
+    if len(args) == 1 and callable(args[0]) and len(kw__njit) == 0:
+        return LazyNjit(args[0])
+
+    def lazy_njit_wrapper(f):
+        return LazyNjit(f, **kw__njit)
+    return lazy_njit_wrapper
+
+
+def numba_warmup(f, *args, **kwargs):
+    '''calls numba function f(*args, **kwargs) twice, so that f is compiled for the types of these args.
+    f: numba dispatcher, or LazyNjit.
+
+    returns dict with info about the call:
+        'status': 'compiled' --> compiled f for these types.
+                  'cached' --> loaded compiled f from numba's on-disk cache (see cache=True in numba.njit).
+                  'ready' --> f was already compiled for these types, in this python session.
+        'compile_time': time [seconds] spent compiling (or loading from cache),
+                        i.e. the extra time for the first call.
+        'run_time': time [seconds] for the second call.
+    '''
+    dispatcher = f.compile() if isinstance(f, LazyNjit) else f
+    nsignatures = len(dispatcher.signatures)
+    cache_hits = sum(dispatcher.stats.cache_hits.values())
+    now = time.perf_counter()
+    dispatcher(*args, **kwargs)
+    first_time = time.perf_counter() - now
+    now = time.perf_counter()
+    dispatcher(*args, **kwargs)
+    run_time = time.perf_counter() - now
+    if len(dispatcher.signatures) == nsignatures:
+        status = 'ready'
+    elif sum(dispatcher.stats.cache_hits.values()) > cache_hits:
+        status = 'cached'
+    else:
+        status = 'compiled'
+    return dict(status=status, compile_time=max(0, first_time - run_time), run_time=run_time)
+
+
+''' --------------------------- parallelism --------------------------- '''
+
+# .num_threads: limit from the innermost parallelism() block, in each thread.
+_PARALLELISM = threading.local()
+_THREAD_POOLS = weakref.WeakKeyDictionary()   # {obj: (numThreads, ThreadPoolExecutor)}. see thread_pool.
+
+
+@contextlib.contextmanager
+def parallelism(num_threads):
+    '''context manager; inside it, (the current thread of) python uses at most num_threads threads for
+    parallel code: numba functions (see stagger._call_kernel) and scipy.fft (use get_num_threads for workers).
+    num_threads None --> no limit (numba and scipy.fft use their own defaults).
+    Nested blocks can only lower the limit.
+    E.g. inside parallelism(1), parallelism(8) still allows only 1 thread.
+    '''
+    old = getattr(_PARALLELISM, 'num_threads', None)
+    _PARALLELISM.num_threads = get_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        _PARALLELISM.num_threads = old
+
+
+def get_num_threads(num_threads=None):
+    '''returns the smaller of num_threads and the limit from the innermost parallelism() block.
+    (the innermost block in this thread.)
+    None means no limit; returns None if neither is set.
+    '''
+    limits = [n for n in (num_threads, getattr(_PARALLELISM, 'num_threads', None)) if n is not None]
+    return min(limits) if limits else None
+
+
+def obj_num_threads(obj):
+    '''returns the parallelism setting of obj: obj.numThreads if it is more than 1, else None.
+    (numThreads = 1 (the default) --> don't use a thread pool,
+    and let numba and scipy.fft use their defaults.)
+    '''
+    num_threads = getattr(obj, 'numThreads', 1)
+    return num_threads if (num_threads is not None) and (num_threads > 1) else None
+
+
+def thread_pool(obj):
+    '''returns the thread pool of obj: a ThreadPoolExecutor with obj.numThreads workers.
+    The pool is made on the first call, and reused afterwards (unless obj.numThreads changes).
+    It is shut down when obj is deleted.
+    '''
+    num_threads = max(1, getattr(obj, 'numThreads', 1))
+    n, pool = _THREAD_POOLS.get(obj, (None, None))
+    if n != num_threads:
+        if pool is not None:
+            pool.shutdown(wait=False)
+        _start_numba_threads()
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix='helita')
+        weakref.finalize(obj, pool.shutdown, wait=False)
+        _THREAD_POOLS[obj] = (num_threads, pool)
+    return pool
+
+
+def _start_numba_threads():
+    '''starts the threading layer of numba (if numba is installed), in the current thread.
+    Do this before numba functions are used in other threads; if numba's threading layer is first started
+    in a worker thread, python may hang on exit (e.g. with the 'tbb' threading layer).
+    '''
+    try:
+        importlib.import_module('numba').get_num_threads()
+    except (ImportError, ValueError):   # (ValueError --> no threading layer could be loaded.)
+        pass
+
+
+def map_slabs(obj, task, *args, axis=2, nslabs=None, out=None, dtype=None):
+    '''returns task(*args), computed in slabs along axis (z by default), in parallel using thread_pool(obj).
+    task: function of args and out, which puts the result at each point of a slab into out.
+        called as task(*slab of each arg, out=slab of out). should write into out (and may return it).
+        if it returns some other array instead, that array is copied into out.
+    args: arrays with ndim 3 are split into slabs along axis (as views; nothing is copied).
+        Other args are passed to task as is.
+    nslabs: None or int. number of slabs. None --> obj.numThreads.
+    out: None or array. if provided, put the result here.
+        Otherwise, make a new array, with the shape and memory layout of the first 3D array in args.
+    dtype: None or dtype. dtype of the new array, if out is None.
+        None --> np.result_type of the 3D arrays in args (or float64, if that is not a float or complex).
+
+    Each slab of out is passed directly to task, so the slabs are never concatenated or copied.
+    In each slab, numba and scipy.fft use 1 thread (see parallelism),
+    so there are at most nslabs threads working.
+    '''
+    arrays = [arg for arg in args if np.ndim(arg) == 3]
+    if len(arrays) == 0:
+        raise ValueError('map_slabs requires at least one 3D array in args')
+    shape = np.shape(arrays[0])
+    if out is None:
+        if dtype is None:
+            dtype = np.result_type(*arrays)
+            if not np.issubdtype(dtype, np.inexact):
+                dtype = np.float64
+        out = np.empty(shape, dtype=dtype, order='F' if np.isfortran(arrays[0]) else 'C')
+    elif np.shape(out) != shape:
+        raise ValueError(f"out must have the same shape as the 3D args, but got {np.shape(out)} and {shape}")
+    n = shape[axis]
+    pool = thread_pool(obj)
+    nslabs = max(1, getattr(obj, 'numThreads', 1)) if nslabs is None else nslabs
+    bounds = np.linspace(0, n, max(1, min(nslabs, n)) + 1).astype(int)
+
+    def slab(arg, start, stop):
+        if np.ndim(arg) != 3:
+            return arg
+        index = [slice(None)] * 3
+        index[axis] = slice(start, stop)
+        return arg[tuple(index)]
+
+    def slab_task(start, stop):
+        out_slab = slab(out, start, stop)
+        with parallelism(1):
+            result = task(*[slab(arg, start, stop) for arg in args], out=out_slab)
+        if (result is not None) and not np.may_share_memory(result, out_slab):
+            out_slab[...] = result
+    futures = [pool.submit(slab_task, start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+    for future in futures:
+        future.result()
+    return out
+
+
+# heavy modules used by some functions in this file; imported only when first used.
+fits = lazy_import('astropy.io.fits')
+interpolate = lazy_import('scipy.interpolate')
+ndimage = lazy_import('scipy.ndimage')
+
+
 def boring_decorator(*args, **kw):
     '''returns the identity wrapper (returns the function it wraps, without any changes).
     This is useful when importing function wrappers; use boring_decorator if ImportError occurs.